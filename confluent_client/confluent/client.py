@@ -19,6 +19,11 @@ try:
     import anydbm as dbm
 except ImportError:
     import dbm
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import collections
 import csv
 import errno
 import fnmatch
@@ -28,6 +33,7 @@ import shlex
 import socket
 import ssl
 import sys
+import threading
 import confluent.tlvdata as tlvdata
 import confluent.sortutil as sortutil
 
@@ -348,6 +354,18 @@ class Command(object):
             raise Exception('Unauthenticated')
         return send_request('delete', path, self.connection, parameters)
 
+    def pipeline(self, requests, window=16):
+        """Issue several requests without waiting on each one in turn
+
+        requests is an iterable of (operation, path, parameters) tuples.
+        Yields (index, result) for every result, in the order requested.
+        """
+        if not self.authenticated:
+            raise Exception('Unauthenticated')
+        return pipeline_requests(
+            ((idx,) + tuple(request) for idx, request in enumerate(requests)),
+            self.connection, window)
+
     def _connect_unix(self):
         self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self.connection.setsockopt(socket.SOL_SOCKET, SO_PASSCRED, 1)
@@ -436,6 +454,134 @@ def send_request(operation, path, server, parameters=None):
         result = tlvdata.recv(server)
 
 
+def pipeline_requests(requests, server, window=16):
+    """Send requests ahead of their responses over one connection
+
+    The server services a connection's requests in order, so the results
+    come back in the same order, each run of them ending in _requestdone.
+    At most window requests are outstanding, so neither end stalls on a
+    full socket buffer.
+
+    :param requests: Iterable of (key, operation, path, parameters)
+    :param server: The socket to send data over
+    :param window: The most requests to have outstanding at once
+    """
+    requests = iter(requests)
+    pending = collections.deque()
+
+    def send_next():
+        for key, operation, path, parameters in requests:
+            payload = {'operation': operation, 'path': path}
+            if parameters is not None:
+                payload['parameters'] = parameters
+            tlvdata.send(server, payload)
+            pending.append(key)
+            return
+
+    for _ in range(window):
+        send_next()
+    try:
+        while pending:
+            result = tlvdata.recv(server)
+            if '_requestdone' in result:
+                pending.popleft()
+                send_next()
+                continue
+            yield pending[0], result
+    except GeneratorExit:
+        # leave the connection ready for whatever is asked of it next
+        while pending:
+            if '_requestdone' in tlvdata.recv(server):
+                pending.popleft()
+        raise
+
+
+class CommandPool(object):
+    """Several sessions, to one or more confluent servers
+
+    Requests are spread over the sessions, and pipelined within each, with
+    results merged as they arrive.  Giving each collective member as a
+    server spreads the work over the collective.
+    """
+    def __init__(self, servers=None, size=None):
+        if not servers:
+            servers = [None]
+        if not size:
+            size = len(servers)
+        self.commands = []
+        for idx in range(size):
+            self.commands.append(Command(servers[idx % len(servers)]))
+
+    @property
+    def authenticated(self):
+        return all([x.authenticated for x in self.commands])
+
+    def authenticate(self, username, password):
+        for command in self.commands:
+            command.authenticate(username, password)
+
+    def _run_requests(self, command, requests, window, results, stop):
+        pipeline = pipeline_requests(requests, command.connection, window)
+        try:
+            for result in pipeline:
+                if stop.is_set():
+                    break
+                results.put(result)
+            # reads the rest of anything outstanding if stopped early
+            pipeline.close()
+        except Exception as e:
+            results.put(e)
+        results.put(None)
+
+    def request_many(self, requests, window=16):
+        """Issue requests across the sessions of the pool
+
+        requests is an iterable of (operation, path, parameters) tuples.
+        Yields (index, result) as results arrive.  Results of any one
+        request stay in order, but those of different requests may
+        interleave.  This blocks only while waiting for the next result,
+        so it can be driven from an executor of an asyncio loop.  On an
+        error, or if the caller stops early, no further requests are sent
+        and this returns once each session has finished what it had
+        outstanding.
+        """
+        if not self.authenticated:
+            raise Exception('Unauthenticated')
+        shares = [[] for _ in self.commands]
+        for idx, request in enumerate(requests):
+            shares[idx % len(shares)].append((idx,) + tuple(request))
+        results = queue.Queue()
+        stop = threading.Event()
+        workers = []
+        for command, share in zip(self.commands, shares):
+            if not share:
+                continue
+            worker = threading.Thread(
+                target=self._run_requests,
+                args=(command, share, window, results, stop))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        running = len(workers)
+        try:
+            while running:
+                result = results.get()
+                if result is None:
+                    running -= 1
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    yield result
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+    def read_many(self, paths, parameters=None, window=16):
+        return self.request_many(
+            [('retrieve', path, parameters) for path in paths], window)
+
+
 def attrrequested(attr, attrlist, seenattributes, node=None):
     for candidate in attrlist:
         truename = candidate
@@ -0,0 +1,222 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2026 Lenovo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This runs a local command per node, as used by noderun and nodeshell.
+# Output of every running command is multiplexed through one epoll (or poll)
+# object, and each readiness is serviced with a single read rather than
+# rechecking each pipe with select.
+
+import collections
+import errno
+import os
+import select
+import subprocess
+import time
+
+ExecEvent = collections.namedtuple('ExecEvent',
+                                   ['node', 'kind', 'data', 'time'])
+
+
+class _Poller(object):
+    # epoll where available, poll otherwise, neither with an FD_SETSIZE limit
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._scale = 1
+            self.readmask = select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR
+        else:
+            self._poller = select.poll()
+            self._scale = 1000
+            self.readmask = select.POLLIN | select.POLLHUP | select.POLLERR
+
+    def register(self, fd):
+        self._poller.register(fd, self.readmask)
+
+    def unregister(self, fd):
+        self._poller.unregister(fd)
+
+    def poll(self, timeout):
+        while True:
+            try:
+                return self._poller.poll(timeout * self._scale)
+            except (IOError, OSError, select.error) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def close(self):
+        if hasattr(self._poller, 'close'):
+            self._poller.close()
+
+
+class NodeExecutor(object):
+    """Run a command for each of many nodes
+
+    Commands are started as earlier ones finish, up to concurrency at a
+    time.  run() yields the ExecEvents of each pass through the poller as a
+    list.  Event kinds are 'stdout' and 'stderr' with a line of output (or
+    a chunk of output if chunked), 'exit' with the exit code, and 'error'
+    with a message if the command could not be started.
+
+    :param concurrency: Maximum number of commands to run at a time
+    :param rate: If given, maximum number of commands to start per second
+    :param loadlimit: If given, reduce concurrency while the one minute load
+                      average is above this, growing it back as the load
+                      falls according to how fast commands are completing
+    :param chunked: Yield output as read rather than as complete lines
+    """
+    maxline = 65536
+
+    def __init__(self, concurrency=168, rate=None, loadlimit=None,
+                 chunked=False):
+        self.concurrency = concurrency
+        self.limit = concurrency
+        self.rate = rate
+        self.loadlimit = loadlimit
+        self.chunked = chunked
+        self.pending = collections.deque()
+        self.running = 0
+        self.exitcode = 0
+        self._pipes = {}
+        self._poller = None
+        self._nextstart = 0
+        self._nextadjust = 0
+        self._completed = 0
+        self._devnull = None
+
+    def add(self, node, cmdv):
+        self.pending.append((node, cmdv))
+
+    def _start(self, events):
+        node, cmdv = self.pending.popleft()
+        try:
+            proc = subprocess.Popen(
+                cmdv, stdin=self._devnull, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                events.append(ExecEvent(
+                    node, 'error',
+                    'Unable to find local executable file "{0}"'.format(
+                        cmdv[0]), time.time()))
+                return
+            raise
+        desc = {'node': node, 'popen': proc, 'open': 2}
+        for kind, pipe in (('stdout', proc.stdout), ('stderr', proc.stderr)):
+            fd = pipe.fileno()
+            self._pipes[fd] = (desc, kind, pipe, [b''])
+            self._poller.register(fd)
+        self.running += 1
+
+    def _start_pending(self, events, now):
+        while self.pending and self.running < self.limit:
+            if self.rate:
+                if now < self._nextstart:
+                    return
+                self._nextstart = max(self._nextstart, now - 1) + (
+                    1.0 / self.rate)
+            self._start(events)
+
+    def _adjust(self, now):
+        # Back off while the load is high, then grow back in proportion to
+        # how quickly commands are finishing
+        if now < self._nextadjust:
+            return
+        self._nextadjust = now + 1
+        completed = self._completed
+        self._completed = 0
+        if not self.loadlimit:
+            return
+        if os.getloadavg()[0] > self.loadlimit:
+            self.limit = max(1, min(self.limit, self.running) * 3 // 4)
+        else:
+            self.limit = min(self.concurrency,
+                             self.limit + max(1, completed))
+
+    def _read(self, fd, events, now):
+        desc, kind, pipe, partial = self._pipes[fd]
+        node = desc['node']
+        data = os.read(fd, 65536)
+        if data:
+            if self.chunked:
+                events.append(ExecEvent(node, kind, data, now))
+                return
+            data = partial[0] + data
+            lines = data.split(b'\n')
+            partial[0] = lines.pop()
+            for line in lines:
+                events.append(ExecEvent(node, kind, line + b'\n', now))
+            if len(partial[0]) >= self.maxline:
+                events.append(ExecEvent(node, kind, partial[0], now))
+                partial[0] = b''
+            return
+        if partial[0]:
+            events.append(ExecEvent(node, kind, partial[0], now))
+        self._poller.unregister(fd)
+        del self._pipes[fd]
+        pipe.close()
+        desc['open'] -= 1
+        if desc['open']:
+            return
+        ret = desc['popen'].wait()
+        self.exitcode |= ret
+        self.running -= 1
+        self._completed += 1
+        events.append(ExecEvent(node, 'exit', ret, now))
+
+    def run(self):
+        self._devnull = open(os.devnull, 'rb')
+        self._poller = _Poller()
+        try:
+            while self.pending or self.running:
+                events = []
+                now = time.time()
+                self._adjust(now)
+                self._start_pending(events, now)
+                if events:
+                    yield events
+                    events = []
+                if not self.running:
+                    if self.pending:
+                        time.sleep(max(self._nextstart - now, 0.01))
+                    continue
+                timeout = 10
+                if self.pending:
+                    timeout = 1
+                    if self.rate and self.running < self.limit:
+                        timeout = min(max(self._nextstart - now, 0), 1)
+                ready = self._poller.poll(timeout)
+                now = time.time()
+                for fd, _ in ready:
+                    self._read(fd, events, now)
+                if events:
+                    yield events
+        finally:
+            self._poller.close()
+            self._devnull.close()
+
+
+def event_record(event):
+    """Describe an ExecEvent as a dict, suitable for a line of JSON"""
+    record = {'node': event.node, 'time': event.time}
+    if event.kind in ('stdout', 'stderr'):
+        data = event.data
+        if not isinstance(data, str):
+            data = data.decode('utf-8', 'replace')
+        record['stream'] = event.kind
+        record['data'] = data
+    else:
+        record[event.kind] = event.data
+    return record
@@ -13,8 +13,10 @@
 # limitations under the License.
 
 import difflib
+import hashlib
 import re
 import sys
+import tempfile
 
 try:
     range = xrange
@@ -87,32 +89,107 @@ def colordiff(first, second):
 
 
 
+class OutputState(object):
+    '''A line of output, following the output that came before it
+
+    Nodes whose output is the same so far share the same state, so each
+    distinct output is held once no matter how many nodes produce it.
+    '''
+    __slots__ = ('parent', 'line', 'child', 'children')
+
+    def __init__(self, parent=None, line=None):
+        self.parent = parent
+        self.line = line
+        self.child = None
+        self.children = None
+
+    def advance(self, line):
+        if self.child is not None and self.child.line == line:
+            return self.child
+        if self.children is not None and line in self.children:
+            return self.children[line]
+        nextstate = OutputState(self, line)
+        if self.child is None:
+            self.child = nextstate
+        else:
+            if self.children is None:
+                self.children = {}
+            self.children[line] = nextstate
+        return nextstate
+
+    def get_lines(self):
+        lines = []
+        state = self
+        while state.parent is not None:
+            lines.append(state.line)
+            state = state.parent
+        lines.reverse()
+        return lines
+
+
 class GroupedData(object):
     '''A post processor to sort and compare per-node data
 
     :param confluentconnection: If given, will attempt to use the connection to abbreviate noderanges
+    :param spill: If true, keep output in a temporary file rather than
+                  memory, reading back one node of each distinct output
+                  when grouping
     '''
 
-    def __init__(self, confluentconnection=None):
+    def __init__(self, confluentconnection=None, spill=False):
         self.bynode = {}
         self.byoutput = {}
         self.header = {}
         self.client = confluentconnection
+        self.spillfile = None
+        if spill:
+            self.spillfile = tempfile.TemporaryFile()
+        self.rootstate = OutputState()
 
     def generate_byoutput(self):
         self.byoutput = {}
+        nodesbykey = {}
         for n in self.bynode:
-            output = '\n'.join(self.bynode[n])
-            if output not in self.byoutput:
-                self.byoutput[output] = set([n])
+            if self.spillfile:
+                outkey = self.bynode[n].digest()
+            else:
+                outkey = self.bynode[n]
+            if outkey not in nodesbykey:
+                nodesbykey[outkey] = set([n])
             else:
-                self.byoutput[output].add(n)
+                nodesbykey[outkey].add(n)
+        if self.spillfile:
+            outputs = self._read_spilled(nodesbykey)
+        else:
+            outputs = dict((x, x.get_lines()) for x in nodesbykey)
+        for outkey in nodesbykey:
+            self.byoutput['\n'.join(outputs[outkey])] = nodesbykey[outkey]
+
+    def _read_spilled(self, nodesbykey):
+        # only one node of each output needs to be read back
+        keybynode = {}
+        for outkey in nodesbykey:
+            keybynode[next(iter(nodesbykey[outkey]))] = outkey
+        outputs = dict((x, []) for x in nodesbykey)
+        self.spillfile.flush()
+        self.spillfile.seek(0)
+        for record in self.spillfile:
+            node, _, line = record.decode('utf8').partition('\x00')
+            if node in keybynode:
+                outputs[keybynode[node]].append(line[:-1])
+        self.spillfile.seek(0, 2)
+        return outputs
 
     def add_line(self, node, line):
-        if node not in self.bynode:
-            self.bynode[node] = [line]
+        if self.spillfile:
+            record = u'{0}\n'.format(line).encode('utf8')
+            self.spillfile.write(node.encode('utf8') + b'\x00' + record)
+            if node not in self.bynode:
+                self.bynode[node] = hashlib.sha256()
+            self.bynode[node].update(record)
         else:
-            self.bynode[node].append(line)
+            self.bynode[node] = self.bynode.get(
+                node, self.rootstate).advance(line)
 
     def get_group_text(self, nodes):
         if self.client:
@@ -172,6 +249,7 @@ class GroupedData(object):
                        count=False, basenode=None):
         self.generate_byoutput()
         modaloutput = None
+        modallines = None
         ismodal = True
         revoutput = []
         if basenode:
@@ -202,7 +280,9 @@ class GroupedData(object):
                 ismodal = False
                 currout += outdata
             else:
-                currout += '\n'.join(colordiff(modaloutput.split('\n'),
+                if modallines is None:
+                    modallines = modaloutput.split('\n')
+                currout += '\n'.join(colordiff(modallines,
                                                  outdata.split('\n')))
             currout += '\n\n'
             if reverse:
@@ -215,7 +295,8 @@ class GroupedData(object):
 
 if __name__ == '__main__':
     groupoutput = GroupedData()
-    for line in sys.stdin.read().split('\n'):
+    for line in sys.stdin:
+        line = line.rstrip('\n')
         if not line:
             continue
         groupoutput.add_line(*line.split(': ', 1))
@@ -30,6 +30,7 @@ import eventlet.green.threading as threading
 import confluent.sortutil as sortutil
 import greenlet
 import random
+import struct
 import time
 import sys
 try:
@@ -87,7 +88,9 @@ def connect_to_leader(cert=None, name=None, leader=None, remote=None):
                 name = get_myname()
             tlvdata.send(remote, {'collective': {'operation': 'connect',
                                                  'name': name,
-                                                 'txcount': cfm._txcount}})
+                                                 'txcount': cfm._txcount,
+                                                 'txepoch': cfm.get_txepoch(),
+                                                 'dbchunks': True}})
             keydata = tlvdata.recv(remote)
             if not keydata:
                 return False
@@ -129,34 +132,59 @@ def connect_to_leader(cert=None, name=None, leader=None, remote=None):
             colldata = tlvdata.recv(remote)
             globaldata = tlvdata.recv(remote)
             dbi = tlvdata.recv(remote)
-            dbsize = dbi['dbsize']
-            dbjson = b''
-            while (len(dbjson) < dbsize):
-                ndata = remote.recv(dbsize - len(dbjson))
-                if not ndata:
-                    try:
-                        remote.close()
-                    except Exception:
-                        pass
-                    raise Exception("Error doing initial DB transfer")
-                dbjson += ndata
-            cfm.clear_configuration()
-            try:
-                cfm._restore_keys(keydata, None, sync=False)
-                for c in colldata:
-                    cfm._true_add_collective_member(c, colldata[c]['address'],
-                                                    colldata[c]['fingerprint'],
-                                                    sync=False)
-                for globvar in globaldata:
-                    cfm.set_global(globvar, globaldata[globvar], False)
-                cfm._txcount = dbi.get('txcount', 0)
-                cfm.ConfigManager(tenant=None)._load_from_json(dbjson,
-                                                               sync=False)
-                cfm.commit_clear()
-            except Exception:
-                cfm.stop_following()
-                cfm.rollback_clear()
-                raise
+            if 'deltas' in dbi:
+                # The leader still has the transactions we missed, apply
+                # those rather than replacing the whole configuration
+                deltas = []
+                for _ in range(dbi['deltas']):
+                    dlen = struct.unpack('!Q', _recv_exact(remote, 8))[0]
+                    deltas.append(_recv_exact(remote, dlen))
+                try:
+                    cfm._restore_keys(keydata, None, sync=False)
+                    for c in colldata:
+                        cfm._true_add_collective_member(
+                            c, colldata[c]['address'],
+                            colldata[c]['fingerprint'], sync=False)
+                    for globvar in globaldata:
+                        cfm.set_global(globvar, globaldata[globvar], False)
+                    for delta in deltas:
+                        cfm.apply_transaction(delta)
+                    cfm._txcount = dbi['txcount']
+                    cfm.set_txepoch(dbi['txepoch'])
+                except Exception:
+                    cfm._new_txepoch()
+                    cfm.stop_following()
+                    raise
+                cfm.ConfigManager.wait_for_sync()
+                log.log({'info': 'Applied {0} transactions from leader '
+                                 '{1}'.format(len(deltas), leader),
+                         'subsystem': 'collective'})
+            else:
+                if 'dbchunks' in dbi:
+                    # Apply the configuration a piece at a time as it
+                    # arrives, rather than as one document
+                    dbjson = _recv_chunks(remote, dbi['dbchunks'])
+                else:
+                    dbjson = (_recv_exact(remote, dbi['dbsize']),)
+                cfm.clear_configuration()
+                try:
+                    cfm._restore_keys(keydata, None, sync=False)
+                    for c in colldata:
+                        cfm._true_add_collective_member(c, colldata[c]['address'],
+                                                        colldata[c]['fingerprint'],
+                                                        sync=False)
+                    for globvar in globaldata:
+                        cfm.set_global(globvar, globaldata[globvar], False)
+                    cfm._txcount = dbi.get('txcount', 0)
+                    cfm.ConfigManager(tenant=None)._load_json_chunks(
+                        dbjson, sync=False)
+                    cfm.commit_clear()
+                except Exception:
+                    cfm.stop_following()
+                    cfm.rollback_clear()
+                    raise
+                if 'txepoch' in dbi:
+                    cfm.set_txepoch(dbi['txepoch'])
             currentleader = leader
         #spawn this as a thread...
         remote.settimeout(90)
@@ -164,6 +192,31 @@ def connect_to_leader(cert=None, name=None, leader=None, remote=None):
     return True
 
 
+def _recv_chunks(remote, count):
+    for _ in range(count):
+        clen = struct.unpack('!Q', _recv_exact(remote, 8))[0]
+        yield _recv_exact(remote, clen)
+
+
+def _recv_exact(remote, size):
+    # receive into one buffer of the final size, rather than concatenating
+    # each read onto what came before.  The whole of a full configuration
+    # transfer is still held and loaded at once.
+    data = bytearray(size)
+    view = memoryview(data)
+    offset = 0
+    while offset < size:
+        nread = remote.recv_into(view[offset:], size - offset)
+        if not nread:
+            try:
+                remote.close()
+            except Exception:
+                pass
+            raise Exception("Error doing initial DB transfer")
+        offset += nread
+    return data
+
+
 def follow_leader(remote, leader):
     global currentleader
     global retrythread
@@ -550,10 +603,35 @@ def handle_connection(connection, cert, request, local=False):
             tlvdata.send(connection, cfm._dump_keys(None, False))
             tlvdata.send(connection, cfm._cfgstore['collective'])
             tlvdata.send(connection, {'confluent_uuid': cfm.get_global('confluent_uuid')}) # cfm.get_globals())
-            cfgdata = cfm.ConfigManager(None)._dump_to_json()
-            tlvdata.send(connection, {'txcount': cfm._txcount,
-                                      'dbsize': len(cfgdata)})
-            connection.sendall(cfgdata)
+            deltas = cfm.get_transactions_since(request.get('txepoch', None),
+                                                request['txcount'])
+            if deltas is not None:
+                tlvdata.send(connection, {'txcount': cfm._txcount,
+                                          'txepoch': cfm.get_txepoch(),
+                                          'deltas': len(deltas)})
+                for delta in deltas:
+                    connection.sendall(struct.pack('!Q', len(delta)) + delta)
+            elif request.get('dbchunks', False):
+                # The member can take the configuration in pieces, send it
+                # that way so neither end holds it as one large document
+                chunks = cfm.ConfigManager(None)._dump_json_chunks()
+                tlvdata.send(connection, {'txcount': cfm._txcount,
+                                          'txepoch': cfm.get_txepoch(),
+                                          'dbchunks': len(chunks)})
+                chunks.reverse()
+                while chunks:
+                    chunk = chunks.pop()
+                    if not isinstance(chunk, bytes):
+                        chunk = chunk.encode('utf-8')
+                    connection.sendall(struct.pack('!Q', len(chunk)) + chunk)
+            else:
+                cfgdata = cfm.ConfigManager(None)._dump_to_json()
+                if not isinstance(cfgdata, bytes):
+                    cfgdata = cfgdata.encode('utf-8')
+                tlvdata.send(connection, {'txcount': cfm._txcount,
+                                          'txepoch': cfm.get_txepoch(),
+                                          'dbsize': len(cfgdata)})
+                connection.sendall(cfgdata)
         #tlvdata.send(connection, {'tenants': 0}) # skip the tenants for now,
         # so far unused anyway
         connection.settimeout(90)
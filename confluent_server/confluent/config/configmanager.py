@@ -59,6 +59,11 @@ except ModuleNotFoundError:
 import ast
 import base64
 from binascii import hexlify
+import collections
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 import confluent.config.attributes as allattributes
 import confluent.config.conf as conf
 import confluent.log
@@ -90,6 +95,7 @@ import struct
 import sys
 import threading
 import traceback
+import zlib
 try:
     unicode
 except NameError:
@@ -111,6 +117,19 @@ _cfgstore = None
 _pendingchangesets = {}
 _txcount = 0
 _hasquorum = True
+# Recently committed collective transactions, allowing a member that
+# rejoins to catch up without a full transfer.  The epoch identifies a
+# history of transactions, and is replaced when a change is made that
+# was not sent to followers
+_txlog = collections.deque()
+_txlogbytes = 0
+_txepoch = None
+_applyingtx = False
+# Sequence numbers of the most recent changes per tenant, allowing data
+# derived from the configuration to be cheaply checked for staleness
+_changeseq = 0
+_changegens = {}
+_cleargen = 0
 
 _attraliases = {
     'bmc': 'hardwaremanagement.manager',
@@ -362,11 +381,83 @@ def exec_on_followers_unconditional(fnname, *args):
     _txcount += 1
     payload = msgpack.packb({'function': fnname, 'args': args,
                              'txcount': _txcount}, use_bin_type=False)
+    _record_transaction(_txcount, payload)
     for _ in pushes.starmap(
             _push_rpc, [(cfgstreams[s], payload) for s in cfgstreams]):
         pass
 
 
+def get_txepoch():
+    if _txepoch is None:
+        _new_txepoch()
+    return _txepoch
+
+
+def set_txepoch(epoch):
+    global _txepoch
+    global _txlogbytes
+    if epoch == _txepoch:
+        return
+    _txepoch = epoch
+    _txlog.clear()
+    _txlogbytes = 0
+
+
+def _new_txepoch():
+    set_txepoch(confluent.util.stringify(base64.b64encode(os.urandom(12))))
+
+
+def _record_transaction(txcount, payload):
+    global _txlogbytes
+    maxtx = conf.get_int_option('collective', 'txlog_size') or 1024
+    maxbytes = conf.get_int_option(
+        'collective', 'txlog_max_bytes') or 67108864
+    _txlog.append((txcount, payload))
+    _txlogbytes += len(payload)
+    while _txlog and (len(_txlog) > maxtx or _txlogbytes > maxbytes):
+        _txlogbytes -= len(_txlog.popleft()[1])
+
+
+def get_transactions_since(epoch, txcount):
+    """Get the transactions a member needs to catch up
+
+    Returns a list of the serialized transactions following txcount, or None
+    if the history is not available and a full transfer is needed.
+
+    :param epoch: The transaction epoch the member last synchronized to
+    :param txcount: The transaction count of the member
+    """
+    if epoch is None or epoch != _txepoch or txcount > _txcount:
+        return None
+    if txcount == _txcount:
+        return []
+    pending = [x for x in _txlog if x[0] > txcount]
+    if not pending or pending[0][0] != txcount + 1:
+        return None
+    for idx in range(1, len(pending)):
+        if pending[idx][0] != pending[idx - 1][0] + 1:
+            return None
+    if pending[-1][0] != _txcount:
+        return None
+    return [x[1] for x in pending]
+
+
+def apply_transaction(payload):
+    """Apply a serialized transaction as received from a leader"""
+    global _txcount
+    global _applyingtx
+    rpc = msgpack.unpackb(payload, raw=False)
+    if not (rpc['function'].startswith('_true') or rpc['function'].startswith('_rpc')):
+        raise Exception("Received unsupported function call: {0}".format(rpc['function']))
+    _applyingtx = True
+    try:
+        globals()[rpc['function']](*rpc['args'])
+    finally:
+        _applyingtx = False
+    _txcount = rpc['txcount']
+    _record_transaction(_txcount, payload)
+
+
 def logException():
     global tracelog
     if tracelog is None:
@@ -570,6 +661,136 @@ def _load_dict_from_dbm(dpath, tdb):
         return
 
 
+# The journal is an append only record of dirty keys, each record being
+# a header of transaction count, payload length and crc32 of the payload,
+# followed by a pickled list of (tenant, category, key, pickledvalue).
+# A pickledvalue of None indicates the key was deleted.  The dbm files serve
+# as the compacted snapshot, and the journal is the tail since that snapshot
+_journalhdr = struct.Struct('!QII')
+_journalpending = {}
+
+
+def _journal_enabled():
+    return (conf.get_option('configdb', 'store') or 'journal') == 'journal'
+
+
+def _journal_maxbytes():
+    return conf.get_int_option('configdb', 'journal_max_bytes') or 16777216
+
+
+def _dbm_path(cfgdir, tenant, category):
+    if tenant is None:
+        return os.path.join(cfgdir, category)
+    return os.path.join(cfgdir, 'tenants', tenant, category)
+
+
+def _apply_journal_entry(tenant, category, key, value):
+    if tenant is None:
+        dpath = ('main', category)
+    else:
+        dpath = ('tenant', tenant, category)
+    currdict = _cfgstore
+    for elem in dpath:
+        if elem not in currdict:
+            currdict[elem] = {}
+        currdict = currdict[elem]
+    if value is None:
+        currdict.pop(key, None)
+    else:
+        currdict[key] = cPickle.loads(value)  # nosec
+
+
+def _replay_journal(cfgdir):
+    # Read back records written since the last compaction.  A record that is
+    # short or fails the checksum is the remnant of a write interrupted by a
+    # crash, it and anything following it are discarded
+    global _txcount
+    jpath = os.path.join(cfgdir, 'journal')
+    try:
+        journal = open(jpath, 'rb+')
+    except IOError:
+        return
+    with journal:
+        goodoffset = 0
+        while True:
+            hdr = journal.read(_journalhdr.size)
+            if len(hdr) < _journalhdr.size:
+                break
+            txcount, plen, crc = _journalhdr.unpack(hdr)
+            payload = journal.read(plen)
+            if len(payload) < plen or zlib.crc32(payload) & 0xffffffff != crc:
+                break
+            for tenant, category, key, value in cPickle.loads(payload):  # nosec
+                _apply_journal_entry(tenant, category, key, value)
+                _journalpending[(tenant, category, key)] = value
+            if txcount > _txcount:
+                _txcount = txcount
+            goodoffset = journal.tell()
+        if goodoffset != os.fstat(journal.fileno()).st_size:
+            journal.truncate(goodoffset)
+
+
+def _compact_journal(cfgdir):
+    # fold the pending journal records into the dbm snapshot, then start a
+    # fresh journal.  Replaying the journal over the new snapshot is
+    # harmless if we were interrupted before the truncate
+    bydbm = {}
+    for tenant, category, key in _journalpending:
+        bydbm.setdefault((tenant, category), []).append(key)
+    for tenant, category in bydbm:
+        dbpath = _dbm_path(cfgdir, tenant, category)
+        _mkpath(os.path.dirname(dbpath))
+        dbf = dbm.open(dbpath, 'c', 384)  # 0600
+        try:
+            for key in bydbm[(tenant, category)]:
+                value = _journalpending[(tenant, category, key)]
+                if value is None:
+                    if key in dbf:
+                        del dbf[key]
+                else:
+                    dbf[key] = value
+        finally:
+            dbf.close()
+    _journalpending.clear()
+    try:
+        with open(os.path.join(cfgdir, 'journal'), 'rb+') as journal:
+            journal.truncate(0)
+    except IOError:
+        pass
+
+
+def _append_journal(cfgdir, currdirt):
+    entries = []
+    for tenant in currdirt:
+        if tenant is None:
+            currdict = _cfgstore['main']
+        else:
+            currdict = _cfgstore['tenant'][tenant]
+        for category in currdirt[tenant]:
+            for key in currdirt[tenant][category]:
+                if key in currdict.get(category, ()):
+                    value = cPickle.dumps(currdict[category][key],
+                                          protocol=cPickle.HIGHEST_PROTOCOL)
+                else:
+                    value = None
+                entries.append((tenant, category, key, value))
+    payload = cPickle.dumps(entries, protocol=cPickle.HIGHEST_PROTOCOL)
+    jpath = os.path.join(cfgdir, 'journal')
+    fd = os.open(jpath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, _journalhdr.pack(
+            _txcount, len(payload), zlib.crc32(payload) & 0xffffffff)
+            + payload)
+        os.fsync(fd)
+        jsize = os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+    for tenant, category, key, value in entries:
+        _journalpending[(tenant, category, key)] = value
+    if jsize > _journal_maxbytes():
+        _compact_journal(cfgdir)
+
+
 def is_tenant(tenant):
     try:
         return tenant in _cfgstore['tenant']
@@ -779,6 +1000,7 @@ def rollback_clear():
     global _oldtxcount
     _txcount = _oldtxcount
     _cfgstore = _oldcfgstore
+    _reset_changes()
     _oldtxcount = 0
     _oldcfgstore = None
     ConfigManager.wait_for_sync(True)
@@ -794,6 +1016,7 @@ def clear_configuration():
     _oldcfgstore = _cfgstore
     _oldtxcount = _txcount
     _cfgstore = {}
+    _reset_changes()
     _txcount = 0
 
 def commit_clear():
@@ -810,7 +1033,9 @@ def commit_clear():
     _oldcfgstore = None
     _oldtxcount = 0
     with _synclock:
-        todelete = ('transactioncount', 'globals', 'collective') + _config_areas
+        _journalpending.clear()
+        todelete = ('transactioncount', 'globals', 'collective', 'journal'
+                    ) + _config_areas
         for cfg in todelete:
             try:
                 os.remove(os.path.join(ConfigManager._cfgdir, cfg))
@@ -839,9 +1064,12 @@ def follow_channel(channel):
                     if not nrpc:
                         raise Exception('Truncated message error')
                     rpc += nrpc
+                rawrpc = rpc
                 rpc = msgpack.unpackb(rpc, raw=False)
                 if 'txcount' in rpc:
                     _txcount = rpc['txcount']
+                    if 'function' in rpc:
+                        _record_transaction(_txcount, rawrpc)
                 if 'newleader' in rpc:
                     return rpc
                 if 'function' in rpc:
@@ -971,6 +1199,9 @@ def get_collective_member_by_address(address):
 
 def _mark_dirtykey(category, key, tenant=None):
     key = confluent.util.stringify(key)
+    if not (cfgstreams or cfgleader or _applyingtx):
+        # a change that followers did not see, start a new history
+        _new_txepoch()
     with _dirtylock:
         if 'dirtykeys' not in _cfgstore:
             _cfgstore['dirtykeys'] = {}
@@ -981,6 +1212,29 @@ def _mark_dirtykey(category, key, tenant=None):
         _cfgstore['dirtykeys'][tenant][category].add(key)
 
 
+def _note_change(tenant, attribs=None):
+    # attribs of None indicates a change of node or group membership
+    global _changeseq
+    _changeseq += 1
+    gens = _changegens.setdefault(tenant, {})
+    if attribs is None:
+        gens[None] = _changeseq
+        return
+    gens['*'] = _changeseq
+    for attrib in attribs:
+        if attrib in ('groups', 'nodes', '_nodedeleted'):
+            gens[None] = _changeseq
+        gens[attrib] = _changeseq
+
+
+def _reset_changes():
+    global _cleargen
+    global _changeseq
+    _changegens.clear()
+    _changeseq += 1
+    _cleargen = _changeseq
+
+
 def _generate_new_id():
     # generate a random id outside the usual ranges used for normal users in
     # /etc/passwd.  Leave an equivalent amount of space near the end disused,
@@ -1142,6 +1396,72 @@ def _decode_attribute(attribute, nodeobj, formatter=None, decrypt=False):
     return nodeobj[attribute]
 
 
+def _cryptkey(cryptvalue):
+    return tuple(cryptvalue)
+
+
+class NodeAttributeRow(Mapping):
+    """Read-only view of the attributes of one node in a NodeAttributeTable
+
+    Behaves like the per-node dictionaries of get_node_attributes, but
+    values are shared with the table and must not be modified.
+    """
+    __slots__ = ('_columns', '_node')
+
+    def __init__(self, columns, node):
+        self._columns = columns
+        self._node = node
+
+    def __getitem__(self, attribute):
+        try:
+            return self._columns[attribute][self._node]
+        except KeyError:
+            raise KeyError(attribute)
+
+    def __iter__(self):
+        for attribute in self._columns:
+            if self._node in self._columns[attribute]:
+                yield attribute
+
+    def __len__(self):
+        return len([x for x in self])
+
+
+class NodeAttributeTable(Mapping):
+    """Columnar, read-only result of get_node_attributes_bulk
+
+    Indexing by node gives a NodeAttributeRow, so existing code expecting
+    the result of get_node_attributes may use it unchanged.  column()
+    gives the node to value mapping of a single attribute.
+    """
+
+    def __init__(self, nodes, columns):
+        self._nodes = nodes
+        self._nodeset = frozenset(nodes)
+        self._columns = columns
+
+    def __getitem__(self, node):
+        if node not in self._nodeset:
+            raise KeyError(node)
+        return NodeAttributeRow(self._columns, node)
+
+    def __contains__(self, node):
+        return node in self._nodeset
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    @property
+    def attributes(self):
+        return list(self._columns)
+
+    def column(self, attribute):
+        return self._columns.get(attribute, {})
+
+
 # my thinking at this point is that noderange and configdata  objects
 # will be constructed and passed as part of a context object to plugins
 # reasoning being that the main program will handle establishing the
@@ -1298,34 +1618,131 @@ class ConfigManager(object):
         if attribute_name_is_invalid(attribute):
             raise ValueError(
                 '{0} is not a valid attribute name'.format(attribute))
+        attrindex = self._get_attrindex()
+        if '*' in attribute or '?' in attribute:
+            attrnames = fnmatch.filter(list(attrindex), attribute)
+            # a glob always considers an unset value in addition to
+            # any matching attributes
+            unsetnodes = None
+        else:
+            attrnames = [attribute] if attribute in attrindex else []
+            unsetnodes = set(self._cfgstore['nodes'])
+            if attrnames:
+                unsetnodes -= set(attrindex[attribute][1])
+        # Evaluate the criteria once per distinct value rather than per node
+        if exmatch:
+            valmatches = lambda x: bool(exmatch.search(x)) == yieldmatches
+        elif yieldmatches:
+            valmatches = lambda x: match == x
+        else:
+            valmatches = lambda x: match != x
+        if valmatches(''):
+            if unsetnodes is None:
+                matched = set(self._cfgstore['nodes'])
+                attrnames = []
+            else:
+                matched = unsetnodes
+        else:
+            matched = set([])
+        for attrname in attrnames:
+            bynode = attrindex[attrname][0]
+            if exmatch is None and yieldmatches:
+                matched |= bynode.get(match, set([]))
+                continue
+            for currval in bynode:
+                if valmatches(currval):
+                    matched |= bynode[currval]
+        if nodes is self._cfgstore['nodes']:
+            for node in matched:
+                yield node
+            return
         for node in nodes:
-            try:
-                currvals = [self._cfgstore['nodes'][node][attribute]['value']]
-            except KeyError:
-                # Let's treat 'not set' as being an empty string for this path
-                currvals = list(
-                    [self._cfgstore['nodes'][node][x].get('value', '') 
-                    for x in fnmatch.filter(self._cfgstore['nodes'][node], attribute)])
-                currvals.append('')
-            for currval in currvals:
-                if exmatch:
-                    if yieldmatches:
-                        if exmatch.search(currval):
-                            yield node
-                            break
-                    else:
-                        if not exmatch.search(currval):
-                            yield node
-                            break
-                else:
-                    if yieldmatches:
-                        if match == currval:
-                            yield node
-                            break
-                    else:
-                        if match != currval:
-                            yield node
-                            break
+            if node in matched:
+                yield node
+
+    def _get_attrindex(self):
+        # Index of attribute name to a tuple of a value to node set map and
+        # a node to value map, built on first use and then maintained by
+        # _update_attrindex as changes come through
+        attrindexes = _cfgstore.setdefault('attrindex', {})
+        if self.tenant in attrindexes:
+            return attrindexes[self.tenant]
+        attrindex = {}
+        for node in self._cfgstore['nodes']:
+            cfgnodeobj = self._cfgstore['nodes'][node]
+            for attrname in cfgnodeobj:
+                self._index_nodeattr(attrindex, node, attrname)
+        attrindexes[self.tenant] = attrindex
+        return attrindex
+
+    def _index_nodeattr(self, attrindex, node, attrname):
+        if attrname in attrindex:
+            bynode, byvalue = attrindex[attrname]
+            if node in byvalue:
+                oldval = byvalue.pop(node)
+                bynode[oldval].discard(node)
+                if not bynode[oldval]:
+                    del bynode[oldval]
+        try:
+            currval = self._cfgstore['nodes'][node][attrname]['value']
+            hash(currval)
+        except (KeyError, TypeError):
+            # unset, encrypted or not a simple value, treat as empty
+            return
+        if attrname not in attrindex:
+            attrindex[attrname] = ({}, {})
+        bynode, byvalue = attrindex[attrname]
+        byvalue[node] = currval
+        if currval not in bynode:
+            bynode[currval] = set([node])
+        else:
+            bynode[currval].add(node)
+
+    def _update_attrindex(self, nodeattrs):
+        attrindex = _cfgstore.get('attrindex', {}).get(self.tenant, None)
+        if attrindex is None:
+            return
+        for node in nodeattrs:
+            if '_nodedeleted' in nodeattrs[node]:
+                checkattrs = list(attrindex)
+            else:
+                checkattrs = nodeattrs[node]
+            for attrname in checkattrs:
+                self._index_nodeattr(attrindex, node, attrname)
+
+    def _rename_attrindex(self, renamemap):
+        attrindex = _cfgstore.get('attrindex', {}).get(self.tenant, None)
+        if attrindex is None:
+            return
+        for attrname in attrindex:
+            bynode, byvalue = attrindex[attrname]
+            for name in renamemap:
+                if name not in byvalue:
+                    continue
+                currval = byvalue.pop(name)
+                byvalue[renamemap[name]] = currval
+                bynode[currval].discard(name)
+                bynode[currval].add(renamemap[name])
+
+    def get_change_generation(self, attributes=None):
+        """Get a value that changes whenever relevant configuration changes
+
+        Any change to node or group membership changes the value.  If
+        attributes are given (globs allowed), changes to other attributes
+        are not considered.
+
+        :param attributes: Optional iterable of attribute names of interest
+        """
+        gens = _changegens.get(self.tenant, {})
+        gen = gens.get(None, _cleargen)
+        if attributes is None:
+            return max(gen, gens.get('*', 0))
+        for attribute in attributes:
+            if '*' in attribute or '?' in attribute:
+                gen = max(gen, gens.get('*', 0))
+            else:
+                gen = max(gen, gens.get(attribute, 0))
+        return gen
 
     def filter_nodenames(self, expression, nodes=None):
         """Filter nodenames by regular expression
@@ -1693,38 +2110,80 @@ class ConfigManager(object):
             yield (node, fmt.format(expression))
 
     def get_node_attributes(self, nodelist, attributes=(), decrypt=None):
+        retdict = {}
+        for node, nodeattrs in self._iter_node_attributes(nodelist, attributes,
+                                                          decrypt):
+            retdict[node] = dict(nodeattrs)
+        return retdict
+
+    def get_node_attributes_bulk(self, nodelist, attributes=(), decrypt=None):
+        """Retrieve attributes of many nodes as a NodeAttributeTable
+
+        This is intended for plugins handling large noderanges.  Attribute
+        globs are evaluated once per distinct attribute name rather than per
+        node, an encrypted value shared by many nodes is decrypted once, and
+        no per node dictionaries are built.  The returned values are shared
+        with the configuration and must be treated as read-only.
+        """
+        nodes = []
+        columns = {}
+        for node, nodeattrs in self._iter_node_attributes(nodelist, attributes,
+                                                          decrypt):
+            nodes.append(node)
+            for attribute, attrval in nodeattrs:
+                try:
+                    columns[attribute][node] = attrval
+                except KeyError:
+                    columns[attribute] = {node: attrval}
+        return NodeAttributeTable(nodes, columns)
+
+    def _iter_node_attributes(self, nodelist, attributes, decrypt):
         if decrypt is None:
             decrypt = self.decrypt
-        retdict = {}
         if isinstance(nodelist, str) or isinstance(nodelist, unicode):
             nodelist = [nodelist]
         if isinstance(attributes, str) or isinstance(attributes, unicode):
             attributes = [attributes]
-        relattribs = attributes
+        allattribs = len(attributes) == 0
+        # private things are skipped when requested by name
+        relattribs = [x for x in attributes if not x.startswith('_')]
+        globs = [re.compile(fnmatch.translate(x)).match for x in relattribs
+                 if '*' in x]
+        globmatches = {}
+        plaintexts = {}
+        cfgnodes = self._cfgstore['nodes']
         for node in nodelist:
-            if node not in self._cfgstore['nodes']:
+            if node not in cfgnodes:
                 continue
-            cfgnodeobj = self._cfgstore['nodes'][node]
-            nodeobj = {}
-            if len(attributes) == 0:
-                relattribs = cfgnodeobj
-            for attribute in relattribs:
-                if attribute.startswith('_'):
-                    # skip private things
-                    continue
-                if '*' in attribute:
-                    for attr in fnmatch.filter(list(cfgnodeobj), attribute):
-                        nodeobj[attr] = _decode_attribute(attr, cfgnodeobj,
-                                                          decrypt=decrypt)
-                if attribute not in cfgnodeobj:
-                    continue
+            cfgnodeobj = cfgnodes[node]
+            if allattribs:
+                wanted = [x for x in cfgnodeobj if not x.startswith('_')]
+            else:
+                wanted = [x for x in relattribs if x in cfgnodeobj]
+                for attr in cfgnodeobj if globs else ():
+                    try:
+                        matched = globmatches[attr]
+                    except KeyError:
+                        matched = any(glob(attr) for glob in globs)
+                        globmatches[attr] = matched
+                    if matched:
+                        wanted.append(attr)
+            nodeattrs = []
+            for attr in wanted:
+                attrval = cfgnodeobj[attr]
                 # since the formatter is not passed in, the calculator is
                 # skipped.  The decryption, however, we want to do only on
                 # demand
-                nodeobj[attribute] = _decode_attribute(attribute, cfgnodeobj,
-                                                       decrypt=decrypt)
-            retdict[node] = nodeobj
-        return retdict
+                if (decrypt and 'value' not in attrval and
+                        'cryptvalue' in attrval):
+                    cryptkey = _cryptkey(attrval['cryptvalue'])
+                    if cryptkey not in plaintexts:
+                        plaintexts[cryptkey] = decrypt_value(
+                            attrval['cryptvalue'])
+                    attrval = dict(attrval)
+                    attrval['value'] = plaintexts[cryptkey]
+                nodeattrs.append((attr, attrval))
+            yield node, nodeattrs
 
     def _node_added_to_group(self, node, group, changeset):
         try:
@@ -1953,6 +2412,7 @@ class ConfigManager(object):
                                              srcgroup=group)
                         _addchange(changeset, node, attr)
             _mark_dirtykey('nodegroups', group, self.tenant)
+        _note_change(self.tenant)
         self._notif_attribwatchers(changeset)
         self._bg_sync_to_file()
 
@@ -2006,6 +2466,7 @@ class ConfigManager(object):
                                 _addchange(changeset, node, attrib)
                                 _mark_dirtykey('nodes', node, self.tenant)
                 _mark_dirtykey('nodegroups', group, self.tenant)
+        _note_change(self.tenant)
         self._notif_attribwatchers(changeset)
         self._bg_sync_to_file()
 
@@ -2024,6 +2485,12 @@ class ConfigManager(object):
                                           changeset=changeset)
 
     def _notif_attribwatchers(self, nodeattrs):
+        # every change funnels through here, keep the filter index current
+        self._update_attrindex(nodeattrs)
+        changed = set([])
+        for node in nodeattrs:
+            changed.update(nodeattrs[node])
+        _note_change(self.tenant, changed)
         if self.tenant not in self._attribwatchers:
             return
         notifdata = {}
@@ -2118,6 +2585,7 @@ class ConfigManager(object):
                                           changeset=changeset)
                 del self._cfgstore['nodegroups'][group]
                 _mark_dirtykey('nodegroups', group, self.tenant)
+        _note_change(self.tenant)
         self._notif_attribwatchers(changeset)
         self._bg_sync_to_file()
 
@@ -2197,6 +2665,9 @@ class ConfigManager(object):
             raise ValueError(
                 'The following requested new names conflict with existing nodes: {0}'.format(
                     ','.join(newnames & currnodes)))
+        # carry indexed values over to the new names first, so that values
+        # recalculated from expressions below replace them in the index
+        self._rename_attrindex(renamemap)
         for name in renamemap:
             self._cfgstore['nodes'][renamemap[name]] = self._cfgstore['nodes'][name]
             del self._cfgstore['nodes'][name]
@@ -2212,6 +2683,8 @@ class ConfigManager(object):
             if exprmgr is None:
                 exprmgr = _ExpressionFormat(cfgobj, node)
             self._recalculate_expressions(cfgobj, formatter=exprmgr, node=renamemap[name], changeset=changeset)
+            self._update_attrindex(changeset)
+        _note_change(self.tenant)
         if self.tenant in self._nodecollwatchers:
             nodecollwatchers = self._nodecollwatchers[self.tenant]
             for watcher in nodecollwatchers:
@@ -2252,6 +2725,7 @@ class ConfigManager(object):
                 lidx = self._cfgstore['nodes'][node]['groups'].index(name)
                 self._cfgstore['nodes'][node]['groups'][lidx] = renamemap[name]
                 _mark_dirtykey('nodes', node, self.tenant)
+        _note_change(self.tenant)
         self._bg_sync_to_file()
 
 
@@ -2398,6 +2872,8 @@ class ConfigManager(object):
                     exprmgr = _ExpressionFormat(cfgobj, node)
                 self._recalculate_expressions(cfgobj, formatter=exprmgr,
                                               node=node, changeset=changeset)
+        if newnodes:
+            _note_change(self.tenant)
         self._notif_attribwatchers(changeset)
         if newnodes:
             if self.tenant in self._nodecollwatchers:
@@ -2414,6 +2890,32 @@ class ConfigManager(object):
         :param jsondata: String of jsondata
         :return:
         """
+        self._load_json_chunks((jsondata,), sync)
+
+    def _load_json_chunks(self, chunks, sync=True):
+        """Load fresh configuration data from a series of json documents
+
+        Each document holds some of the elements of a configuration dump,
+        with the areas in the order of _config_areas, as from
+        _dump_json_chunks.  Each is checked and applied before the next is
+        looked at, so the whole configuration is never held as json.  Only
+        the first is checked before the current configuration is erased.
+
+        :param chunks: Iterable of strings of jsondata
+        """
+        cleared = False
+        for jsondata in chunks:
+            tmpconfig = self._parse_dump(jsondata)
+            if not cleared:
+                self._clear_for_load()
+                cleared = True
+            self._apply_dump(tmpconfig)
+        if not cleared:
+            self._clear_for_load()
+        if sync:
+            self._bg_sync_to_file()
+
+    def _parse_dump(self, jsondata):
         dumpdata = json.loads(jsondata)
         tmpconfig = {}
         for confarea in _config_areas:
@@ -2450,20 +2952,32 @@ class ConfigManager(object):
                         # be rebuilt
                         del newelement[attribute]
                 tmpconfig[confarea][element] = newelement
-        # We made it through above section without an exception, go ahead and
-        # replace
-        # Start by erasing the dbm files if present
+        return tmpconfig
+
+    def _clear_for_load(self):
+        # We made it through checking the data without an exception, go
+        # ahead and replace
+        # Start by erasing the dbm files if present, after folding in any
+        # journal so that stale records are not replayed over the new data
+        with _synclock:
+            if _journalpending:
+                _compact_journal(self._cfgdir)
         for confarea in _config_areas:
             try:
                 os.unlink(os.path.join(self._cfgdir, confarea))
             except OSError as e:
                 if e.errno == 2:
                     pass
-        # Now we have to iterate through each fixed up element, using the
-        # set attribute to flesh out inheritence and expressions
         _cfgstore['main']['idmap'] = {}
+        _cfgstore.get('attrindex', {}).pop(self.tenant, None)
+        _note_change(self.tenant)
         for confarea in _config_areas:
             self._cfgstore[confarea] = {}
+
+    def _apply_dump(self, tmpconfig):
+        # Now we have to iterate through each fixed up element, using the
+        # set attribute to flesh out inheritence and expressions
+        for confarea in _config_areas:
             if confarea not in tmpconfig:
                 continue
             if confarea == 'nodes':
@@ -2490,8 +3004,6 @@ class ConfigManager(object):
                         if attrname in tmpconfig[confarea][user]:
                             self._cfgstore['users'][user][attrname] = tmpconfig[confarea][user][attrname]
                             _mark_dirtykey('users', user, self.tenant)
-        if sync:
-            self._bg_sync_to_file()
 
     def _dump_to_json(self, redact=None):
         """Dump the configuration in json form to output
@@ -2512,34 +3024,60 @@ class ConfigManager(object):
                 continue
             dumpdata[confarea] = {}
             for element in self._cfgstore[confarea]:
-                dumpdata[confarea][element] = \
-                    copy.deepcopy(self._cfgstore[confarea][element])
-                for attribute in self._cfgstore[confarea][element]:
-                    if 'inheritedfrom' in dumpdata[confarea][element][attribute]:
-                        del dumpdata[confarea][element][attribute]
-                    elif (attribute == 'cryptpass' or
-                                  'cryptvalue' in
-                                  dumpdata[confarea][element][attribute]):
-                        if redact is not None:
-                            dumpdata[confarea][element][attribute] = '*REDACTED*'
-                        else:
-                            if attribute == 'cryptpass':
-                                target = dumpdata[confarea][element][attribute]
-                            else:
-                                target = dumpdata[confarea][element][attribute]['cryptvalue']
-                            cryptval = []
-                            for value in target:
-                                cryptval.append(confluent.util.stringify(base64.b64encode(value)))
-                            if attribute == 'cryptpass':
-                                dumpdata[confarea][element][attribute] = '!'.join(cryptval)
-                            else:
-                                dumpdata[confarea][element][attribute]['cryptvalue'] = '!'.join(cryptval)
-                    elif isinstance(dumpdata[confarea][element][attribute], set):
-                        dumpdata[confarea][element][attribute] = \
-                            list(dumpdata[confarea][element][attribute])
+                dumpdata[confarea][element] = self._dump_element(
+                    confarea, element, redact)
         return json.dumps(
             dumpdata, sort_keys=True, indent=4, separators=(',', ': '))
 
+    def _dump_json_chunks(self, chunksize=1000):
+        """Dump the configuration as a list of compact json documents
+
+        Each holds up to chunksize elements of one area, as for
+        _load_json_chunks.  This is done in one pass without yielding, so
+        the documents are a consistent snapshot of the configuration.
+        """
+        chunks = []
+        for confarea in _config_areas:
+            if confarea not in self._cfgstore:
+                continue
+            dumpdata = {}
+            for element in self._cfgstore[confarea]:
+                dumpdata[element] = self._dump_element(confarea, element)
+                if len(dumpdata) >= chunksize:
+                    chunks.append(json.dumps(
+                        {confarea: dumpdata}, separators=(',', ':')))
+                    dumpdata = {}
+            if dumpdata:
+                chunks.append(json.dumps(
+                    {confarea: dumpdata}, separators=(',', ':')))
+        return chunks
+
+    def _dump_element(self, confarea, element, redact=None):
+        dumpelement = copy.deepcopy(self._cfgstore[confarea][element])
+        for attribute in self._cfgstore[confarea][element]:
+            if 'inheritedfrom' in dumpelement[attribute]:
+                del dumpelement[attribute]
+            elif (attribute == 'cryptpass' or
+                          'cryptvalue' in
+                          dumpelement[attribute]):
+                if redact is not None:
+                    dumpelement[attribute] = '*REDACTED*'
+                else:
+                    if attribute == 'cryptpass':
+                        target = dumpelement[attribute]
+                    else:
+                        target = dumpelement[attribute]['cryptvalue']
+                    cryptval = []
+                    for value in target:
+                        cryptval.append(confluent.util.stringify(base64.b64encode(value)))
+                    if attribute == 'cryptpass':
+                        dumpelement[attribute] = '!'.join(cryptval)
+                    else:
+                        dumpelement[attribute]['cryptvalue'] = '!'.join(cryptval)
+            elif isinstance(dumpelement[attribute], set):
+                dumpelement[attribute] = list(dumpelement[attribute])
+        return dumpelement
+
 
 
     @classmethod
@@ -2568,6 +3106,7 @@ class ConfigManager(object):
                         os.path.join(rootpath, tenant, confarea))
         except OSError:
             pass
+        _replay_journal(rootpath)
 
     @classmethod
     def wait_for_sync(cls, fullsync=False):
@@ -2672,6 +3211,8 @@ class ConfigManager(object):
                     except OSError:
                         pass
             if fullsync:
+                if _journalpending:
+                    _compact_journal(cls._cfgdir)
                 pathname = cls._cfgdir
                 currdict = _cfgstore['main']
                 for category in currdict:
@@ -2688,10 +3229,19 @@ class ConfigManager(object):
                             dbf[ck] = cPickle.dumps(currdict[category][ck], protocol=cPickle.HIGHEST_PROTOCOL)
                     finally:
                         dbf.close()
+                try:
+                    os.remove(os.path.join(cls._cfgdir, 'journal'))
+                except OSError:
+                    pass
             elif 'dirtykeys' in _cfgstore:
                 with _dirtylock:
                     currdirt = copy.deepcopy(_cfgstore['dirtykeys'])
                     del _cfgstore['dirtykeys']
+                if _journal_enabled():
+                    _append_journal(cls._cfgdir, currdirt)
+                    currdirt = {}
+                elif _journalpending:
+                    _compact_journal(cls._cfgdir)
                 for tenant in currdirt:
                     dkdict = currdirt[tenant]
                     if tenant is None:
@@ -24,6 +24,7 @@
 import codecs
 import collections
 import confluent.collective.manager as collective
+import confluent.config.conf as conf
 import confluent.config.configmanager as configmodule
 import confluent.exceptions as exc
 import confluent.interface.console as conapi
@@ -38,18 +39,18 @@ import eventlet.green.select as select
 import eventlet.green.socket as socket
 import eventlet.green.subprocess as subprocess
 import eventlet.green.ssl as ssl
-import eventlet.semaphore as semaphore
+import eventlet.queue
 import fcntl
 import random
 import struct
 import time
 import traceback
+import zlib
 
 _handled_consoles = {}
 
 _tracelog = None
-_bufferdaemon = None
-_bufferlock = None
+_bufferdaemons = []
 
 try:
     range = xrange
@@ -61,40 +62,99 @@ def chunk_output(output, n):
     for i in range(0, len(output), n):
         yield output[i:i + n]
 
+class BufferDaemon(object):
+    """A vtbufferd process holding the screens of some of the nodes
+
+    vtbufferd services requests strictly in order.  Writes and screen
+    requests are queued to it without waiting on one another, and sent
+    together as they accumulate.  Each screen it sends back belongs to the
+    oldest screen request still waiting.
+    """
+    maxbatch = 1048576
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            ['/opt/confluent/bin/vtbufferd'], bufsize=0,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        fl = fcntl.fcntl(self.process.stdout.fileno(), fcntl.F_GETFL)
+        fcntl.fcntl(self.process.stdout.fileno(),
+                    fcntl.F_SETFL, fl | os.O_NONBLOCK)
+        self.requests = eventlet.queue.LightQueue()
+        self.waiters = collections.deque()
+        eventlet.spawn_n(self._write_requests)
+        eventlet.spawn_n(self._read_screens)
+
+    def _write_requests(self):
+        out = self.process.stdin
+        while True:
+            batch = [self.requests.get()]
+            batchsize = len(batch[0])
+            while batchsize < self.maxbatch:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except eventlet.queue.Empty:
+                    break
+                batchsize += len(batch[-1])
+            try:
+                out.write(b''.join(batch))
+                out.flush()
+            except Exception:
+                _tracelog.log(traceback.format_exc(),
+                              ltype=log.DataTypes.event,
+                              event=log.Events.stacktrace)
+
+    def _read_screens(self):
+        infd = self.process.stdout.fileno()
+        screen = bytearray()
+        while True:
+            try:
+                chunk = os.read(infd, 65536)
+            except IOError:
+                select.select((infd,), (), (), 30)
+                continue
+            if not chunk:
+                break
+            while chunk:
+                head, sep, chunk = chunk.partition(b'\x00')
+                screen.extend(head)
+                if sep:
+                    if self.waiters:
+                        self.waiters.popleft().send(bytes(screen))
+                    screen = bytearray()
+        # the daemon has gone away, do not leave anyone waiting on it
+        while self.waiters:
+            self.waiters.popleft().send(b'')
+
+    def get_buffer(self, nodename):
+        waiter = eventlet.event.Event()
+        self.waiters.append(waiter)
+        self.requests.put(struct.pack('I', len(nodename)) + nodename)
+        return waiter.wait()
+
+    def send_output(self, nodename, output):
+        request = [struct.pack('I', len(nodename) | (1 << 29)), nodename]
+        for chunk in chunk_output(output, 8192):
+            request.append(struct.pack('I', len(chunk) | (2 << 29)))
+            request.append(chunk)
+        self.requests.put(b''.join(request))
+
+
+def _get_bufferdaemon(nodename):
+    if len(_bufferdaemons) == 1:
+        return _bufferdaemons[0]
+    return _bufferdaemons[zlib.crc32(nodename) % len(_bufferdaemons)]
+
+
 def get_buffer_output(nodename):
-    out = _bufferdaemon.stdin
-    instream = _bufferdaemon.stdout
     if not isinstance(nodename, bytes):
         nodename = nodename.encode('utf8')
-    outdata = bytearray()
-    with _bufferlock:
-        out.write(struct.pack('I', len(nodename)))
-        out.write(nodename)
-        out.flush()
-        select.select((instream,), (), (), 30)
-        while not outdata or outdata[-1]:
-            try:
-                chunk = os.read(instream.fileno(), 128)
-            except IOError:
-                chunk = None
-            if chunk:
-                outdata.extend(chunk)
-            else:
-                select.select((instream,), (), (), 0)
-        return bytes(outdata[:-1])
+    return _get_bufferdaemon(nodename).get_buffer(nodename)
 
 
 def send_output(nodename, output):
     if not isinstance(nodename, bytes):
         nodename = nodename.encode('utf8')
-    with _bufferlock:
-        _bufferdaemon.stdin.write(struct.pack('I', len(nodename) | (1 << 29)))
-        _bufferdaemon.stdin.write(nodename)
-        _bufferdaemon.stdin.flush()
-        for chunk in chunk_output(output, 8192):
-            _bufferdaemon.stdin.write(struct.pack('I', len(chunk) | (2 << 29)))
-            _bufferdaemon.stdin.write(chunk)
-            _bufferdaemon.stdin.flush()
+    _get_bufferdaemon(nodename).send_output(nodename, output)
 
 def _utf8_normalize(data, decoder):
     # first we give the stateful decoder a crack at the byte stream,
@@ -583,10 +643,11 @@ def _nodechange(added, deleting, renamed, configmanager):
 
 
 def _start_tenant_sessions(cfm):
-    nodeattrs = cfm.get_node_attributes(cfm.list_nodes(), 'collective.manager')
+    nodeattrs = cfm.get_node_attributes_bulk(cfm.list_nodes(),
+                                             'collective.manager')
+    managers = nodeattrs.column('collective.manager')
     for node in nodeattrs:
-        manager = nodeattrs[node].get('collective.manager', {}).get('value',
-                                                                    None)
+        manager = managers.get(node, {}).get('value', None)
         if manager and collective.get_myname() != manager:
             continue
         try:
@@ -599,16 +660,11 @@ def _start_tenant_sessions(cfm):
 
 def initialize():
     global _tracelog
-    global _bufferdaemon
-    global _bufferlock
-    _bufferlock = semaphore.Semaphore()
     _tracelog = log.Logger('trace')
-    _bufferdaemon = subprocess.Popen(
-        ['/opt/confluent/bin/vtbufferd'], bufsize=0, stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE)
-    fl = fcntl.fcntl(_bufferdaemon.stdout.fileno(), fcntl.F_GETFL)
-    fcntl.fcntl(_bufferdaemon.stdout.fileno(),
-                fcntl.F_SETFL, fl | os.O_NONBLOCK)
+    # nodes may be spread over several buffer daemons, by hash of name
+    shards = conf.get_int_option('console', 'buffer_daemons') or 1
+    for _ in range(max(shards, 1)):
+        _bufferdaemons.append(BufferDaemon())
 
 def start_console_sessions():
     configmodule.hook_new_configmanagers(_start_tenant_sessions)
@@ -41,13 +41,16 @@ import confluent.config.attributes as attrscheme
 import confluent.config.configmanager as cfm
 import confluent.collective.manager as collective
 import confluent.discovery.core as disco
+import confluent.forwarder as forwarder
 import confluent.interface.console as console
 import confluent.exceptions as exc
 import confluent.messages as msg
+import confluent.neighutil as neighutil
 import confluent.networking.macmap as macmap
 import confluent.noderange as noderange
 import confluent.osimage as osimage
 import confluent.plugin as plugin
+import confluent.resolver as resolver
 try:
     import confluent.shellmodule as shellmodule
 except ImportError:
@@ -159,8 +162,16 @@ def _merge_dict(original, custom):
 
 
 rootcollections = ['deployment/', 'discovery/', 'events/', 'networking/',
-                   'noderange/', 'nodes/', 'nodegroups/', 'usergroups/' ,
-                   'users/', 'uuid', 'version']
+                   'noderange/', 'nodes/', 'nodegroups/', 'stats/',
+                   'usergroups/' , 'users/', 'uuid', 'version']
+
+# Internal cache and counter statistics offered under /stats/
+statproviders = {
+    'forwarder': forwarder.get_relay_stats,
+    'neighbors': neighutil.get_stats,
+    'noderange': noderange.get_cache_stats,
+    'resolver': resolver.get_stats,
+}
 
 
 class PluginRoute(object):
@@ -803,20 +814,23 @@ def _keepalivefn(connection, xmitlock):
         with xmitlock:
             connection.sendall(b'\x00\x00\x00\x00\x00\x00\x00\x01\x00')
 
-def handle_dispatch(connection, cert, dispatch, peername):
+def _stream_keepalivefn(connection, xmitlock):
+    while True:
+        eventlet.sleep(30)
+        with xmitlock:
+            connection.sendall(_framehdr.pack(0, 0))
+
+
+def _check_dispatch_peer(connection, cert, peername):
     cert = crypto.dump_certificate(crypto.FILETYPE_ASN1, cert)
     if not util.cert_matches(
             cfm.get_collective_member(peername)['fingerprint'], cert):
         connection.close()
-        return
-    if dispatch[0:2] != b'\x01\x03':  # magic value to indicate msgpack
-        # We only support msgpack now
-        # The magic should preclude any pickle, as the first byte can never be
-        # under 0x20 or so.
-        connection.close()
-        return
-    xmitlock = semaphore.Semaphore()
-    keepalive = eventlet.spawn(_keepalivefn, connection, xmitlock)
+        return False
+    return True
+
+
+def _dispatch_responses(dispatch):
     dispatch = msgpack.unpackb(dispatch[2:], raw=False)
     configmanager = cfm.ConfigManager(dispatch['tenant'])
     nodes = dispatch['nodes']
@@ -829,11 +843,7 @@ def handle_dispatch(connection, cert, dispatch, peername):
             pathcomponents, operation, inputdata, nodes, dispatch['isnoderange'],
             configmanager)
     except Exception as res:
-        with xmitlock:
-            _forward_rsp(connection, res)
-        keepalive.kill()
-        connection.sendall('\x00\x00\x00\x00\x00\x00\x00\x00')
-        connection.close()
+        yield res
         return
     plugroute = routespec.routeinfo
     nodesbyhandler = {}
@@ -846,7 +856,7 @@ def handle_dispatch(connection, cert, dispatch, peername):
             if attrname in nodeattr[node]:
                 plugpath = nodeattr[node][attrname]['value']
             if not plugpath and 'default' in plugroute:
-                plugpath = plugroute['default'] 
+                plugpath = plugroute['default']
         if plugpath:
             try:
                 hfunc = getattr(pluginmap[plugpath], operation)
@@ -864,17 +874,81 @@ def handle_dispatch(connection, cert, dispatch, peername):
                 configmanager=configmanager,
                 inputdata=inputdata))
         for res in itertools.chain(*passvalues):
-            with xmitlock:
-                _forward_rsp(connection, res)
+            yield res
     except Exception as res:
+        yield res
+
+
+def handle_dispatch(connection, cert, dispatch, peername):
+    if not _check_dispatch_peer(connection, cert, peername):
+        return
+    if dispatch[0:2] != b'\x01\x03':  # magic value to indicate msgpack
+        # We only support msgpack now
+        # The magic should preclude any pickle, as the first byte can never be
+        # under 0x20 or so.
+        connection.close()
+        return
+    xmitlock = semaphore.Semaphore()
+    keepalive = eventlet.spawn(_keepalivefn, connection, xmitlock)
+    for res in _dispatch_responses(dispatch):
         with xmitlock:
             _forward_rsp(connection, res)
     keepalive.kill()
-    connection.sendall('\x00\x00\x00\x00\x00\x00\x00\x00')
+    connection.sendall(b'\x00\x00\x00\x00\x00\x00\x00\x00')
     connection.close()
 
 
+def _stream_dispatch(connection, xmitlock, reqid, dispatch):
+    try:
+        if dispatch[0:2] != b'\x01\x03':
+            raise Exception('Unsupported dispatch encoding')
+        for res in _dispatch_responses(dispatch):
+            rsp = _serialize_rsp(res)
+            if rsp:
+                with xmitlock:
+                    connection.sendall(_framehdr.pack(len(rsp), reqid) + rsp)
+    except Exception as e:
+        rsp = _serialize_rsp(e)
+        with xmitlock:
+            connection.sendall(_framehdr.pack(len(rsp), reqid) + rsp)
+    finally:
+        with xmitlock:
+            connection.sendall(_framehdr.pack(0, reqid))
+
+
+def handle_dispatch_stream(connection, cert, peername):
+    """Service a long lived dispatch connection from a collective member
+
+    Requests and responses are framed with a length and request id, allowing
+    any number of dispatches to be in flight on the one connection.
+    """
+    if not _check_dispatch_peer(connection, cert, peername):
+        return
+    xmitlock = semaphore.Semaphore()
+    with xmitlock:
+        tlvdata.send(connection, {'dispatchstream': {'ready': True}})
+    keepalive = eventlet.spawn(_stream_keepalivefn, connection, xmitlock)
+    try:
+        for reqid, dispatch in _read_frames(connection):
+            if reqid:
+                eventlet.spawn_n(_stream_dispatch, connection, xmitlock,
+                                 reqid, dispatch)
+    except Exception:
+        pass
+    finally:
+        keepalive.kill()
+        connection.close()
+
+
 def _forward_rsp(connection, res):
+    r = _serialize_rsp(res)
+    rlen = len(r)
+    if not rlen:
+        return
+    connection.sendall(struct.pack('!Q', rlen) + r)
+
+
+def _serialize_rsp(res):
     try:
        r = res.serialize()
     except AttributeError:
@@ -888,11 +962,7 @@ def _forward_rsp(connection, res):
         r = msgpack.packb(
                 ['Exception', 'Unable to serialize response ' + repr(res) + ' due to ' + str(e)],
                 use_bin_type=False)
-    rlen = len(r)
-    if not rlen:
-        return
-    connection.sendall(struct.pack('!Q', rlen))
-    connection.sendall(r)
+    return r
 
 
 def handle_node_request(configmanager, inputdata, operation,
@@ -976,7 +1046,7 @@ def handle_node_request(configmanager, inputdata, operation,
         else:
             raise Exception("TODO here")
     del pathcomponents[0:2]
-    passvalues = queue.Queue()
+    passvalues = util.ResultQueue()
     plugroute = routespec.routeinfo
     _plugin = None
 
@@ -1083,16 +1153,21 @@ def _get_input_data(plugin_ext, pathcomponents, operation, inputdata,
 
 def iterate_queue(numworkers, passvalues, strip=False):
     completions = 0
-    while completions < numworkers:
-        nv = passvalues.get()
-        if nv == 'theend':
-            completions += 1
-        else:
-            if isinstance(nv, Exception):
-                raise nv
-            if strip and not isinstance(nv, console.Console):
-                nv.strip_node(strip)
-            yield nv
+    try:
+        while completions < numworkers:
+            nv = passvalues.get()
+            if nv == 'theend':
+                completions += 1
+            else:
+                if isinstance(nv, Exception):
+                    raise nv
+                if strip and not isinstance(nv, console.Console):
+                    nv.strip_node(strip)
+                yield nv
+    finally:
+        # Whether finished, failed or abandoned by the client, stop
+        # holding results so that any remaining workers do not block
+        passvalues.close()
 
 
 def addtoqueue(theq, fun, kwargs):
@@ -1102,6 +1177,11 @@ def addtoqueue(theq, fun, kwargs):
             theq.put(result)
         else:
             for pv in result:
+                if theq.closed:
+                    # nobody is reading any more, stop the plugin early
+                    if hasattr(result, 'close'):
+                        result.close()
+                    break
                 theq.put(pv)
     except Exception as e:
         theq.put(e)
@@ -1109,9 +1189,210 @@ def addtoqueue(theq, fun, kwargs):
         theq.put('theend')
 
 
+# Frames on a dispatch stream are a payload length and request id followed
+# by the payload.  An empty payload ends the responses to a request, request
+# id zero is reserved for keepalives
+_framehdr = struct.Struct('!QI')
+_collectivestreams = {}
+
+
+def _read_frames(connection):
+    buf = bytearray()
+    while True:
+        data = connection.recv(262144)
+        if not data:
+            return
+        buf += data
+        offset = 0
+        while len(buf) - offset >= _framehdr.size:
+            rlen, reqid = _framehdr.unpack_from(buf, offset)
+            if len(buf) - offset - _framehdr.size < rlen:
+                break
+            offset += _framehdr.size
+            yield reqid, bytes(buf[offset:offset + rlen])
+            offset += rlen
+        del buf[:offset]
+
+
+class CollectiveStream(object):
+    """Multiplexed dispatch connection to a collective member
+
+    One TLS connection per member is kept open and shared by all requests
+    routed to that member.  Failure to connect causes further attempts to
+    be deferred with an exponential backoff, and a member that does not
+    support streams is remembered for a while to use one shot dispatch.
+    """
+    maxbackoff = 30
+    legacyrecheck = 300
+    idletimeout = 90  # the remote sends a keepalive every 30 seconds
+
+    def __init__(self, name):
+        self.name = name
+        self.connection = None
+        self.address = None
+        self.pending = {}
+        self.nextreqid = 1
+        self.xmitlock = semaphore.Semaphore()
+        self.connlock = semaphore.Semaphore()
+        self.backoff = 0
+        self.retryafter = 0
+        self.legacyuntil = 0
+
+    @property
+    def legacy(self):
+        return self.legacyuntil > util.monotonic_time()
+
+    def _connect(self, member):
+        remote = socket.create_connection((member['address'], 13001))
+        remote.settimeout(self.idletimeout)
+        remote = ssl.wrap_socket(remote, cert_reqs=ssl.CERT_NONE,
+                                 keyfile='/etc/confluent/privkey.pem',
+                                 certfile='/etc/confluent/srvcert.pem')
+        if not util.cert_matches(member['fingerprint'], remote.getpeercert(
+                binary_form=True)):
+            remote.close()
+            raise Exception("Invalid certificate on peer")
+        tlvdata.recv(remote)
+        tlvdata.recv(remote)
+        tlvdata.send(remote, {'dispatchstream': {
+            'name': collective.get_myname()}})
+        try:
+            rsp = tlvdata.recv(remote)
+        except Exception:
+            rsp = None
+        if not isinstance(rsp, dict) or 'dispatchstream' not in rsp:
+            remote.close()
+            self.legacyuntil = util.monotonic_time() + self.legacyrecheck
+            return
+        self.connection = remote
+        self.address = member['address']
+        eventlet.spawn_n(self._receive, remote)
+
+    def _receive(self, remote):
+        try:
+            for reqid, rsp in _read_frames(remote):
+                if reqid in self.pending:
+                    self.pending[reqid].put(rsp)
+        except Exception:
+            pass
+        finally:
+            self._disconnect(remote)
+
+    def _disconnect(self, remote):
+        if self.connection is remote:
+            self.connection = None
+            for reqid in list(self.pending):
+                self.pending[reqid].put(None)
+        try:
+            remote.close()
+        except Exception:
+            pass
+
+    def request(self, member, dreq):
+        """Send a dispatch request
+
+        Returns a request id and a queue that receives each serialized
+        response, an empty value on completion or None if the connection
+        is lost.
+        """
+        with self.connlock:
+            if self.connection and self.address != member['address']:
+                self._disconnect(self.connection)
+            if self.connection is None:
+                now = util.monotonic_time()
+                if now < self.retryafter:
+                    raise Exception('reconnect deferred for {0} seconds'.format(
+                        int(self.retryafter - now) + 1))
+                try:
+                    self._connect(member)
+                except Exception:
+                    self.backoff = min(max(self.backoff * 2, 1),
+                                       self.maxbackoff)
+                    self.retryafter = now + self.backoff
+                    raise
+                self.backoff = 0
+                if self.connection is None:
+                    return None, None
+            connection = self.connection
+        reqid = self.nextreqid
+        self.nextreqid = self.nextreqid % 4294967295 + 1
+        rspq = queue.LightQueue()
+        self.pending[reqid] = rspq
+        try:
+            with self.xmitlock:
+                connection.sendall(_framehdr.pack(len(dreq), reqid) + dreq)
+        except Exception:
+            del self.pending[reqid]
+            self._disconnect(connection)
+            raise
+        return reqid, rspq
+
+
 def dispatch_request(nodes, manager, element, configmanager, inputdata,
                      operation, isnoderange):
     a = configmanager.get_collective_member(manager)
+    if not a:
+        for node in nodes:
+            yield msg.ConfluentResourceUnavailable(
+                node,
+                '"{0}" is not recognized as a collective member'.format(
+                    manager))
+        return
+    if manager not in _collectivestreams:
+        _collectivestreams[manager] = CollectiveStream(manager)
+    stream = _collectivestreams[manager]
+    if stream.legacy:
+        for rsp in _dispatch_request_oneshot(
+                nodes, manager, element, configmanager, inputdata,
+                operation, isnoderange):
+            yield rsp
+        return
+    myname = collective.get_myname()
+    dreq =  b'\x01\x03' + msgpack.packb(
+        {'name': myname, 'nodes': list(nodes),
+        'path': element,'tenant': configmanager.tenant,
+        'operation': operation, 'inputdata': inputdata, 'isnoderange': isnoderange}, use_bin_type=False)
+    try:
+        reqid, rspq = stream.request(a, dreq)
+    except Exception as e:
+        for node in nodes:
+            yield msg.ConfluentResourceUnavailable(
+                node, 'Collective member {0} is unreachable ({1})'.format(
+                    a['name'], str(e)))
+        return
+    if reqid is None:
+        for rsp in _dispatch_request_oneshot(
+                nodes, manager, element, configmanager, inputdata,
+                operation, isnoderange):
+            yield rsp
+        return
+    try:
+        while True:
+            rsp = rspq.get()
+            if rsp is None:
+                for node in nodes:
+                    yield msg.ConfluentResourceUnavailable(
+                        node, 'Collective member {0} went unreachable'.format(
+                            a['name']))
+                return
+            if not rsp:
+                break
+            try:
+                rsp = msg.msg_deserialize(rsp)
+            except Exception:
+                rsp = exc.deserialize_exc(rsp)
+            if isinstance(rsp, Exception):
+                raise rsp
+            if not rsp:
+                raise Exception('Error in cross-collective serialize/deserialze, see remote logs')
+            yield rsp
+    finally:
+        stream.pending.pop(reqid, None)
+
+
+def _dispatch_request_oneshot(nodes, manager, element, configmanager,
+                              inputdata, operation, isnoderange):
+    a = configmanager.get_collective_member(manager)
     try:
         remote = socket.create_connection((a['address'], 13001))
         remote.settimeout(180)
@@ -1207,6 +1488,16 @@ def dispatch_request(nodes, manager, element, configmanager, inputdata,
         yield rsp
 
 
+def handle_stats(pathcomponents, operation):
+    if operation != 'retrieve':
+        raise exc.InvalidArgumentException('Statistics are read-only')
+    if len(pathcomponents) == 1:
+        return enumerate_collections(sorted(statproviders))
+    if len(pathcomponents) != 2 or pathcomponents[1] not in statproviders:
+        raise exc.NotFoundException()
+    return (msg.KeyValueData(statproviders[pathcomponents[1]]()),)
+
+
 def handle_discovery(pathcomponents, operation, configmanager, inputdata):
     if pathcomponents[0] == 'detected':
         pass
@@ -1246,6 +1537,8 @@ def handle_path(path, operation, configmanager, inputdata=None, autostrip=True):
             configmanager, inputdata, operation, pathcomponents)
     elif pathcomponents[0] == 'version':
         return (msg.Attributes(kv={'version': confluent.__version__}),)
+    elif pathcomponents[0] == 'stats':
+        return handle_stats(pathcomponents, operation)
     elif pathcomponents[0] == 'uuid':
         if operation == 'update':
              with open('/var/lib/confluent/public/site/confluent_uuid', 'r') as uuidf:
@@ -657,7 +657,7 @@ def _recheck_nodes_backend(nodeattribs, configmanager):
     # for the nodes whose attributes have changed, consider them as potential
     # strangers
     if nodeattribs:
-        macmap.vintage = 0  # expire current mac map data, in case
+        macmap.invalidate_macmap()  # expire current mac map data, in case
         # the attributes changed impacted the result
     for node in nodeattribs:
         if node in known_nodes:
@@ -1522,7 +1522,7 @@ needaddhandled = False
 def _handle_nodelist_change(configmanager):
     global needaddhandled
     global nodeaddhandler
-    macmap.vintage = 0  # the current mac map is probably inaccurate
+    macmap.invalidate_macmap()  # the current mac map is probably inaccurate
     _recheck_nodes((), configmanager)
     if needaddhandled:
         needaddhandled = False
@@ -1650,9 +1650,9 @@ def _map_unique_ids(nodes=None):
         nodes_by_fprint = {}
         known_pxe_uuids = {}
         nodes = cfg.list_nodes()
-    bigmap = cfg.get_node_attributes(nodes,
-                                     ('id.uuid',
-                                      'pubkeys.tls_hardwaremanager'))
+    bigmap = cfg.get_node_attributes_bulk(nodes,
+                                          ('id.uuid',
+                                           'pubkeys.tls_hardwaremanager'))
     for uuid in list(nodes_by_uuid):
         node = nodes_by_uuid[uuid]
         if node in bigmap:
@@ -1665,13 +1665,14 @@ def _map_unique_ids(nodes=None):
         node = nodes_by_fprint[fprint]
         if node in bigmap:
             del nodes_by_fprint[fprint]
+    uuids = bigmap.column('id.uuid')
+    fprints = bigmap.column('pubkeys.tls_hardwaremanager')
     for node in bigmap:
-        uuid = bigmap[node].get('id.uuid', {}).get('value', '').lower()
+        uuid = uuids.get(node, {}).get('value', '').lower()
         if uuid_is_valid(uuid):
             nodes_by_uuid[uuid] = node
             known_pxe_uuids[uuid] = node
-        fprint = bigmap[node].get(
-            'pubkeys.tls_hardwaremanager', {}).get('value', None)
+        fprint = fprints.get(node, {}).get('value', None)
         if fprint:
             nodes_by_fprint[fprint] = node
 
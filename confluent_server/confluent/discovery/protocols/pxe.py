@@ -22,12 +22,14 @@
 
 # option 97 = UUID (wireformat)
 
+import confluent.config.conf as conf
 import confluent.config.configmanager as cfm
 import confluent.collective.manager as collective
 import confluent.noderange as noderange
 import confluent.neighutil as neighutil
 import confluent.log as log
 import confluent.netutil as netutil
+import confluent.resolver as resolver
 import confluent.util as util
 import ctypes
 import ctypes.util
@@ -167,7 +169,22 @@ pxearchs = {
 
 uuidmap = {}
 macmap = {}
+# reverse of the above, so a node's entries can be dropped without a scan
+nodeuuids = {}
+nodemacs = {}
+# nodes that already have the attribute watchers registered
+watchednodes = set([])
 attribwatcher = None
+# Attributes and noderange results needed to answer a node, kept until the
+# attributes change.  Nic configuration also depends on name resolution and
+# local addresses, so entries also expire after a while regardless.
+replyparams = {}
+niccfgs = {}
+replycachettl = 60
+replyattribs = ('deployment.*', 'collective.managercandidates', 'net*',
+                'groups')
+dhcpworkers = None
+_rawsock = None
 
 def stringify(value):
     string = bytes(value)
@@ -397,14 +414,24 @@ def snoop(handler, protocol=None, nodeguess=None):
     start_proxydhcp(handler, nodeguess)
     tracelog = log.Logger('trace')
     global attribwatcher
+    global dhcpworkers
     cfg = cfm.ConfigManager(None)
-    remap_nodes(cfg.list_nodes(), cfg)
-    attribwatcher = cfg.watch_attributes(cfg.list_nodes(), ('id.uuid', 'net.*hwaddr'), remap_nodes)
+    allnodes = cfg.list_nodes()
+    remap_nodes(allnodes, cfg)
+    attribwatcher = cfg.watch_attributes(allnodes, ('id.uuid', 'net.*hwaddr'), remap_nodes)
+    cfg.watch_attributes(allnodes, replyattribs, clear_reply_cache)
+    watchednodes.update(allnodes)
     cfg.watch_nodecollection(new_nodes)
+    dhcpworkers = eventlet.GreenPool(
+        conf.get_int_option('deployment', 'dhcp_workers') or 64)
+    eventlet.spawn_n(resolver.prefetch_nodes, cfg, allnodes)
     net4 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     net4.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     net4.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
     net4.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+    # room for a burst of requests from a large number of nodes powering on
+    # together, subject to net.core.rmem_max
+    net4.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4194304)
     try:
         net4.bind(('', 67))
     except Exception:
@@ -413,6 +440,7 @@ def snoop(handler, protocol=None, nodeguess=None):
     v6addr = socket.inet_pton(socket.AF_INET6, mcastv6addr)
     net6 = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
     net6.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    net6.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4194304)
     for ifidx in util.list_interface_indexes():
         v6grp = v6addr + struct.pack('=I', ifidx)
         net6.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, v6grp)
@@ -431,7 +459,7 @@ def snoop(handler, protocol=None, nodeguess=None):
     msg.msg_control = ctypes.addressof(cmsg)
     msg.msg_controllen = ctypes.sizeof(cmsg)
     msg.msg_name = ctypes.addressof(clientaddr)
-    msg.msg_namelen = ctypes.sizeof(clientaddr)
+    msgp = ctypes.pointer(msg)
     # We'll leave name and namelen blank for now
     while True:
         try:
@@ -443,19 +471,32 @@ def snoop(handler, protocol=None, nodeguess=None):
             for netc in ready[0]:
                 idx = None
                 if netc == net4:
-                    i = recvmsg(netc.fileno(), ctypes.pointer(msg), 0)
-                    # if we have a small packet, just skip, it can't possible hold enough
-                    # data and avoids some downstream IndexErrors that would be messy
-                    # with try/except
-                    if i < 64:
-                        continue
-                    _, level, typ = struct.unpack('QII', cmsgarr[:16])
-                    if level == socket.IPPROTO_IP and typ == IP_PKTINFO:
-                        idx, recv = struct.unpack('II', cmsgarr[16:24])
-                        recv = ipfromint(recv)
-                    rqv = memoryview(rawbuffer)[:i]
-                    if rawbuffer[0] == 1:  # Boot request
-                        process_dhcp4req(handler, nodeguess, cfg, net4, idx, recv, rqv)
+                    # Drain what has queued up rather than going back through
+                    # select for every packet, the work of replying is left
+                    # to the workers
+                    for _ in range(64):
+                        msg.msg_namelen = ctypes.sizeof(clientaddr)
+                        msg.msg_controllen = ctypes.sizeof(cmsg)
+                        i = recvmsg(netc.fileno(), msgp, socket.MSG_DONTWAIT)
+                        if i > 2048:  # -1, nothing more queued
+                            break
+                        # if we have a small packet, just skip, it can't possible hold enough
+                        # data and avoids some downstream IndexErrors that would be messy
+                        # with try/except
+                        if i < 64:
+                            continue
+                        idx = None
+                        recv = None
+                        _, level, typ = struct.unpack('QII', cmsgarr[:16])
+                        if level == socket.IPPROTO_IP and typ == IP_PKTINFO:
+                            idx, recv = struct.unpack('II', cmsgarr[16:24])
+                            recv = ipfromint(recv)
+                        if rawbuffer[0] == 1:  # Boot request
+                            # the buffer is reused by the next recvmsg
+                            rqv = memoryview(bytearray(rawbuffer[:i]))
+                            dhcpworkers.spawn_n(
+                                _dhcp_worker, process_dhcp4req, handler,
+                                nodeguess, cfg, net4, idx, recv, rqv)
                 elif netc == net6:
                     recv = 'ff02::1:2'
                     pkt, addr = netc.recvfrom(2048)
@@ -466,12 +507,24 @@ def snoop(handler, protocol=None, nodeguess=None):
                     rqv = memoryview(pkt)
                     rq = bytearray(rqv[:2])
                     if rq[0] in (1, 3): # dhcpv6 solicit
-                        process_dhcp6req(handler, rqv, addr, netc, cfg, nodeguess)
+                        dhcpworkers.spawn_n(
+                            _dhcp_worker, process_dhcp6req, handler, rqv,
+                            addr, netc, cfg, nodeguess)
 
         except Exception as e:
             tracelog.log(traceback.format_exc(), ltype=log.DataTypes.event,
                             event=log.Events.stacktrace)
 
+
+def _dhcp_worker(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        tracelog = log.Logger('trace')
+        tracelog.log(traceback.format_exc(), ltype=log.DataTypes.event,
+                     event=log.Events.stacktrace)
+
+
 def process_dhcp6req(handler, rqv, addr, net, cfg, nodeguess):
     ip = addr[0]
     req, disco = v6opts_to_dict(bytearray(rqv[4:]))
@@ -485,11 +538,7 @@ def process_dhcp6req(handler, rqv, addr, net, cfg, nodeguess):
     mac = neighutil.get_hwaddr(ip.split('%', 1)[0])
     if not mac:
         net.sendto(b'\x00', addr)
-    tries = 5
-    while tries and not mac:
-        eventlet.sleep(0.01)
-        tries -= 1
-        mac = neighutil.get_hwaddr(ip.split('%', 1)[0])
+        mac = neighutil.wait_for_hwaddr(ip.split('%', 1)[0], 0.05)
     info = {'hwaddr': mac, 'uuid': disco['uuid'],
             'architecture': disco['arch'], 'services': ('pxe-client',)}
     if ignoredisco.get(mac, 0) + 90 < time.time():
@@ -539,40 +588,64 @@ def process_dhcp4req(handler, nodeguess, cfg, net4, idx, recv, rqv):
 
 
 
+def _unmap(idmap, nodeids, nodename):
+    for ent in nodeids.pop(nodename, ()):
+        if idmap.get(ent, None) == nodename:
+            del idmap[ent]
+
+
+def _map(idmap, nodeids, ent, nodename):
+    oldnode = idmap.get(ent, None)
+    if oldnode is not None and oldnode != nodename:
+        nodeids[oldnode].discard(ent)
+    idmap[ent] = nodename
+    nodeids.setdefault(nodename, set([])).add(ent)
+
+
 def clear_nodes(nodes):
     for nodename in nodes:
-        for ent in list(macmap):
-            if macmap[ent] == nodename:
-                del macmap[ent]
-        for ent in list(uuidmap):
-            if uuidmap[ent] == nodename:
-                del uuidmap[ent]
+        _unmap(macmap, nodemacs, nodename)
+        _unmap(uuidmap, nodeuuids, nodename)
+
+
+def clear_reply_cache(nodeattribs, configmanager):
+    for nodename in nodeattribs:
+        replyparams.pop(nodename, None)
+        niccfgs.pop(nodename, None)
+    resolver.seed_from_config(configmanager, nodeattribs)
 
 
 def new_nodes(added, deleting, renamed, configmanager):
-    global attribwatcher
-    configmanager.remove_watcher(attribwatcher)
     alldeleting = set(deleting) | set(renamed)
     clear_nodes(alldeleting)
     alladding = set(added)
     for oldname in renamed:
         alladding.add(renamed[oldname])
+    clear_reply_cache(alldeleting | alladding, configmanager)
     remap_nodes(alladding, configmanager)
-    attribwatcher = configmanager.watch_attributes(configmanager.list_nodes(),
-                                                   ('id.uuid', 'net.*hwaddr'), remap_nodes)
+    eventlet.spawn_n(resolver.prefetch_nodes, configmanager, alladding)
+    # Watchers of deleted names are left in place by the configmanager, so
+    # only names never watched before need a watcher of their own
+    unwatched = alladding - watchednodes
+    if unwatched:
+        configmanager.watch_attributes(
+            unwatched, ('id.uuid', 'net.*hwaddr'), remap_nodes)
+        configmanager.watch_attributes(
+            unwatched, replyattribs, clear_reply_cache)
+        watchednodes.update(unwatched)
 
 
 def remap_nodes(nodeattribs, configmanager):
-    global macmap
-    global uuidmap
     updates = configmanager.get_node_attributes(nodeattribs, ('id.uuid', 'net.*hwaddr'))
     clear_nodes(nodeattribs)
     for node in updates:
         for attrib in updates[node]:
             if attrib == 'id.uuid':
-                uuidmap[updates[node][attrib]['value'].lower()] = node
+                _map(uuidmap, nodeuuids,
+                     updates[node][attrib]['value'].lower(), node)
             elif 'hwaddr' in attrib:
-                macmap[updates[node][attrib]['value'].lower()] = node
+                _map(macmap, nodemacs,
+                     updates[node][attrib]['value'].lower(), node)
 
 
 def get_deployment_profile(node, cfg, cfd=None):
@@ -588,12 +661,35 @@ def get_deployment_profile(node, cfg, cfd=None):
             return None
     return profile
 
+def get_reply_params(node, cfg):
+    now = time.time()
+    cached = replyparams.get(node, None)
+    if cached and cached[0] > now:
+        return cached[1:]
+    cfd = cfg.get_node_attributes(node, ('deployment.*', 'collective.managercandidates'))
+    profile = get_deployment_profile(node, cfg, cfd)
+    replyparams[node] = (now + replycachettl, cfd, profile)
+    return cfd, profile
+
+
+def get_nic_config(cfg, node, ifidx):
+    now = time.time()
+    nodecfgs = niccfgs.get(node, None)
+    if nodecfgs is None:
+        nodecfgs = niccfgs[node] = {}
+    cached = nodecfgs.get(ifidx, None)
+    if cached and cached[0] > now:
+        return cached[1]
+    niccfg = netutil.get_nic_config(cfg, node, ifidx=ifidx)
+    nodecfgs[ifidx] = (now + replycachettl, niccfg)
+    return niccfg
+
+
 staticassigns = {}
 myipbypeer = {}
 def check_reply(node, info, packet, sock, cfg, reqview, addr):
     httpboot = info['architecture'] == 'uefi-httpboot'
-    cfd = cfg.get_node_attributes(node, ('deployment.*', 'collective.managercandidates'))
-    profile = get_deployment_profile(node, cfg, cfd)
+    cfd, profile = get_reply_params(node, cfg)
     if not profile:
         if time.time() > ignoremacs.get(info['hwaddr'], 0) + 90:
             ignoremacs[info['hwaddr']] = time.time()
@@ -614,7 +710,7 @@ def reply_dhcp6(node, addr, cfg, packet, cfd, profile, sock):
     if not myaddrs:
         log.log({'info': 'Unable to provide IPv6 boot services to {0}, no viable IPv6 configuration on interface index "{1}" to respond through.'.format(node, addr[-1])})
         return
-    niccfg = netutil.get_nic_config(cfg, node, ifidx=addr[-1])
+    niccfg = get_nic_config(cfg, node, addr[-1])
     ipv6addr = niccfg.get('ipv6_address', None)
     ipv6prefix = niccfg.get('ipv6_prefix', None)
     ipv6method = niccfg.get('ipv6_method', 'static')
@@ -723,7 +819,7 @@ def reply_dhcp4(node, info, packet, cfg, reqview, httpboot, cfd, profile):
     repview[28:44] = reqview[28:44]  # copy chaddr field
     gateway = None
     netmask = None
-    niccfg = netutil.get_nic_config(cfg, node, ifidx=info['netinfo']['ifidx'])
+    niccfg = get_nic_config(cfg, node, info['netinfo']['ifidx'])
     nicerr = niccfg.get('error_msg', False)
     if nicerr:
         log.log({'error': nicerr})
@@ -836,9 +932,13 @@ def reply_dhcp4(node, info, packet, cfg, reqview, httpboot, cfd, profile):
     send_raw_packet(repview, replen + 28, reqview, info)
 
 def send_raw_packet(repview, replen, reqview, info):
+    global _rawsock
     ifidx = info['netinfo']['ifidx']
-    tsock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM,
-                          socket.htons(0x800))
+    if _rawsock is None:
+        # one socket serves every reply, rather than one per reply
+        _rawsock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM,
+                                 socket.htons(0x800))
+    tsock = _rawsock
     targ = sockaddr_ll()
     bcastaddr = get_bcastaddr(ifidx)
     hwlen = len(bcastaddr)
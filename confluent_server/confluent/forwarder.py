@@ -18,8 +18,10 @@
 #It will also hijack port 3900 and do best effort..
 
 import eventlet
-import eventlet.green.select as select
 import eventlet.green.socket as socket
+import eventlet.hubs
+import os
+import time
 forwardersbyclient = {}
 relaysbysession = {}
 sessionsbyip = {}
@@ -27,20 +29,142 @@ ipsbysession = {}
 sockhandler = {}
 vidtargetbypeer = {}
 vidforwarder = None
+# Counters of each client and target pair with relays open, dropped when
+# the last of its relays closes
+relaystats = {}
 
-def handle_connection(incoming, outgoing):
-    while True:
-        r, _, _ = select.select((incoming, outgoing), (), (), 60)
-        for mysock in r:
-            data = mysock.recv(32768)
-            if not data:
-                incoming.close()
-                outgoing.close()
+try:
+    _spliceflags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+except AttributeError:
+    _spliceflags = None
+
+
+def get_relay_stats():
+    """Return byte and delay counters of forwarded connections
+
+    The splice delay is the time taken to pass each chunk read on to its
+    destination, from the kernel pipe, or by sendall where splice is not
+    available.  It does not include waiting for data to arrive.
+    """
+    stats = {}
+    for relay in relaystats:
+        relaystat = relaystats[relay]
+        stats[relay] = {
+            'active': relaystat['active'],
+            'connections': relaystat['connections'],
+            'bytesfromclient': relaystat['bytesfromclient'],
+            'bytestoclient': relaystat['bytestoclient'],
+            'maxsplicedelayms': relaystat['maxsplicedelay'] * 1000,
+            'avgsplicedelayms': (
+                relaystat['totalsplicedelay'] * 1000 / relaystat['chunks']
+                if relaystat['chunks'] else 0),
+        }
+    return stats
+
+
+def _get_relaystat(clientip, target, port):
+    relay = '{0} -> [{1}]:{2}'.format(clientip, target, port)
+    if relay not in relaystats:
+        relaystats[relay] = {
+            'relay': relay, 'active': 0, 'connections': 0,
+            'bytesfromclient': 0, 'bytestoclient': 0, 'maxsplicedelay': 0,
+            'totalsplicedelay': 0, 'chunks': 0}
+    return relaystats[relay]
+
+
+def _count_chunk(stats, direction, size, delay):
+    stats[direction] += size
+    stats['chunks'] += 1
+    stats['totalsplicedelay'] += delay
+    if delay > stats['maxsplicedelay']:
+        stats['maxsplicedelay'] = delay
+
+
+def _splice_data(src, dst, stats, direction):
+    # data goes from socket to pipe to socket within the kernel, with the
+    # hub waking us only when a socket is ready
+    srcfd = src.fileno()
+    dstfd = dst.fileno()
+    piperd, pipewr = os.pipe()
+    try:
+        while True:
+            try:
+                pending = os.splice(srcfd, pipewr, 262144, flags=_spliceflags)
+            except BlockingIOError:
+                eventlet.hubs.trampoline(srcfd, read=True)
+                continue
+            if not pending:
                 return
-            if mysock == incoming:
-                outgoing.sendall(data)
-            elif mysock == outgoing:
-                incoming.sendall(data)
+            started = time.time()
+            size = pending
+            while pending:
+                try:
+                    pending -= os.splice(piperd, dstfd, pending,
+                                         flags=_spliceflags)
+                except BlockingIOError:
+                    eventlet.hubs.trampoline(dstfd, write=True)
+            _count_chunk(stats, direction, size, time.time() - started)
+    finally:
+        os.close(piperd)
+        os.close(pipewr)
+
+
+def _copy_data(src, dst, stats, direction):
+    while True:
+        data = src.recv(262144)
+        if not data:
+            return
+        started = time.time()
+        dst.sendall(data)
+        _count_chunk(stats, direction, len(data), time.time() - started)
+
+
+def _shutdown(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except (IOError, OSError):
+        pass  # already disconnected
+
+
+def _relay_data(src, dst, stats, direction):
+    try:
+        if _spliceflags is None:
+            _copy_data(src, dst, stats, direction)
+        else:
+            _splice_data(src, dst, stats, direction)
+    except (IOError, OSError):
+        pass  # includes either side being shut down under us
+    finally:
+        # closing a socket does not wake the other direction waiting on
+        # it, shutting it down does, with an end of file
+        _shutdown(src)
+        _shutdown(dst)
+
+
+def handle_connection(incoming, outgoing, stats=None):
+    if stats is None:
+        stats = _get_relaystat(incoming.getpeername()[0],
+                               *outgoing.getpeername()[:2])
+    else:
+        # the pair may have been dropped since, while this waited to start
+        stats = relaystats.setdefault(stats['relay'], stats)
+    stats['connections'] += 1
+    stats['active'] += 1
+    try:
+        # each direction gets a thread, the end of either ends both, and
+        # the sockets are closed once neither is using them
+        toclient = eventlet.spawn(_relay_data, outgoing, incoming, stats,
+                                  'bytestoclient')
+        try:
+            _relay_data(incoming, outgoing, stats, 'bytesfromclient')
+        finally:
+            toclient.wait()
+    finally:
+        incoming.close()
+        outgoing.close()
+        stats['active'] -= 1
+        if not stats['active'] and relaystats.get(stats['relay']) is stats:
+            del relaystats[stats['relay']]
 
 
 def forward_port(sock, target, clientip, sessionid):
@@ -58,7 +182,8 @@ def forward_port(sock, target, clientip, sessionid):
         if sessionid not in relaysbysession:
             relaysbysession[sessionid] = {}
         relaysbysession[sessionid][eventlet.spawn(
-            handle_connection, conn, client)] = conn
+            handle_connection, conn, client,
+            _get_relaystat(clientip, target, 443))] = conn
 
 
 def forward_video():
@@ -76,7 +201,8 @@ def forward_video():
             conn.close()
             vidclient.close()
             continue
-        eventlet.spawn_n(handle_connection, conn, vidclient)
+        eventlet.spawn_n(handle_connection, conn, vidclient, _get_relaystat(
+            cli[0], vidtargetbypeer[cli[0]], 3900))
 
 
 def close_session(sessionid):
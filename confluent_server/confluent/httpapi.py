@@ -392,15 +392,19 @@ def _pick_mimetype(env):
     """Detect the http indicated mime to send back.
 
     Note that as it gets into the ACCEPT header honoring, it only looks for
-    application/json and else gives up and assumes html.  This is because
-    browsers are very chaotic about ACCEPT HEADER.  It is assumed that
-    XMLHttpRequest.setRequestHeader will be used by clever javascript
-    if the '.json' scheme doesn't cut it.
+    application/json (or application/x-ndjson) and else gives up and assumes
+    html.  This is because browsers are very chaotic about ACCEPT HEADER.
+    It is assumed that XMLHttpRequest.setRequestHeader will be used by clever
+    javascript if the '.json' scheme doesn't cut it.
     """
     if env['PATH_INFO'].endswith('.json'):
         return 'application/json; charset=utf-8', '.json'
+    elif env['PATH_INFO'].endswith('.ndjson'):
+        return 'application/x-ndjson; charset=utf-8', '.ndjson'
     elif env['PATH_INFO'].endswith('.html'):
         return 'text/html', '.html'
+    elif 'HTTP_ACCEPT' in env and 'application/x-ndjson' in env['HTTP_ACCEPT']:
+        return 'application/x-ndjson; charset=utf-8', ''
     elif 'HTTP_ACCEPT' in env and 'application/json' in env['HTTP_ACCEPT']:
         return 'application/json; charset=utf-8', ''
     else:
@@ -601,7 +605,7 @@ def resourcehandler(env, start_response):
     except Exception as e:
         tracelog.log(traceback.format_exc(), ltype=log.DataTypes.event,
                      event=log.Events.stacktrace)
-        start_response('500 - ' + str(e), [])
+        start_response('500 - ' + str(e), [], sys.exc_info())
         yield '500 - ' + str(e)
         return
 
@@ -877,6 +881,7 @@ def resourcehandler_backend(env, start_response):
     else:
         # normal request
         url = env['PATH_INFO']
+        url = url.replace('.ndjson', '')
         url = url.replace('.json', '')
         url = url.replace('.html', '')
         if url == '/sessions/current/info':
@@ -899,6 +904,7 @@ def resourcehandler_backend(env, start_response):
             return
         resource = '.' + url[url.rindex('/'):]
         lquerydict = copy.deepcopy(querydict)
+        started = False
         try:
             hdlr = pluginapi.handle_path(url, operation,
                                          cfgmgr, querydict)
@@ -907,19 +913,31 @@ def resourcehandler_backend(env, start_response):
                 start_response('202 Accepted', headers)
                 yield 'Request queued'
                 return
-            pagecontent = ""
             if mimetype == 'text/html':
+                pagecontent = ""
                 for datum in _assemble_html(hdlr, resource, lquerydict, url,
                                             extension):
                     pagecontent += datum
+                start_response('200 OK', headers)
+                if not isinstance(pagecontent, bytes):
+                    pagecontent = pagecontent.encode('utf-8')
+                yield pagecontent
+                return
+            if mimetype.startswith('application/x-ndjson'):
+                chunks = _stream_ndjson(hdlr, resource, url, extension)
             else:
-                for datum in _assemble_json(hdlr, resource, url, extension):
-                    pagecontent += datum
-            start_response('200 OK', headers)
-            if not isinstance(pagecontent, bytes):
-                pagecontent = pagecontent.encode('utf-8')
-            yield pagecontent
+                chunks = _stream_json(hdlr, resource, url, extension)
+            # The streams hold back output until the first result, so an
+            # error ahead of any data still gets a proper status
+            for chunk in chunks:
+                if not started:
+                    start_response('200 OK', headers)
+                    started = True
+                yield chunk
         except exc.ConfluentException as e:
+            if started:
+                # too late for a status, cut the response short
+                raise
             if ((not isinstance(e, exc.LockedCredentials)) and
                     e.apierrorcode == 500):
                 # raise generics to trigger the tracelog
@@ -983,12 +1001,7 @@ def _assemble_html(responses, resource, querydict, url, extension):
                '</form></body></html>')
 
 
-def _assemble_json(responses, resource=None, url=None, extension=None):
-    #NOTE(jbjohnso) I'm considering giving up on yielding bit by bit
-    #in json case over http.  Notably, duplicate key values from plugin
-    #overwrite, but we'd want to preserve them into an array instead.
-    #the downside is that http would just always blurt it ll out at
-    #once and hold on to all the data in memory
+def _base_links(resource, url, extension):
     links = {}
     if resource is not None:
         links['self'] = {"href": resource + extension}
@@ -998,49 +1011,142 @@ def _assemble_json(responses, resource=None, url=None, extension=None):
             links['collection'] = {"href": "../" + extension}
         else:
             links['collection'] = {"href": "./" + extension}
+    return links
+
+
+def _merge_links(links, rsp, extension):
+    haldata = rsp.raw()
+    for hk in haldata:
+        if 'href' in haldata[hk]:
+            if isinstance(haldata[hk]['href'], int):
+                haldata[hk]['href'] = str(haldata[hk]['href'])
+            haldata[hk]['href'] += extension
+        if hk in links:
+            if isinstance(links[hk], list):
+                links[hk].append(haldata[hk])
+            else:
+                links[hk] = [links[hk], haldata[hk]]
+        elif hk == 'item':
+            links[hk] = [haldata[hk],]
+        else:
+            links[hk] = haldata[hk]
+
+
+def _merge_rspdata(rspdata, rsp, dk):
+    if dk in rspdata:
+        if isinstance(rspdata[dk], list):
+            if isinstance(rsp[dk], list):
+                rspdata[dk].extend(rsp[dk])
+            else:
+                rspdata[dk].append(rsp[dk])
+        else:
+            rspdata[dk] = [rspdata[dk], rsp[dk]]
+    else:
+        if dk == 'databynode' or dk == 'asyncresponse':
+            # a quirk, databynode suggests noderange
+            # multi response.  This should *always* be a list,
+            # even if it will be length 1
+            rspdata[dk] = [rsp[dk]]
+        else:
+            rspdata[dk] = rsp[dk]
+
+
+def _assemble_json(responses, resource=None, url=None, extension=None):
+    #NOTE(jbjohnso) I'm considering giving up on yielding bit by bit
+    #in json case over http.  Notably, duplicate key values from plugin
+    #overwrite, but we'd want to preserve them into an array instead.
+    #the downside is that http would just always blurt it ll out at
+    #once and hold on to all the data in memory
+    links = _base_links(resource, url, extension)
     rspdata = {}
     for rsp in responses:
         if isinstance(rsp, confluent.messages.LinkRelation):
-            haldata = rsp.raw()
-            for hk in haldata:
-                if 'href' in haldata[hk]:
-                    if isinstance(haldata[hk]['href'], int):
-                        haldata[hk]['href'] = str(haldata[hk]['href'])
-                    haldata[hk]['href'] += extension
-                if hk in links:
-                    if isinstance(links[hk], list):
-                        links[hk].append(haldata[hk])
-                    else:
-                        links[hk] = [links[hk], haldata[hk]]
-                elif hk == 'item':
-                    links[hk] = [haldata[hk],]
-                else:
-                    links[hk] = haldata[hk]
+            _merge_links(links, rsp, extension)
         else:
             rsp = rsp.raw()
             for dk in rsp:
-                if dk in rspdata:
-                    if isinstance(rspdata[dk], list):
-                        if isinstance(rsp[dk], list):
-                            rspdata[dk].extend(rsp[dk])
-                        else:
-                            rspdata[dk].append(rsp[dk])
-                    else:
-                        rspdata[dk] = [rspdata[dk], rsp[dk]]
-                else:
-                    if dk == 'databynode' or dk == 'asyncresponse':
-                        # a quirk, databynode suggests noderange
-                        # multi response.  This should *always* be a list,
-                        # even if it will be length 1
-                        rspdata[dk] = [rsp[dk]]
-                    else:
-                        rspdata[dk] = rsp[dk]
+                _merge_rspdata(rspdata, rsp, dk)
     rspdata["_links"] = links
     tlvdata.unicode_dictvalues(rspdata)
     yield util.stringify(json.dumps(
         rspdata, sort_keys=True, indent=4, ensure_ascii=False).encode('utf-8'))
 
 
+def _json_value(value, depth):
+    # render a value as it would be nested depth levels into the document
+    value = {'v': value}
+    tlvdata.unicode_dictvalues(value)
+    return json.dumps(value['v'], sort_keys=True, indent=4,
+                      ensure_ascii=False).replace('\n', '\n' + '    ' * depth)
+
+
+def _stream_json(responses, resource=None, url=None, extension=None):
+    """Incrementally serialize responses as a json document
+
+    The document is the same as from _assemble_json, but databynode entries
+    are sent as they arrive rather than after the last one, with the other
+    keys and _links following at the end.  Nothing is produced until there
+    is something to send.
+    """
+    links = _base_links(resource, url, extension)
+    rspdata = {}
+    nodedata = False
+    for rsp in responses:
+        if isinstance(rsp, confluent.messages.LinkRelation):
+            _merge_links(links, rsp, extension)
+            continue
+        rsp = rsp.raw()
+        for dk in rsp:
+            if dk != 'databynode':
+                _merge_rspdata(rspdata, rsp, dk)
+                continue
+            entries = rsp[dk]
+            if not isinstance(entries, list):
+                entries = [entries]
+            for entry in entries:
+                if nodedata:
+                    chunk = ',\n        '
+                else:
+                    chunk = '{\n    "databynode": [\n        '
+                    nodedata = True
+                chunk += _json_value(entry, 2)
+                yield chunk.encode('utf-8')
+    if nodedata:
+        chunk = '\n    ],\n    '
+    else:
+        chunk = '{\n    '
+    for dk in sorted(rspdata):
+        chunk += '{0}: {1},\n    '.format(json.dumps(dk),
+                                          _json_value(rspdata[dk], 1))
+    chunk += '"_links": {0}\n}}'.format(_json_value(links, 1))
+    yield chunk.encode('utf-8')
+
+
+def _stream_ndjson(responses, resource=None, url=None, extension=None):
+    """Serialize responses as newline delimited json
+
+    Each response is a line of its own as it arrives, with _links last.
+    """
+    links = _base_links(resource, url, extension)
+    for rsp in responses:
+        if isinstance(rsp, confluent.messages.LinkRelation):
+            _merge_links(links, rsp, extension)
+            continue
+        if hasattr(rsp, 'encoded'):
+            sdata = rsp.encoded()
+            if sdata is not None:
+                yield sdata + b'\n'
+                continue
+        rsp = rsp.raw()
+        tlvdata.unicode_dictvalues(rsp)
+        yield (json.dumps(rsp, ensure_ascii=False, separators=(',', ':')) +
+               '\n').encode('utf-8')
+    links = {'_links': links}
+    tlvdata.unicode_dictvalues(links)
+    yield (json.dumps(links, ensure_ascii=False, separators=(',', ':')) +
+           '\n').encode('utf-8')
+
+
 def serve(bind_host, bind_port):
     # TODO(jbjohnso): move to unix socket and explore
     # either making apache deal with it
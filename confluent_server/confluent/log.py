@@ -112,6 +112,23 @@ except ImportError:
 
 MIDNIGHT = 24 * 60 * 60
 _loggers = {}
+_binrecord = struct.Struct(">BBIHIBBH")
+_strftimecache = {}
+
+
+def _cached_strftime(fmt, tstamp):
+    # log timestamps have a resolution of a second, so a burst of records
+    # can share one formatting
+    try:
+        cachedstamp, formatted = _strftimecache[fmt]
+        if cachedstamp == tstamp:
+            return formatted
+    except KeyError:
+        pass
+    formatted = time.strftime(fmt, time.localtime(tstamp))
+    _strftimecache[fmt] = (tstamp, formatted)
+    return formatted
+
 
 class Events(object):
     (
@@ -153,39 +170,29 @@ class BaseRotatingHandler(object):
             self.binfile.seek(0, 2)
         return self.textfile, self.binfile
 
-    def try_emit(self, binrecord, textrecord):
+    def try_rollover(self, rolling_type):
         """
-        Emit a record.
-
-        Output the record to the file, catering for rollover as described
-        in doRollover().
+        Perform a rollover, returning the names the files were moved to.
         """
         global logfull
         try:
-            rolling_type = self.shouldRollover(binrecord, textrecord)
-            if rolling_type:
-                flock(self.textfile, LOCK_UN)
-                return self.doRollover(rolling_type)
-            return None
+            return self.doRollover(rolling_type)
         except (IOError, OSError) as e:
             if not daemonized:
                 raise
             logfull = True
 
-
-    def emit(self, binrecord, textrecord):
+    def emit_batch(self, binrecords, textrecords):
+        """
+        Append a batch of records, with one write to each file.
+        """
         global logfull
         try:
-            if self.textfile is None:
-                self.textfile = open(self.textpath, mode='ab')
-            if self.binfile is None:
-                self.binfile = open(self.binpath, mode='ab')
-            if not isinstance(textrecord, bytes):
-                textrecord = textrecord.encode('utf-8')
-            self.textfile.write(textrecord)
-            self.binfile.write(binrecord)
-            self.textfile.flush()
-            self.binfile.flush()
+            textfile, binfile = self.open()
+            textfile.write(b''.join(textrecords))
+            binfile.write(b''.join(binrecords))
+            textfile.flush()
+            binfile.flush()
         except (IOError, OSError) as e:
             if not daemonized:
                 raise
@@ -348,15 +355,22 @@ class TimedAndSizeRotatingFileHandler(BaseRotatingHandler):
         Determine if rollover should occur.
         Just compare times.
         """
+        self.open()
+        return self.rolloverNeeded(
+            int(time.time()), self.textfile.tell() + len(textrecord),
+            self.binfile.tell() + len(binrecord))
+
+    def rolloverNeeded(self, currentTime, textsize, binsize):
+        """
+        Determine if rollover should occur for files grown to given sizes.
+        """
         # time rolling first
-        t = int(time.time())
-        if t >= self.rolloverAt:
+        if currentTime >= self.rolloverAt:
             return RollingTypes.time_rolling
-        self.open()
         if self.maxBytes > 0:                   # are we rolling over?
-            if self.textfile.tell() + len(textrecord) >= self.maxBytes:
+            if textsize >= self.maxBytes:
                 return RollingTypes.size_rolling
-            if self.binfile.tell() + len(binrecord) >= self.maxBytes:
+            if binsize >= self.maxBytes:
                 return RollingTypes.size_rolling
         return RollingTypes.no_rolling
 
@@ -563,67 +577,108 @@ class Logger(object):
         self.logentries = collections.deque()
 
     def writedata(self):
+        # Everything pending is written as one batch under a single lock,
+        # stopping short only where a rollover is needed
         while self.logentries:
             textfile, binfile = self.handler.open()
-            entry = self.logentries.popleft()
-            ltype = entry[0]
-            tstamp = entry[1]
-            data = entry[2]
-            evtdata = entry[3]
-            if len(data) > 65535:
-                # our max log entry is 65k, take only the first 65k and put
-                # rest back on as a continuation
-                entry[2] = data[65535:]
-                self.logentries.appendleft(entry)
-                data = data[:65535]
-            textdate = ''
-            if self.isconsole and ltype != 2:
-                textdate = time.strftime(
-                    '[%m/%d %H:%M:%S ', time.localtime(tstamp))
-                if ltype == DataTypes.event and evtdata in Events.logstr:
-                    textdate += Events.logstr[evtdata]
-            elif not self.isconsole:
-                textdate = time.strftime(
-                    '%b %d %H:%M:%S ', time.localtime(tstamp))
+            binrecords = []
+            textrecords = []
+            rolling_type = RollingTypes.no_rolling
             flock(textfile, LOCK_EX)
             try:
-                offset = textfile.tell() + len(textdate)
-                datalen = len(data)
-                eventaux = entry[4]
-                if eventaux is None:
-                    eventaux = 0
-                # metadata length is always 16 for this code at the moment
-                binrecord = struct.pack(
-                    ">BBIHIBBH", 16, ltype, offset, datalen, tstamp, evtdata,
-                    eventaux, 0)
-                if self.isconsole:
-                    if ltype == 2:
-                        textrecord = data
+                textsize = textfile.tell()
+                binsize = binfile.tell()
+                now = int(time.time())
+                while self.logentries:
+                    entry = self.logentries.popleft()
+                    ltype = entry[0]
+                    tstamp = entry[1]
+                    data = entry[2]
+                    evtdata = entry[3]
+                    if len(data) > 65535:
+                        # our max log entry is 65k, take only the first 65k
+                        # and put rest back on as a continuation
+                        entry[2] = data[65535:]
+                        self.logentries.appendleft(entry)
+                        data = data[:65535]
+                        entry = [ltype, tstamp, data, evtdata, entry[4]]
+                    textdate = ''
+                    if self.isconsole and ltype != 2:
+                        textdate = _cached_strftime('[%m/%d %H:%M:%S ',
+                                                    tstamp)
+                        if (ltype == DataTypes.event and
+                                evtdata in Events.logstr):
+                            textdate += Events.logstr[evtdata]
+                    elif not self.isconsole:
+                        textdate = _cached_strftime('%b %d %H:%M:%S ',
+                                                    tstamp)
+                    datalen = len(data)
+                    eventaux = entry[4]
+                    if eventaux is None:
+                        eventaux = 0
+                    try:
+                        # metadata length is always 16 for this code at the
+                        # moment
+                        binrecord = _binrecord.pack(
+                            16, ltype, textsize + len(textdate), datalen,
+                            tstamp, evtdata, eventaux, 0)
+                    except struct.error:
+                        binrecord = None
+                    if self.isconsole:
+                        if ltype == 2:
+                            textrecord = data
+                        else:
+                            if not isinstance(textdate, bytes):
+                                textdate = textdate.encode('utf-8')
+                            if not isinstance(data, bytes):
+                                data = data.encode('utf-8')
+                            textrecord = textdate + data + b']'
                     else:
-                        if not isinstance(textdate, bytes):
-                            textdate = textdate.encode('utf-8')
-                        if not isinstance(data, bytes):
-                            data = data.encode('utf-8')
-                        textrecord = textdate + data + b']'
-                else:
-                    textrecord = textdate + data
-                    if not textrecord.endswith('\n'):
-                        textrecord += '\n'
-                files = self.handler.try_emit(binrecord, textrecord)
-            except struct.error:
-                files = self.handler.doRollover(RollingTypes.size_rolling)
+                        textrecord = textdate + data
+                        if not textrecord.endswith('\n'):
+                            textrecord += '\n'
+                    if not isinstance(textrecord, bytes):
+                        textrecord = textrecord.encode('utf-8')
+                    if binrecord is None:
+                        if not (textsize or binsize):
+                            # not representable even in a fresh file
+                            continue
+                        rolling_type = RollingTypes.size_rolling
+                    elif textsize or binsize:
+                        rolling_type = self.handler.rolloverNeeded(
+                            now, textsize + len(textrecord),
+                            binsize + len(binrecord))
+                    else:
+                        # a record too big for an empty file goes in anyway,
+                        # but an empty file is still due to roll on time
+                        rolling_type = self.handler.rolloverNeeded(now, 0, 0)
+                    if rolling_type:
+                        self.logentries.appendleft(entry)
+                        pending = (binrecord, textrecord)
+                        break
+                    binrecords.append(binrecord)
+                    textrecords.append(textrecord)
+                    textsize += len(textrecord)
+                    binsize += len(binrecord)
+                if textrecords:
+                    self.handler.emit_batch(binrecords, textrecords)
             finally:
                 try:
                     flock(textfile, LOCK_UN)
                 except Exception:
                     pass
-            if not files:
-                self.handler.emit(binrecord, textrecord)
-            else:
+            if rolling_type:
+                files = self.handler.try_rollover(rolling_type)
+                if not files:
+                    # unable to roll, write to the current file instead
+                    self.logentries.popleft()
+                    binrecord, textrecord = pending
+                    if binrecord is not None:
+                        self.handler.emit_batch([binrecord], [textrecord])
+                    continue
                 # Log the rolling event at first, then log the last data
                 # which cause the rolling event.
                 to_bfile, to_tfile = files
-                self.logentries.appendleft(entry)
                 roll_data = json.dumps({'previouslogfile': to_tfile})
                 self.logentries.appendleft([DataTypes.event, tstamp, roll_data,
                                             Events.logrollover, None])
@@ -23,6 +23,7 @@ import confluent.config.configmanager as cfm
 import confluent.config.conf as cfgfile
 from copy import deepcopy
 from datetime import datetime
+import confluent.tlvdata as tlvdata
 import confluent.util as util
 import msgpack
 import json
@@ -85,12 +86,33 @@ def _htmlify_structure(indict):
     return ret + '</ul>'
 
 
+# classes already vetted by msg_deserialize, by name
+_msgclasses = {}
+
+
 def msg_deserialize(packed):
     m = msgpack.unpackb(packed, raw=False)
-    cls = globals()[m[0]]
-    if issubclass(cls, ConfluentMessage) or issubclass(cls, ConfluentNodeError):
-        return cls(*m[1:])
-    raise Exception("Unknown shenanigans")
+    try:
+        cls = _msgclasses[m[0]]
+    except KeyError:
+        cls = globals()[m[0]]
+        if not (issubclass(cls, ConfluentMessage) or
+                issubclass(cls, ConfluentNodeError)):
+            raise Exception("Unknown shenanigans")
+        _msgclasses[m[0]] = cls
+    rsp = cls(*m[1:])
+    # relaying the message on can reuse the form it arrived in
+    rsp._packed = packed
+    return rsp
+
+
+def _encode_raw(rawdata):
+    if not isinstance(rawdata, dict):
+        # not json on the socket api, leave it to tlvdata.send
+        return None
+    tlvdata.unicode_dictvalues(rawdata)
+    return json.dumps(
+        rawdata, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
 class ConfluentMessage(object):
     apicode = 200
@@ -114,10 +136,23 @@ class ConfluentMessage(object):
         return jsonsnippet
 
     def serialize(self):
+        if getattr(self, '_packed', None):
+            return self._packed
         msg = [self.__class__.__name__]
         msg.extend(self.myargs)
         return msgpack.packb(msg, use_bin_type=False)
 
+    def encoded(self):
+        """Return the raw form as compact utf-8 json
+
+        This is the payload sockapi sends for the message, and a line of
+        ndjson over http.  The result is kept until strip_node changes the
+        message.  None is returned if the raw form is not a dict.
+        """
+        if getattr(self, '_encoded', None) is None:
+            self._encoded = _encode_raw(self.raw())
+        return self._encoded
+
     @classmethod
     def deserialize(cls, data):
         return cls(*data)
@@ -132,6 +167,7 @@ class ConfluentMessage(object):
         return {'databynode': self.kvpairs}
 
     def strip_node(self, node):
+        self._encoded = None
         self.stripped = True
         if self.kvpairs is not None:
             self.kvpairs = self.kvpairs[node]
@@ -233,10 +269,17 @@ class ConfluentNodeError(object):
         self.error = errorstr
 
     def serialize(self):
+        if getattr(self, '_packed', None):
+            return self._packed
         return msgpack.packb(
             [self.__class__.__name__, self.node, self.error],
             use_bin_type=False)
 
+    def encoded(self):
+        if getattr(self, '_encoded', None) is None:
+            self._encoded = _encode_raw(self.raw())
+        return self._encoded
+
     @classmethod
     def deserialize(cls, data):
         return cls(*data)
@@ -18,27 +18,102 @@
 
 import confluent.netutil as netutil
 import confluent.util as util
+import errno
 import os
+import eventlet
+import eventlet.event as event
 import eventlet.semaphore as semaphore
 import eventlet.green.socket as socket
 import struct
+import time
+
+RTMGRP_NEIGH = 4
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
 
 
 def msg_align(len):
     return (len + 3) & ~3
 
 
+# ip address to hardware address, and hardware address to set of addresses
 neightable = {}
+hwaddrtable = {}
 neightime = 0
+neighwaiters = {}
+neighstats = {'refreshes': 0, 'lastrefresh': 0, 'updates': 0,
+              'lookups': 0, 'lookuptime': 0, 'misses': 0}
+monitoring = False
+_monitor = None
 
 import re
 
 neighlock = semaphore.Semaphore()
 
+
+def _iter_neigh(v):
+    # yield message type, ip and hwaddr of the unicast neighbor entries in a
+    # buffer from netlink, with a type of NLMSG_DONE at the end of a dump
+    while len(v):
+        length, typ = struct.unpack('IH', v[:6])
+        if typ == NLMSG_DONE:
+            yield typ, None, None
+            return
+        if typ in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            hlen = struct.calcsize('BIHBB')
+            _, idx, state, flags, ntyp = struct.unpack('BIHBB', v[16:16+hlen])
+            if ntyp == 1:  # only handle unicast entries
+                curraddr = None
+                currip = None
+                rta = v[16+hlen:length]
+                while len(rta):
+                    rtalen, rtatyp = struct.unpack('HH', rta[:4])
+                    if rtatyp == 2:  # hwaddr
+                        curraddr = rta[4:rtalen].tobytes()
+                        if len(curraddr) == 20:
+                            curraddr = curraddr[12:]
+                    elif rtatyp == 1:  # ip address
+                        currip = rta[4:rtalen].tobytes()
+                    rta = rta[msg_align(rtalen):]
+                    if not rtalen:
+                        break
+                if currip:
+                    yield typ, currip, curraddr
+        if not length:
+            return
+        v = v[msg_align(length):]
+
+
+def _set_neigh(ipaddr, hwaddr):
+    oldaddr = neightable.get(ipaddr, None)
+    if oldaddr == hwaddr:
+        return
+    if oldaddr:
+        _drop_neigh(ipaddr)
+    neightable[ipaddr] = hwaddr
+    if hwaddr not in hwaddrtable:
+        hwaddrtable[hwaddr] = set([])
+    hwaddrtable[hwaddr].add(ipaddr)
+    for waiter in neighwaiters.pop(ipaddr, ()):
+        waiter.send(hwaddr)
+
+
+def _drop_neigh(ipaddr):
+    hwaddr = neightable.pop(ipaddr, None)
+    if hwaddr in hwaddrtable:
+        hwaddrtable[hwaddr].discard(ipaddr)
+        if not hwaddrtable[hwaddr]:
+            del hwaddrtable[hwaddr]
+
+
 def _update_neigh():
     global neightable
+    global hwaddrtable
     global neightime
     neightime = os.times()[4]
+    started = time.time()
     s = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
     s.bind((0, 0))
     # RTM_GETNEIGH
@@ -48,65 +123,166 @@ def _update_neigh():
     ndmsg=  b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
     s.sendall(nlhdr + ndmsg)
     neightable = {}
+    hwaddrtable = {}
     try:
-        while True:
+        done = False
+        while not done:
             pdata = s.recv(65536)
-            v = memoryview(pdata)
-            if struct.unpack('H', v[4:6])[0] == 3:
-                break
-            while len(v):
-                length, typ = struct.unpack('IH', v[:6])
-                if typ == 28:
-                    hlen = struct.calcsize('BIHBB')
-                    _, idx, state, flags, typ = struct.unpack('BIHBB', v[16:16+hlen])
-                    if typ == 1:  # only handle unicast entries
-                        curraddr = None
-                        currip = None
-                        rta = v[16+hlen:length]
-                        while len(rta):
-                            rtalen, rtatyp = struct.unpack('HH', rta[:4])
-                            if rtatyp == 2:  # hwaddr
-                                curraddr = rta[4:rtalen].tobytes()
-                                if len(curraddr) == 20:
-                                    curraddr = curraddr[12:]
-                            elif rtatyp == 1:  # ip address
-                                currip = rta[4:rtalen].tobytes()
-                            rta = rta[msg_align(rtalen):]
-                            if not rtalen:
-                                break
-                        if curraddr and currip:
-                            neightable[currip] = curraddr
-                v = v[msg_align(length):]
+            for typ, currip, curraddr in _iter_neigh(memoryview(pdata)):
+                if typ == NLMSG_DONE:
+                    done = True
+                elif curraddr:
+                    _set_neigh(currip, curraddr)
     finally:
         s.close()
+    neighstats['refreshes'] += 1
+    neighstats['lastrefresh'] = time.time() - started
 
 
-def get_hwaddr(ipaddr):
+def _monitor_neigh():
+    # Follow neighbor changes as the kernel announces them, starting over
+    # with a full dump if announcements were lost
+    global monitoring
+    while True:
+        s = None
+        try:
+            s = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                              socket.NETLINK_ROUTE)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4194304)
+            s.bind((0, RTMGRP_NEIGH))
+            with neighlock:
+                _update_neigh()
+            monitoring = True
+            while True:
+                pdata = s.recv(65536)
+                for typ, currip, curraddr in _iter_neigh(memoryview(pdata)):
+                    neighstats['updates'] += 1
+                    if typ == RTM_NEWNEIGH and curraddr:
+                        _set_neigh(currip, curraddr)
+                    elif typ in (RTM_NEWNEIGH, RTM_DELNEIGH):
+                        # deleted, or no longer has a usable address
+                        _drop_neigh(currip)
+        except socket.error as e:
+            monitoring = False
+            if e.errno != errno.ENOBUFS:
+                eventlet.sleep(5)
+        except Exception:
+            monitoring = False
+            eventlet.sleep(5)
+        finally:
+            if s:
+                s.close()
+
+
+def _start_monitor():
+    global _monitor
+    if _monitor is None:
+        _monitor = eventlet.spawn(_monitor_neigh)
+
+
+def _to_ipn(ipaddr):
     if '%' in ipaddr:
         ipaddr, _ = ipaddr.split('%', 1)
-    hwaddr = None
-    if os.name == 'nt':
-        return hwaddr
     if ':' in ipaddr:
         ipaddr = socket.inet_pton(socket.AF_INET6, ipaddr)
     elif '.' in ipaddr:
         ipaddr = socket.inet_pton(socket.AF_INET, ipaddr)
-    with neighlock:
-        updated = False
-        if os.times()[4] > (neightime + 30):
-            _update_neigh()
-            updated = True
+    return ipaddr
+
+
+def _format_hwaddr(hwaddr):
+    return ':'.join(['{:02x}'.format(x) for x in bytearray(hwaddr)])
+
+
+def get_hwaddr(ipaddr):
+    hwaddr = None
+    if os.name == 'nt':
+        return hwaddr
+    ipaddr = _to_ipn(ipaddr)
+    _start_monitor()
+    started = time.time()
+    if monitoring:
         hwaddr = neightable.get(ipaddr, None)
         if not hwaddr and not netutil.ipn_is_local(ipaddr):
             hwaddr = False
-        if hwaddr == None and not updated:
-            _update_neigh()
+    else:
+        with neighlock:
+            updated = False
+            if os.times()[4] > (neightime + 30):
+                _update_neigh()
+                updated = True
             hwaddr = neightable.get(ipaddr, None)
+            if not hwaddr and not netutil.ipn_is_local(ipaddr):
+                hwaddr = False
+            if hwaddr == None and not updated:
+                _update_neigh()
+                hwaddr = neightable.get(ipaddr, None)
+    neighstats['lookups'] += 1
+    neighstats['lookuptime'] += time.time() - started
     if hwaddr:
-        hwaddr = ':'.join(['{:02x}'.format(x) for x in bytearray(hwaddr)])
+        hwaddr = _format_hwaddr(hwaddr)
+    else:
+        neighstats['misses'] += 1
     return hwaddr
 
 
+def wait_for_hwaddr(ipaddr, timeout):
+    """Get the hardware address of a neighbor, waiting for it to appear
+
+    :param ipaddr: The ip address of the neighbor
+    :param timeout: How many seconds to wait for the neighbor entry
+    :returns: The hardware address, or None if not found in time
+    """
+    hwaddr = get_hwaddr(ipaddr)
+    if hwaddr or hwaddr is False or os.name == 'nt':
+        return hwaddr
+    if not monitoring:
+        # nothing to be told by, check back periodically
+        deadline = os.times()[4] + timeout
+        while not hwaddr and os.times()[4] < deadline:
+            eventlet.sleep(0.01)
+            hwaddr = get_hwaddr(ipaddr)
+        return hwaddr
+    ipaddr = _to_ipn(ipaddr)
+    waiter = event.Event()
+    if ipaddr not in neighwaiters:
+        neighwaiters[ipaddr] = []
+    neighwaiters[ipaddr].append(waiter)
+    with eventlet.Timeout(timeout, False):
+        hwaddr = _format_hwaddr(waiter.wait())
+    if not waiter.ready():
+        waiters = neighwaiters.get(ipaddr, [])
+        if waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del neighwaiters[ipaddr]
+    return hwaddr
+
+
+def get_ipaddrs(hwaddr):
+    """Get the ip addresses currently seen in use by a hardware address"""
+    hwaddr = bytes(bytearray(int(x, 16) for x in hwaddr.split(':')))
+    ipaddrs = []
+    for ipaddr in list(hwaddrtable.get(hwaddr, ())):
+        if len(ipaddr) == 4:
+            ipaddrs.append(socket.inet_ntop(socket.AF_INET, ipaddr))
+        else:
+            ipaddrs.append(socket.inet_ntop(socket.AF_INET6, ipaddr))
+    return ipaddrs
+
+
+def get_stats():
+    """Return neighbor table size, refresh and lookup counters"""
+    stats = dict(neighstats)
+    stats['entries'] = len(neightable)
+    stats['monitoring'] = monitoring
+    stats['lastrefreshms'] = stats.pop('lastrefresh') * 1000
+    lookuptime = stats.pop('lookuptime')
+    stats['avglookupms'] = (lookuptime * 1000 / stats['lookups']
+                            if stats['lookups'] else 0)
+    return stats
+
+
 if __name__ == '__main__':
     import sys
     print(repr(get_hwaddr(sys.argv[1])))
@@ -17,6 +17,7 @@
 
 
 import confluent.exceptions as exc
+import confluent.resolver as resolver
 import codecs
 import netifaces
 import struct
@@ -64,13 +65,13 @@ def ip_on_same_subnet(first, second, prefix):
         first = first.replace('::ffff:', '')
     if second.startswith('::ffff:') and '.' in second:
         second = second.replace('::ffff:', '')
-    addrinf = socket.getaddrinfo(first, None, 0, socket.SOCK_STREAM)[0]
+    addrinf = resolver.getaddrinfo(first, None, 0, socket.SOCK_STREAM)[0]
     fam = addrinf[0]
     if '%' in addrinf[-1][0]:
         return False
     ip = socket.inet_pton(fam, addrinf[-1][0])
     ip = int(codecs.encode(bytes(ip), 'hex'), 16)
-    addrinf = socket.getaddrinfo(second, None, 0, socket.SOCK_STREAM)[0]
+    addrinf = resolver.getaddrinfo(second, None, 0, socket.SOCK_STREAM)[0]
     if fam != addrinf[0]:
         return False
     txtaddr = addrinf[-1][0].split('%')[0]
@@ -199,7 +200,7 @@ class NetManager(object):
             if ipv4addr:
                 try:
                     luaddr = ipv4addr.split('/', 1)[0]
-                    for ai in socket.getaddrinfo(luaddr, 0, socket.AF_INET, socket.SOCK_STREAM):
+                    for ai in resolver.getaddrinfo(luaddr, 0, socket.AF_INET, socket.SOCK_STREAM):
                         ipv4addr.replace(luaddr, ai[-1][0])
                 except socket.gaierror:
                     pass
@@ -207,7 +208,7 @@ class NetManager(object):
                 currname = attribs.get('hostname', self.node).split()[0]
                 if currname and currname not in self.consumednames4:
                     try:
-                        for ai in socket.getaddrinfo(currname, 0, socket.AF_INET, socket.SOCK_STREAM):
+                        for ai in resolver.getaddrinfo(currname, 0, socket.AF_INET, socket.SOCK_STREAM):
                             ipv4addr = ai[-1][0]
                             self.consumednames4.add(currname)
                     except socket.gaierror:
@@ -224,7 +225,7 @@ class NetManager(object):
             ipv6addr = attribs.get('ipv6_address', None)
             if ipv6addr:
                 try:
-                    for ai in socket.getaddrinfo(ipv6addr, 0, socket.AF_INET6, socket.SOCK_STREAM):
+                    for ai in resolver.getaddrinfo(ipv6addr, 0, socket.AF_INET6, socket.SOCK_STREAM):
                         ipv6addr = ai[-1][0]
                 except socket.gaierror:
                     pass
@@ -232,7 +233,7 @@ class NetManager(object):
                 currname = attribs.get('hostname', self.node).split()[0]
                 if currname and currname not in self.consumednames6:
                     try:
-                        for ai in socket.getaddrinfo(currname, 0, socket.AF_INET6, socket.SOCK_STREAM):
+                        for ai in resolver.getaddrinfo(currname, 0, socket.AF_INET6, socket.SOCK_STREAM):
                             ipv6addr = ai[-1][0]
                             self.consumednames6.add(currname)
                     except socket.gaierror:
@@ -429,12 +430,12 @@ def get_nic_config(configmanager, node, ip=None, mac=None, ifidx=None,
     ipbynodename = None
     ip6bynodename = None
     try:
-        for addr in socket.getaddrinfo(node, 0, socket.AF_INET, socket.SOCK_DGRAM):
+        for addr in resolver.getaddrinfo(node, 0, socket.AF_INET, socket.SOCK_DGRAM):
             ipbynodename = addr[-1][0]
     except socket.gaierror:
         pass
     try:
-        for addr in socket.getaddrinfo(node, 0, socket.AF_INET6, socket.SOCK_DGRAM):
+        for addr in resolver.getaddrinfo(node, 0, socket.AF_INET6, socket.SOCK_DGRAM):
                 ip6bynodename = addr[-1][0]
     except socket.gaierror:
         pass
@@ -469,7 +470,7 @@ def get_nic_config(configmanager, node, ip=None, mac=None, ifidx=None,
                 candgw = cfgbyname[candidate].get('ipv{}_gateway'.format(nver), None)
                 if candip:
                     try:
-                        for inf in socket.getaddrinfo(candip, 0, fam, socket.SOCK_STREAM):
+                        for inf in resolver.getaddrinfo(candip, 0, fam, socket.SOCK_STREAM):
                             candipn = socket.inet_pton(fam, inf[-1][0])
                         if ipn_on_same_subnet(fam, svrip, candipn, prefix):
                             bestsrvbyfam[fam] = svrip
@@ -487,7 +488,7 @@ def get_nic_config(configmanager, node, ip=None, mac=None, ifidx=None,
                     except Exception as e:
                         cfgdata['error_msg'] = "Error trying to evaluate net.*ipv4_address attribute value '{0}' on {1}: {2}".format(candip, node, str(e))
                 elif candgw:
-                    for inf in socket.getaddrinfo(candgw, 0, fam, socket.SOCK_STREAM):
+                    for inf in resolver.getaddrinfo(candgw, 0, fam, socket.SOCK_STREAM):
                         candgwn = socket.inet_pton(fam, inf[-1][0])
                     if ipn_on_same_subnet(fam, svrip, candgwn, prefix):
                         candgws.append((fam, candgwn, prefix))
@@ -565,7 +566,7 @@ def get_nic_config(configmanager, node, ip=None, mac=None, ifidx=None,
                 if gw is None or not gw:
                     continue
                 gwn = socket.inet_pton(fam, gw)
-                ip = socket.getaddrinfo(ip, 0, proto=socket.IPPROTO_TCP, family=fam)[-1][-1][0]
+                ip = resolver.getaddrinfo(ip, 0, proto=socket.IPPROTO_TCP, family=fam)[-1][-1][0]
                 ipn = socket.inet_pton(fam, ip)
                 if ipn_on_same_subnet(fam, ipn, gwn, prefix):
                     cfgdata['ipv{}_gateway'.format(nver)] = gw
@@ -638,7 +639,7 @@ def get_prefix_len_for_ip(ip):
         plen = int(plen)
     myaddrs = get_my_addresses()
     found = False
-    for inf in socket.getaddrinfo(ip, 0, 0, socket.SOCK_DGRAM):
+    for inf in resolver.getaddrinfo(ip, 0, 0, socket.SOCK_DGRAM):
         if plen:
             yield (inf[0], plen)
             return
@@ -664,12 +665,12 @@ def addresses_match(addr1, addr2):
     """
     if '%' in addr1 or '%' in addr2:
         return False
-    for addrinfo in socket.getaddrinfo(addr1, 0, 0, socket.SOCK_STREAM):
+    for addrinfo in resolver.getaddrinfo(addr1, 0, 0, socket.SOCK_STREAM):
         rootaddr1 = socket.inet_pton(addrinfo[0], addrinfo[4][0])
         if addrinfo[0] == socket.AF_INET6 and rootaddr1[:12] == b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff':
             # normalize to standard IPv4
             rootaddr1 = rootaddr1[-4:]
-        for otherinfo in socket.getaddrinfo(addr2, 0, 0, socket.SOCK_STREAM):
+        for otherinfo in resolver.getaddrinfo(addr2, 0, 0, socket.SOCK_STREAM):
             otheraddr = socket.inet_pton(otherinfo[0], otherinfo[4][0])
             if otherinfo[0] == socket.AF_INET6 and otheraddr[:12] == b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff':
                 otheraddr = otheraddr[-4:]
@@ -231,34 +231,42 @@ def _extract_neighbor_data_b(args):
     idxtoportid = {}
     _chassisidbyswitch[switch] = sanitize(list(
         conn.walk('1.0.8802.1.1.2.1.3.2'))[0][1])
-    for oidindex in conn.walk('1.0.8802.1.1.2.1.3.7.1.3'):
+    # the columns of the local and remote tables are walked concurrently,
+    # then processed in the same order as walking them one at a time
+    walked = conn.walk_many(['1.0.8802.1.1.2.1.3.7.1.3',
+                             '1.0.8802.1.1.2.1.3.7.1.4'])
+    for oidindex in walked['1.0.8802.1.1.2.1.3.7.1.3']:
         idx = oidindex[0][-1]
         idxtoportid[idx] = sanitize(oidindex[1])
-    for oidindex in conn.walk('1.0.8802.1.1.2.1.3.7.1.4'):
+    for oidindex in walked['1.0.8802.1.1.2.1.3.7.1.4']:
         idx = oidindex[0][-1]
         idxtoifname[idx] = _lldpdesc_to_ifname(sid, idx, str(oidindex[1]))
-    for remotedesc in conn.walk('1.0.8802.1.1.2.1.4.1.1.10'):
+    walked = conn.walk_many(['1.0.8802.1.1.2.1.4.1.1.10',
+                             '1.0.8802.1.1.2.1.4.1.1.9',
+                             '1.0.8802.1.1.2.1.4.1.1.7',
+                             '1.0.8802.1.1.2.1.4.1.1.5'])
+    for remotedesc in walked['1.0.8802.1.1.2.1.4.1.1.10']:
         iname = idxtoifname.get(remotedesc[0][-2],
                                 idxtoportid.get(remotedesc[0][-2], None))
         if iname is None:
             continue
         _init_lldp(lldpdata, iname, remotedesc[0][-2], idxtoportid, switch)
         _extract_extended_desc(lldpdata[iname], remotedesc[1], user)
-    for remotename in conn.walk('1.0.8802.1.1.2.1.4.1.1.9'):
+    for remotename in walked['1.0.8802.1.1.2.1.4.1.1.9']:
         iname = idxtoifname.get(remotename[0][-2],
                                 idxtoportid.get(remotename[0][-2], None))
         if iname is None:
             continue
         _init_lldp(lldpdata, iname, remotename[0][-2], idxtoportid, switch)
         lldpdata[iname]['peername'] = str(remotename[1])
-    for remotename in conn.walk('1.0.8802.1.1.2.1.4.1.1.7'):
+    for remotename in walked['1.0.8802.1.1.2.1.4.1.1.7']:
         iname = idxtoifname.get(remotename[0][-2],
                                 idxtoportid.get(remotename[0][-2], None))
         if iname is None:
             continue
         _init_lldp(lldpdata, iname, remotename[0][-2], idxtoportid, switch)
         lldpdata[iname]['peerportid'] = sanitize(remotename[1])
-    for remoteid in conn.walk('1.0.8802.1.1.2.1.4.1.1.5'):
+    for remoteid in walked['1.0.8802.1.1.2.1.4.1.1.5']:
         iname = idxtoifname.get(remoteid[0][-2],
                                 idxtoportid.get(remoteid[0][-2], None))
         if iname is None:
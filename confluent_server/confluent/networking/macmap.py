@@ -67,6 +67,10 @@ _apimacmap = {}
 _macsbyswitch = {}
 _nodesbymac = {}
 _switchportmap = {}
+# when each switch was last walked and how long to wait before walking it
+# again, in proportion to how long that switch takes to walk
+_switchvintage = {}
+_switchbackoff = {}
 _offloadevts = {}
 _offloader = None
 vintage = None
@@ -119,8 +123,14 @@ def _namesmatch(switchdesc, userdesc):
     return False
 
 def _map_switch(args):
+    """Walk a switch, returning its name, macs by port and walk duration
+
+    The macs by port are None if the switch could not be walked.
+    """
+    start = util.monotonic_time()
+    macs = None
     try:
-        return _map_switch_backend(args)
+        macs = _map_switch_backend(args)
     except (UnicodeError, socket.gaierror):
         log.log({'error': "Cannot resolve switch '{0}' to an address".format(
             args[0])})
@@ -135,6 +145,7 @@ def _map_switch(args):
         log.log({'error': 'Unexpected condition trying to reach switch "{0}"'
                           ' check trace log for more'.format(args[0])})
         log.logtrace()
+    return args[0], macs, util.monotonic_time() - start
 
 
 def _nodelookup(switch, ifname):
@@ -156,34 +167,8 @@ def _affluent_map_switch(args):
     macs, retcode = wc.grab_json_response_with_status('/affluent/macs/by-port')
     if retcode != 200:
         raise Exception("No affluent detected")
-    _macsbyswitch[switch] = macs
+    return macs
 
-    for iface in macs:
-        nummacs = len(macs[iface])
-        for mac in macs[iface]:
-            if mac in _macmap:
-                _macmap[mac].append((switch, iface, nummacs))
-            else:
-                _macmap[mac] = [(switch, iface, nummacs)]
-            nodename = _nodelookup(switch, iface)
-            if nodename is not None:
-                if mac in _nodesbymac and _nodesbymac[mac][0] != nodename:
-                    # For example, listed on both a real edge port
-                    # and by accident a trunk port
-                    onummacs = _nodesbymac[mac][1]
-                    onode = _nodesbymac[mac][0]
-                    if onode:
-                        errstr = 'Mac address {2} may match either {0} or {1} according to net.*switch* attributes.'.format(nodename, onode, mac)
-                        if onummacs > 2 or nummacs > 2:
-                            errstr += ' ({0} may match a switch trunk)'.format(nodename if nummacs > onummacs else onode)
-                    else:
-                        errstr = 'Mac address {1} may match either {0} or a node previously reported as ambiguous according to net.*switch* attributes.'.format(nodename, mac)
-                        if nummacs > 2:
-                            errstr += ' ({0} may match a switch trunk)'.format(nodename)
-                    log.log({'error': errstr})
-                    _nodesbymac[mac] = (None, None)
-                else:
-                    _nodesbymac[mac] = (nodename, nummacs)
 
 def _offload_map_switch(switch, password, user):
     if _offloader is None:
@@ -252,7 +237,6 @@ def _map_switch_backend(args):
     #  .1.3.6.1.2.1.2.2.1.2 - ifDescr, usually useless, but a
     #   fallback if ifName is empty
     #
-    global _macmap
     if len(args) == 4:
         switch, password, user, _ = args  # 4th arg is for affluent only
         if not user:
@@ -309,22 +293,56 @@ def _map_switch_backend(args):
             ifname = ifnamemap[bridgetoifmap[mactobridge[mac]]]
         except KeyError:
             continue
-        if mac in _macmap:
-            _macmap[mac].append((switch, ifname, maccounts[ifname]))
-        else:
-            _macmap[mac] = [(switch, ifname, maccounts[ifname])]
         if ifname in newmacs:
             newmacs[ifname].append(mac)
         else:
             newmacs[ifname] = [mac]
-        nodename = _nodelookup(switch, ifname)
-        if nodename is not None:
-            if mac in _nodesbymac and _nodesbymac[mac][0] != nodename:
+    return newmacs
+
+
+def _merge_switch_macs(switch, newmacs):
+    """Replace the contribution of one switch to the mac maps
+
+    :param switch: The switch that was walked
+    :param newmacs: Dictionary of port names to mac lists, or None to
+                    forget the switch
+    """
+    affected = set([])
+    for ifname in _macsbyswitch.get(switch, {}):
+        affected.update(_macsbyswitch[switch][ifname])
+    for mac in affected:
+        locations = [x for x in _macmap.get(mac, ()) if x[0] != switch]
+        if locations:
+            _macmap[mac] = locations
+        else:
+            _macmap.pop(mac, None)
+    if newmacs is None:
+        _macsbyswitch.pop(switch, None)
+    else:
+        _macsbyswitch[switch] = newmacs
+        for ifname in newmacs:
+            nummacs = len(newmacs[ifname])
+            for mac in newmacs[ifname]:
+                if mac in _macmap:
+                    _macmap[mac].append((switch, ifname, nummacs))
+                else:
+                    _macmap[mac] = [(switch, ifname, nummacs)]
+                affected.add(mac)
+    _update_nodesbymac(affected)
+
+
+def _update_nodesbymac(macs):
+    """Reevaluate which node, if any, each of the given macs belongs to"""
+    for mac in macs:
+        nodeinfo = None
+        for switch, ifname, nummacs in _macmap.get(mac, ()):
+            nodename = _nodelookup(switch, ifname)
+            if nodename is None:
+                continue
+            if nodeinfo is not None and nodeinfo[0] != nodename:
                 # For example, listed on both a real edge port
                 # and by accident a trunk port
-                nummacs = maccounts[ifname]
-                onummacs = _nodesbymac[mac][1]
-                onode = _nodesbymac[mac][0]
+                onode, onummacs = nodeinfo
                 if onode:
                     errstr = 'Mac address {2} may match either {0} or {1} according to net.*switch* attributes.'.format(nodename, onode, mac)
                     if onummacs > 2 or nummacs > 2:
@@ -334,11 +352,14 @@ def _map_switch_backend(args):
                     if nummacs > 2:
                         errstr += ' ({0} may match a link between switches)'.format(nodename)
                 log.log({'error': errstr})
-                
-                _nodesbymac[mac] = (None, None)
+                nodeinfo = (None, None)
             else:
-                _nodesbymac[mac] = (nodename, maccounts[ifname])
-    _macsbyswitch[switch] = newmacs
+                nodeinfo = (nodename, nummacs)
+        if nodeinfo is None:
+            _nodesbymac.pop(mac, None)
+        else:
+            _nodesbymac[mac] = nodeinfo
+
 
 def _snmp_map_switch_relay(rqid, switch, password, user):
     try:
@@ -368,28 +389,35 @@ def _snmp_map_switch(switch, password, user):
     haveqbridge = False
     mactobridge = {}
     conn = snmp.Session(switch, password, user)
-    ifnamemap = get_portnamemap(conn)
-    for vb in conn.walk('1.3.6.1.2.1.17.7.1.2.2.1.2'):
-        haveqbridge = True
-        oid, bridgeport = vb
-        if not bridgeport:
-            continue
-        oid = str(oid).rsplit('.', 6)
-        # if 7, then oid[1] would be vlan id
-        macaddr = '{0:02x}:{1:02x}:{2:02x}:{3:02x}:{4:02x}:{5:02x}'.format(
-            *([int(x) for x in oid[-6:]])
-        )
-        mactobridge[macaddr] = int(bridgeport)
-    if not haveqbridge:
-        for vb in conn.walk('1.3.6.1.2.1.17.4.3.1.2'):
+    # interface names are walked alongside the forwarding database
+    namewalk = eventlet.spawn(get_portnamemap, conn)
+    try:
+        for vb in conn.walk('1.3.6.1.2.1.17.7.1.2.2.1.2'):
+            haveqbridge = True
             oid, bridgeport = vb
             if not bridgeport:
                 continue
             oid = str(oid).rsplit('.', 6)
+            # if 7, then oid[1] would be vlan id
             macaddr = '{0:02x}:{1:02x}:{2:02x}:{3:02x}:{4:02x}:{5:02x}'.format(
                 *([int(x) for x in oid[-6:]])
             )
             mactobridge[macaddr] = int(bridgeport)
+        if not haveqbridge:
+            for vb in conn.walk('1.3.6.1.2.1.17.4.3.1.2'):
+                oid, bridgeport = vb
+                if not bridgeport:
+                    continue
+                oid = str(oid).rsplit('.', 6)
+                macaddr = '{0:02x}:{1:02x}:{2:02x}:{3:02x}:{4:02x}:{5:02x}'.format(
+                    *([int(x) for x in oid[-6:]])
+                )
+                mactobridge[macaddr] = int(bridgeport)
+    except Exception:
+        # nothing will wait on the interface names now
+        namewalk.kill()
+        raise
+    ifnamemap = namewalk.wait()
     vlanstocheck = set([])
     try:
         #ciscoiftovlanmap = {}
@@ -404,28 +432,38 @@ def _snmp_map_switch(switch, password, user):
         eventlet.sleep(8)
     if not vlanstocheck:
         vlanstocheck.add(None)
-    bridgetoifmap = {}
-    for vlan in vlanstocheck:
+    if not user and not isinstance(password, str):
+        password = password.decode('utf8')
+
+    def _walk_bridgeports(vlan):
+        vconn = conn
         if vlan:
             if user:
-                conn = snmp.Session(switch, password, user, 'vlan-{}'.format(vlan))
+                vconn = snmp.Session(switch, password, user, 'vlan-{}'.format(vlan))
             else:
-                if not isinstance(password, str):
-                    password = password.decode('utf8')
-                conn = snmp.Session(switch, '{}@{}'.format(password, vlan))
-        for vb in conn.walk('1.3.6.1.2.1.17.1.4.1.2'):
+                vconn = snmp.Session(switch, '{}@{}'.format(password, vlan))
+        vlanbridgetoifmap = {}
+        for vb in vconn.walk('1.3.6.1.2.1.17.1.4.1.2'):
             bridgeport, ifidx = vb
             bridgeport = int(str(bridgeport).rsplit('.', 1)[1])
             try:
-                bridgetoifmap[bridgeport] = int(ifidx)
+                vlanbridgetoifmap[bridgeport] = int(ifidx)
             except ValueError:
                 # ifidx might be '', skip in such a case
                 continue
+        return vlanbridgetoifmap
+    bridgetoifmap = {}
+    # walk the per vlan bridge tables concurrently, merging in the same
+    # order as a serial walk would
+    for vlanbridgetoifmap in GreenPool(_vlanwalkers).imap(_walk_bridgeports,
+                                                         vlanstocheck):
+        bridgetoifmap.update(vlanbridgetoifmap)
     #OFFLOAD: end of need to offload?
     return mactobridge,ifnamemap,bridgetoifmap
 
 
 switchbackoff = 30
+_vlanwalkers = 16
 
 
 def find_nodeinfo_by_mac(mac, configmanager):
@@ -447,13 +485,27 @@ def find_nodeinfo_by_mac(mac, configmanager):
 mapupdating = eventlet.semaphore.Semaphore()
 
 
-def update_macmap(configmanager, impatient=False):
+def invalidate_macmap():
+    """Consider the data of every switch out of date
+
+    The next lookup of an unknown mac walks all switches again, rather than
+    waiting for the backoff of each switch to pass.
+    """
+    global vintage
+    vintage = 0
+    _switchvintage.clear()
+    _switchbackoff.clear()
+
+
+def update_macmap(configmanager, impatient=False, rescanall=False):
     """Interrogate switches to build/update mac table
 
-    Begin a rebuild process.  This process is a generator that will yield
+    Begin an update process.  This process is a generator that will yield
     as each switch interrogation completes, allowing a caller to
     recheck the cache as results become possible, rather
     than having to wait for the process to complete to interrogate.
+    Only switches whose data is older than their backoff are walked,
+    unless rescanall is requested.
     """
     if mapupdating.locked():
         while mapupdating.locked():
@@ -462,7 +514,7 @@ def update_macmap(configmanager, impatient=False):
         return
     if impatient:
         return
-    completions = _full_updatemacmap(configmanager)
+    completions = _full_updatemacmap(configmanager, rescanall)
     for completion in completions:
         try:
             yield completion
@@ -478,28 +530,21 @@ def _finish_update(completions):
         pass
 
 
-def _full_updatemacmap(configmanager):
+def _full_updatemacmap(configmanager, rescanall=False):
     global vintage
     global _apimacmap
-    global _macmap
-    global _nodesbymac
     global _switchportmap
-    global _macsbyswitch
     global switchbackoff
-    start = util.monotonic_time()
     with mapupdating:
         vintage = util.monotonic_time()
-        # Clear all existing entries
-        _macmap = {}
-        _nodesbymac = {}
-        _switchportmap = {}
         if configmanager.tenant is not None:
             raise exc.ForbiddenRequest(
                 'Network topology not available to tenants')
         # here's a list of switches... need to add nodes that are switches
-        nodelocations = configmanager.get_node_attributes(
+        nodelocations = configmanager.get_node_attributes_bulk(
             configmanager.list_nodes(), ('type', 'net*.switch', 'net*.switchport'))
         switches = set([])
+        switchportmap = {}
         for node in nodelocations:
             cfg = nodelocations[node]
             if cfg.get('type', {}).get('value', None) == 'switch':
@@ -516,11 +561,11 @@ def _full_updatemacmap(configmanager):
                     portname = cfg[switchportattr].get('value', '')
                     if not portname:
                         continue
-                    if curswitch not in _switchportmap:
-                        _switchportmap[curswitch] = {}
-                    if (portname in _switchportmap[curswitch] and
-                            _switchportmap[curswitch][portname] != node):
-                        if _switchportmap[curswitch][portname] is None:
+                    if curswitch not in switchportmap:
+                        switchportmap[curswitch] = {}
+                    if (portname in switchportmap[curswitch] and
+                            switchportmap[curswitch][portname] != node):
+                        if switchportmap[curswitch][portname] is None:
                             errstr = ('Duplicate switch attributes for {0} and '
                                       'a previously logged duplicate'.format(
                                          node))
@@ -528,28 +573,49 @@ def _full_updatemacmap(configmanager):
                             errstr = ('Duplicate switch topology config '
                                       'for {0} and {1}'.format(
                                                 node,
-                                            _switchportmap[curswitch][
+                                            switchportmap[curswitch][
                                                 portname]))
                         log.log({'error': errstr})
-                        _switchportmap[curswitch][portname] = None
+                        switchportmap[curswitch][portname] = None
                     else:
-                        _switchportmap[curswitch][portname] = node
+                        switchportmap[curswitch][portname] = node
+        # node to port assignments may have changed without the switch
+        # data changing, reevaluate the macs of any such switch
+        changedswitches = set(switchportmap) | set(_switchportmap)
+        changedswitches = [x for x in changedswitches if
+                           switchportmap.get(x) != _switchportmap.get(x)]
+        _switchportmap = switchportmap
+        for switch in changedswitches:
+            macs = set([])
+            for ifname in _macsbyswitch.get(switch, {}):
+                macs.update(_macsbyswitch[switch][ifname])
+            _update_nodesbymac(macs)
         for switch in list(_macsbyswitch):
             if switch not in switches:
-                del _macsbyswitch[switch]
+                _merge_switch_macs(switch, None)
+        for switch in list(_switchvintage):
+            if switch not in switches:
+                del _switchvintage[switch]
+                del _switchbackoff[switch]
+        now = util.monotonic_time()
+        if not rescanall:
+            switches = [x for x in switches if x not in _switchvintage or
+                        now - _switchvintage[x] >= _switchbackoff[x]]
         switchauth = get_switchcreds(configmanager, switches)
         pool = GreenPool(64)
-        for ans in pool.imap(_map_switch, switchauth):
+        for switch, macs, duration in pool.imap(_map_switch, switchauth):
+            _merge_switch_macs(switch, macs)
             vintage = util.monotonic_time()
-            yield ans
+            _switchvintage[switch] = vintage
+            # wait 15 times as long as it takes to walk
+            # avoid spending a large portion of the time hitting switches
+            # with snmp requests
+            _switchbackoff[switch] = max(30, duration * 15)
+            yield switch
     _apimacmap = _macmap
-    endtime = util.monotonic_time()
-    duration = endtime - start
-    duration = duration * 15  # wait 15 times as long as it takes to walk
-    # avoid spending a large portion of the time hitting switches with snmp
-    # requests
-    if duration > switchbackoff:
-        switchbackoff = duration
+    # do not consider another update until some switch could be due
+    if _switchbackoff:
+        switchbackoff = min(_switchbackoff.values())
 
 
 def _dump_locations(info, macaddr, nodename=None):
@@ -686,7 +752,7 @@ def dump_macinfo(macaddr):
 
 
 def rescan(cfg):
-    for _ in update_macmap(cfg):
+    for _ in update_macmap(cfg, rescanall=True):
         pass
 
 
@@ -20,6 +20,7 @@
 # the middle of strings and use of @ for anything is not in their syntax
 
 
+import collections
 import copy
 import itertools
 import pyparsing as pp
@@ -46,6 +47,39 @@ numregex = re.compile('([0-9]+)')
 
 lastnoderange = None
 
+# Parsed noderange expressions are shared across tenants, while the
+# resulting node sets are kept per tenant and checked against the
+# configuration change generation of the attributes they depended on
+_cachesize = 1024
+_parsecache = collections.OrderedDict()
+_resultcache = {}
+_cachestats = {'parsehits': 0, 'parsemisses': 0, 'hits': 0, 'misses': 0}
+
+
+def get_cache_stats():
+    """Return noderange cache statistics"""
+    stats = dict(_cachestats)
+    stats['parsecached'] = len(_parsecache)
+    stats['cached'] = sum([len(x) for x in _resultcache.values()])
+    return stats
+
+
+def _parse(noderange):
+    try:
+        elements = _parsecache.pop(noderange)
+        _cachestats['parsehits'] += 1
+    except KeyError:
+        _cachestats['parsemisses'] += 1
+        try:
+            elements = _parser.parseString(
+                "(" + noderange + ")", parseAll=True).asList()[0]
+        except pp.ParseException as pe:
+            raise Exception("Invalid syntax")
+        if len(_parsecache) >= _cachesize:
+            _parsecache.popitem(last=False)
+    _parsecache[noderange] = elements
+    return elements
+
 def humanify_nodename(nodename):
     """Analyzes nodename in a human way to enable natural sort
 
@@ -106,10 +140,10 @@ class NodeRange(object):
         self.endpage = None
         self.cfm = config
         self.purenumeric = purenumeric
-        try:
-            elements = _parser.parseString("(" + noderange + ")", parseAll=True).asList()[0]
-        except pp.ParseException as pe:
-            raise Exception("Invalid syntax")
+        self._attribdeps = set([])
+        if self.cfm is not None and self._from_cache(noderange):
+            return
+        elements = _parse(noderange)
         if noderange[0] in ('<', '>'):
             # pagination across all nodes
             self._evaluate(elements)
@@ -117,6 +151,37 @@ class NodeRange(object):
         else:
             self._noderange = self._evaluate(elements)
         lastnoderange = {noderange: set(self._noderange)}
+        if self.cfm is not None:
+            self._to_cache(noderange)
+
+    def _from_cache(self, noderange):
+        global lastnoderange
+        cache = _resultcache.get(self.cfm.tenant, None)
+        if not cache or noderange not in cache:
+            _cachestats['misses'] += 1
+            return False
+        gen, attribdeps, nodes, beginpage, endpage = cache.pop(noderange)
+        if gen != self.cfm.get_change_generation(attribdeps):
+            _cachestats['misses'] += 1
+            return False
+        cache[noderange] = (gen, attribdeps, nodes, beginpage, endpage)
+        _cachestats['hits'] += 1
+        self._noderange = set(nodes)
+        self._attribdeps = set(attribdeps)
+        self.beginpage = beginpage
+        self.endpage = endpage
+        lastnoderange = {noderange: set(nodes)}
+        return True
+
+    def _to_cache(self, noderange):
+        cache = _resultcache.setdefault(self.cfm.tenant,
+                                        collections.OrderedDict())
+        if len(cache) >= _cachesize:
+            cache.popitem(last=False)
+        attribdeps = tuple(self._attribdeps)
+        cache[noderange] = (self.cfm.get_change_generation(attribdeps),
+                            attribdeps, frozenset(self._noderange),
+                            self.beginpage, self.endpage)
 
     @property
     def nodes(self):
@@ -222,8 +287,9 @@ class NodeRange(object):
             grpcfg = self.cfm.get_nodegroup_attributes(entname)
             nodes = copy.copy(grpcfg['nodes'])
             if 'noderange' in grpcfg and grpcfg['noderange']:
-                nodes |= NodeRange(
-                    grpcfg['noderange']['value'], self.cfm).nodes
+                subrange = NodeRange(grpcfg['noderange']['value'], self.cfm)
+                self._attribdeps |= subrange._attribdeps
+                nodes |= subrange.nodes
             return nodes
         raise Exception('Unknown node ' + entname)
         
@@ -239,6 +305,7 @@ class NodeRange(object):
             element = ''.join(element)
             if self.cfm is None:
                 raise Exception('Verification configmanager required')
+            self._attribdeps.add(re.split('[=!]', element, 1)[0])
             return set(self.cfm.filter_node_attributes(element, filternodes))
         for idx in range(len(element)):
             if element[idx][0] == '[':
@@ -258,8 +325,10 @@ class NodeRange(object):
                 grpcfg = self.cfm.get_nodegroup_attributes(element)
                 nodes = copy.copy(grpcfg['nodes'])
                 if 'noderange' in grpcfg and grpcfg['noderange']:
-                    nodes |= NodeRange(
-                        grpcfg['noderange']['value'], self.cfm).nodes
+                    subrange = NodeRange(grpcfg['noderange']['value'],
+                                         self.cfm)
+                    self._attribdeps |= subrange._attribdeps
+                    nodes |= subrange.nodes
                 return nodes
         if ':' in element:  # : range for less ambiguity
             return self.expandrange(element, ':')
@@ -4,7 +4,12 @@ import confluent.messages as msg
 import eventlet
 import eventlet.green.select as select
 import eventlet.green.subprocess as subprocess
+import eventlet.greenpool
+import eventlet.semaphore
+import eventlet.tpool
+import confluent.config.conf as conf
 import glob
+import json
 import logging
 logging.getLogger('libarchive').addHandler(logging.NullHandler())
 import libarchive
@@ -12,8 +17,13 @@ import hashlib
 import os
 import shutil
 import sys
+import threading
 import time
 import yaml
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 COPY = 1
 EXTRACT = 2
@@ -31,7 +41,8 @@ HASHPRINTS = {
     '69d5f1c5e4474d70b0fb5374bfcb29bf57ba828ff00a55237cd757e61ed71048': {'name': 'cumulus-broadcom-amd64-4.0.0', 'method': COPY},
 }
 
-from ctypes import byref, c_longlong, c_size_t, c_void_p
+from ctypes import (
+    byref, c_longlong, c_size_t, c_void_p, create_string_buffer, memmove)
 
 from libarchive.ffi import (
     write_disk_new, write_disk_set_options, write_free, write_header,
@@ -186,6 +197,75 @@ def update_boot_linux(profiledir, profile, label):
          '{0}/boot.img'.format(profiledir), profname], preexec_fn=relax_umask)
 
 
+# extracted data is written in chunks of this size, with this many chunks
+# allowed to wait on the writer
+extractchunk = 4194304
+extractdepth = 4
+
+
+class _DataWriter(object):
+    """Write extracted data from a thread of its own
+
+    The archive is read, and the next data decompressed, while the last is
+    being written.  Data of an entry is gathered into large chunks so that
+    it is written with fewer, larger writes.
+    """
+
+    def __init__(self, write_p):
+        self.write_p = write_p
+        self.pending = queue.Queue(extractdepth)
+        self.error = None
+        self.chunk = None
+        self.used = 0
+        self.offset = 0
+        self.thread = threading.Thread(target=self._write_chunks)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _write_chunks(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    chunk, used, offset = item
+                    write_data_block(self.write_p, chunk, used, offset)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.pending.task_done()
+
+    def _send(self):
+        if self.used:
+            self.pending.put((self.chunk, self.used, self.offset))
+        self.chunk = None
+        self.used = 0
+
+    def add(self, buff, size, offset):
+        # the block is only valid until the next read, so copy it out
+        if self.chunk is not None and (
+                offset != self.offset + self.used or
+                self.used + size > len(self.chunk)):
+            self._send()
+        if self.chunk is None:
+            self.chunk = create_string_buffer(max(size, extractchunk))
+            self.offset = offset
+        memmove(byref(self.chunk, self.used), buff, size)
+        self.used += size
+
+    def flush(self):
+        """Wait for all data added so far to be written"""
+        self._send()
+        self.pending.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+
 def extract_entries(entries, flags=0, callback=None, totalsize=None, extractlist=None):
     """Extracts the given archive entries into the current directory.
     """
@@ -194,28 +274,33 @@ def extract_entries(entries, flags=0, callback=None, totalsize=None, extractlist
     sizedone = 0
     printat = 0
     with libarchive.extract.new_archive_write_disk(flags) as write_p:
-        for entry in entries:
-            if str(entry).endswith('TRANS.TBL'):
-                continue
-            if extractlist and str(entry).lower() not in extractlist:
-                continue
-            write_header(write_p, entry._entry_p)
-            read_p = entry._archive_p
-            while 1:
-                r = read_data_block(read_p, buff_p, size_p, offset_p)
-                sizedone += size.value
-                if callback and time.time() > printat:
-                    callback({'progress': float(sizedone) / float(totalsize)})
-                    printat = time.time() + 0.5
-                if r == ARCHIVE_EOF:
-                    break
-                write_data_block(write_p, buff, size, offset)
-            write_finish_entry(write_p)
-            if os.path.isdir(str(entry)):
-                # This directory must be world accessible for web server
-                os.chmod(str(entry), 0o755)  # nosec
-            else:
-                os.chmod(str(entry), 0o644)
+        writer = _DataWriter(write_p)
+        try:
+            for entry in entries:
+                if str(entry).endswith('TRANS.TBL'):
+                    continue
+                if extractlist and str(entry).lower() not in extractlist:
+                    continue
+                write_header(write_p, entry._entry_p)
+                read_p = entry._archive_p
+                while 1:
+                    r = read_data_block(read_p, buff_p, size_p, offset_p)
+                    sizedone += size.value
+                    if callback and time.time() > printat:
+                        callback({'progress': float(sizedone) / float(totalsize)})
+                        printat = time.time() + 0.5
+                    if r == ARCHIVE_EOF:
+                        break
+                    writer.add(buff.value, size.value, offset.value)
+                writer.flush()
+                write_finish_entry(write_p)
+                if os.path.isdir(str(entry)):
+                    # This directory must be world accessible for web server
+                    os.chmod(str(entry), 0o755)  # nosec
+                else:
+                    os.chmod(str(entry), 0o644)
+        finally:
+            writer.close()
     if callback:
         callback({'progress': float(sizedone) / float(totalsize)})
     return float(sizedone) / float(totalsize)
@@ -576,12 +661,31 @@ def fingerprint(archive):
                 return imginfo, None, None
 
 
-def import_image(filename, callback, backend=False, mfd=None):
+def copy_range(infd, outfd, offset, count):
+    """Copy up to count bytes from offset of infd to outfd
+
+    The copy is left to the kernel where it can manage, avoiding the trip
+    through userspace.  Returns the number of bytes copied, 0 at the end.
+    """
+    try:
+        return os.copy_file_range(infd, outfd, count, offset)
+    except (AttributeError, OSError):
+        pass
+    try:
+        return os.sendfile(outfd, infd, offset, count)
+    except (AttributeError, OSError):
+        pass
+    os.lseek(infd, offset, 0)
+    return os.write(outfd, os.read(infd, count))
+
+
+def import_image(filename, callback, backend=False, mfd=None, identity=None):
     if mfd:
         archive = os.fdopen(int(mfd), 'rb')
     else:
         archive = open(filename, 'rb')
-    identity = fingerprint(archive)
+    if not identity:
+        identity = fingerprint(archive)
     if not identity:
         return -1
     identity, imginfo, funname = identity
@@ -614,15 +718,16 @@ def import_image(filename, callback, backend=False, mfd=None):
         archive.seek(0, 0)
         printat = 0
         with open(targiso, 'wb') as targ:
-            buf = archive.read(32768)
-            while buf:
-                currsz += len(buf)
+            copied = copy_range(archive.fileno(), targ.fileno(), currsz,
+                                16777216)
+            while copied:
+                currsz += copied
                 pgress = pct + ((float(currsz) / float(totalsz)) * modpct)
                 if time.time() > printat:
                     callback({'progress': pgress})
                     printat = time.time() + 0.5
-                targ.write(buf)
-                buf = archive.read(32768)
+                copied = copy_range(archive.fileno(), targ.fileno(), currsz,
+                                    16777216)
     with open(targpath + '/distinfo.yaml', 'w') as distinfo:
         distinfo.write(yaml.dump(identity, default_flow_style=False))
     if 'subname' in identity:
@@ -661,16 +766,74 @@ def copy_file(src, dst):
     makedirs(newdir, 0o755)
     shutil.copy2(src, dst)
 
-def get_hash(fname):
+# Hashes of files by path, along with the size, times and inode they were
+# computed for, so that unchanged files are not read again.  ctime is part
+# of it since copy2 carries mtime over to a rewritten file.
+_hashcachefile = '/var/lib/confluent/cache/filehashes.json'
+_hashcache = None
+_hashworkers = 8
+
+
+def _load_hash_cache():
+    global _hashcache
+    if _hashcache is None:
+        try:
+            with open(_hashcachefile, 'r') as cachein:
+                _hashcache = json.load(cachein)
+        except (IOError, OSError, ValueError):
+            _hashcache = {}
+    return _hashcache
+
+
+def _save_hash_cache():
+    if not _hashcache:
+        return
+    for fname in list(_hashcache):
+        if not os.path.exists(fname):
+            del _hashcache[fname]
+    try:
+        makedirs(os.path.dirname(_hashcachefile), 0o700)
+        with open(_hashcachefile + '.new', 'w') as cacheout:
+            json.dump(_hashcache, cacheout)
+        os.rename(_hashcachefile + '.new', _hashcachefile)
+    except (IOError, OSError):
+        pass  # the cache is only an optimization
+
+
+def _hash_file(fname):
     currhash = hashlib.sha512()
+    buf = bytearray(1048576)
+    view = memoryview(buf)
     with open(fname, 'rb') as currf:
-        currd = currf.read(2048)
-        while currd:
-            currhash.update(currd)
-            currd = currf.read(2048)
+        currlen = currf.readinto(buf)
+        while currlen:
+            currhash.update(view[:currlen])
+            currlen = currf.readinto(buf)
     return currhash.hexdigest()
 
 
+def get_hash(fname):
+    hashcache = _load_hash_cache()
+    st = os.stat(fname)
+    fileid = [st.st_size, st.st_mtime, st.st_ctime, st.st_ino]
+    cached = hashcache.get(fname, None)
+    if cached and cached[:4] == fileid:
+        return cached[4]
+    # hash in a real thread, so several files may be read at once
+    currhash = eventlet.tpool.execute(_hash_file, fname)
+    hashcache[fname] = fileid + [currhash]
+    return currhash
+
+
+def get_hash_map(fnames):
+    """Hash a list of files, several at a time
+
+    Returns a dict of file names to hashes.
+    """
+    pool = eventlet.greenpool.GreenPool(_hashworkers)
+    return dict(zip(fnames, pool.imap(get_hash, fnames)))
+
+
 def rebase_profile(dirname):
     if dirname.startswith('/var/lib/confluent/public'):
         profiledir = dirname
@@ -707,10 +870,11 @@ def rebase_profile(dirname):
             copy_file(distfilename, newfilename)
             updated.append(updatecandidate)
             newmanifest.append(updatecandidate)
+    newhashes = get_hash_map(
+        [os.path.join(profiledir, nf) for nf in newmanifest])
     for nf in newmanifest:
-        nfname = os.path.join(profiledir, nf)
-        currhash = get_hash(nfname)
-        manifest['disthashes'][nf] = currhash
+        manifest['disthashes'][nf] = newhashes[os.path.join(profiledir, nf)]
+    _save_hash_cache()
     with open('{0}/manifest.yaml'.format(profiledir), 'w') as yout:
             yout.write('# This manifest enables rebase to know original source of profile data and if any customizations have been done\n')
             yout.write(yaml.dump(manifest, default_flow_style=False))
@@ -726,16 +890,19 @@ def rebase_profile(dirname):
     
         
 def get_hashes(dirname):
-    hashmap = {}
+    fullnames = {}
     for dname, _, fnames in os.walk(dirname):
         for fname in fnames:
             if fname == 'profile.yaml':
                 continue
             fullname = os.path.join(dname, fname)
-            currhash = hashlib.sha512()
             subname = fullname.replace(dirname + '/', '')
             if os.path.isfile(fullname):
-                hashmap[subname] = get_hash(fullname)
+                fullnames[subname] = fullname
+    hashes = get_hash_map(list(fullnames.values()))
+    hashmap = {}
+    for subname in fullnames:
+        hashmap[subname] = hashes[fullnames[subname]]
     return hashmap
 
 
@@ -795,12 +962,25 @@ def generate_stock_profiles(defprofile, distpath, targpath, osname,
         profilelist.append(profname)
     for upd in bootupdates:
         upd.wait()
+    _save_hash_cache()
+
+
+_importslots = None
+
+
+def _get_importslots():
+    global _importslots
+    if _importslots is None:
+        _importslots = eventlet.semaphore.Semaphore(
+            conf.get_int_option('deployment', 'max_concurrent_imports') or 2)
+    return _importslots
 
 
 class MediaImporter(object):
 
     def __init__(self, media, cfm=None):
         self.worker = None
+        self.stopped = False
         if not os.path.exists('/var/lib/confluent/public'):
             raise Exception('`osdeploy initialize` must be executed before importing any media')
         self.profiles = []
@@ -819,8 +999,10 @@ class MediaImporter(object):
         if not identity:
             raise exc.InvalidArgumentException('Unsupported Media')
         self.percent = 0.0
+        # handed to the worker, so it need not go over the media again
+        self.identity = identity
         identity, _, _ = identity
-        self.phase = 'copying'
+        self.phase = 'queued'
         if not identity:
             raise Exception('Unrecognized OS Media')
         if 'subname' in identity:
@@ -847,6 +1029,7 @@ class MediaImporter(object):
         self.importer = eventlet.spawn(self.importmedia)
 
     def stop(self):
+        self.stopped = True
         if self.worker and self.worker.poll() is None:
             self.worker.kill()
 
@@ -855,13 +1038,22 @@ class MediaImporter(object):
         return {'phase': self.phase, 'progress': self.percent, 'profiles': self.profiles, 'error': self.error}
 
     def importmedia(self):
+        # imports past the limit wait their turn rather than contend for io
+        with _get_importslots():
+            if self.stopped:
+                return
+            self.phase = 'copying'
+            self._importmedia()
+
+    def _importmedia(self):
         os.environ['PYTHONPATH'] = ':'.join(sys.path)
         if self.medfile:
             os.environ['CONFLUENT_MEDIAFD'] = '{0}'.format(self.medfile.fileno())
-        with open(os.devnull, 'w') as devnull:
-            self.worker = subprocess.Popen(
-                [sys.executable, __file__, self.filename, '-b'],
-                stdin=devnull, stdout=subprocess.PIPE, close_fds=False)
+        self.worker = subprocess.Popen(
+            [sys.executable, __file__, self.filename, '-b'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=False)
+        self.worker.stdin.write(json.dumps(self.identity).encode('utf8'))
+        self.worker.stdin.close()
         wkr = self.worker
         currline = b''
         while wkr.poll() is None:
@@ -927,6 +1119,10 @@ if __name__ == '__main__':
     os.umask(0o022)
     if len(sys.argv) > 2:
         mfd = os.environ.get('CONFLUENT_MEDIAFD', None)
-        sys.exit(import_image(sys.argv[1], callback=printit, backend=True, mfd=mfd))
+        identity = sys.stdin.read()
+        if identity:
+            identity = json.loads(identity)
+        sys.exit(import_image(sys.argv[1], callback=printit, backend=True,
+                              mfd=mfd, identity=identity))
     else:
         sys.exit(import_image(sys.argv[1], callback=printit))
@@ -25,7 +25,6 @@ import eventlet
 import eventlet.event
 import eventlet.green.threading as threading
 import eventlet.greenpool as greenpool
-import eventlet.queue as queue
 import eventlet.support.greendns
 from fnmatch import fnmatch
 import os
@@ -38,6 +37,7 @@ ipmicommand = eventlet.import_patched('pyghmi.ipmi.command')
 import socket
 import ssl
 import traceback
+import weakref
 
 
 if not hasattr(ssl, 'SSLEOFError'):
@@ -123,6 +123,11 @@ sensor_categories = {
 }
 
 
+# Readable SDR sensors of each category, by SDR.  Entries go away with the
+# SDR, when the session to that BMC is gone.
+_sweepplans = weakref.WeakKeyDictionary()
+
+
 class EmptySensor(object):
     def __init__(self, name):
         self.name = name
@@ -132,6 +137,25 @@ class EmptySensor(object):
         self.health = 'ok'
 
 
+def sensor_in_category(category, sensortype):
+    if category == 'all':
+        return True
+    return sensortype in sensor_categories[category]
+
+
+def _get_sweep_plan(sdr, category):
+    plans = _sweepplans.setdefault(sdr, {})
+    if category in plans:
+        return plans[category]
+    sensors = getattr(sdr, 'sensors', {})
+    plan = []
+    for number in sdr.get_sensor_numbers():
+        if sensor_in_category(category, sensors[number].sensor_type):
+            plan.append(sensors[number])
+    plans[category] = plan
+    return plan
+
+
 def hex2bin(hexstring):
     hexvals = hexstring.split(':')
     if len(hexvals) < 2:
@@ -178,6 +202,8 @@ class IpmiCommandWrapper(ipmicommand.Command):
         self.cfm = cfm
         self.node = node
         self.sensormap = {}
+        self.sensormapped = False
+        self._oemsensors = None
         self._inhealth = False
         self._lasthealth = None
         kwargs['keepalive'] = False
@@ -216,6 +242,37 @@ class IpmiCommandWrapper(ipmicommand.Command):
             # then do nothing
             pass
 
+    def sweep_sensors(self, category):
+        """Read all sensors of a category
+
+        SDR sensors are read directly by number in one pass, rather than
+        finding each sensor by name in the SDR for every reading.  Sensors
+        that are not present are given as EmptySensor.
+        """
+        for sensor in _get_sweep_plan(self.init_sdr(), category):
+            rsp = self.raw_command(command=0x2d, netfn=4,
+                                   rslun=sensor.sensor_lun,
+                                   data=(sensor.sensor_number,))
+            if 'error' in rsp:
+                if rsp['code'] == 203:
+                    yield EmptySensor(sensor.name)
+                    continue
+                raise pygexc.IpmiException(rsp['error'], rsp['code'])
+            yield sensor.decode_sensor_reading(self, rsp['data'])
+        self.oem_init()
+        if self._oemsensors is None:
+            self._oemsensors = list(self._oem.get_sensor_descriptions())
+        for sensor in self._oemsensors:
+            if not sensor_in_category(category, sensor['type']):
+                continue
+            try:
+                yield self._oem.get_sensor_reading(sensor['name'])
+            except pygexc.IpmiException as ie:
+                if ie.ipmicode == 203:
+                    yield EmptySensor(sensor['name'])
+                    continue
+                raise
+
     def get_health(self):
         if self._inhealth:
             while self._inhealth:
@@ -381,50 +438,16 @@ class IpmiConsole(conapi.Console):
 
 
 def perform_requests(operator, nodes, element, cfg, inputdata, realop):
-    cryptit = cfg.decrypt
-    cfg.decrypt = True
-    configdata = cfg.get_node_attributes(nodes, _configattributes)
-    cfg.decrypt = cryptit
-    resultdata = queue.LightQueue()
-    livingthreads = set([])
-    numnodes = len(nodes)
-    for node in nodes:
-        livingthreads.add(_ipmiworkers.spawn(
+    configdata = cfg.get_node_attributes_bulk(nodes, _configattributes,
+                                              decrypt=True)
+    resultdata = util.ResultQueue()
+
+    def spawnrequest(node):
+        return _ipmiworkers.spawn(
             perform_request, operator, node, element, configdata, inputdata,
-            cfg, resultdata, realop))
-    while livingthreads:
-        try:
-            bundle = []
-            datum = resultdata.get(timeout=10)
-            while datum:
-                if datum != 'Done':
-                    if isinstance(datum, Exception):
-                        raise datum
-                    if (hasattr(datum, 'kvpairs') and datum.kvpairs and
-                            len(datum.kvpairs) == 1):
-                        bundle.append((list(datum.kvpairs)[0], datum))
-                        numnodes -= 1
-                    else:
-                        yield datum
-                timeout = 0.1 if numnodes else 0.001
-                datum = resultdata.get(timeout=timeout)
-        except queue.Empty:
-            pass
-        finally:
-            for datum in sorted(
-                    bundle, key=lambda x: util.naturalize_string(x[0])):
-                yield datum[1]
-        for t in list(livingthreads):
-            if t.dead:
-                livingthreads.discard(t)
-    try:
-        # drain queue if a thread put something on the queue and died
-        while True:
-            datum = resultdata.get_nowait()
-            if datum != 'Done':
-                yield datum
-    except queue.Empty:
-        pass
+            cfg, resultdata, realop)
+    for datum in util.run_node_requests(nodes, spawnrequest, resultdata):
+        yield datum
 
 
 def perform_request(operator, node, element,
@@ -860,31 +883,22 @@ class IpmiHandler(object):
         for sensor in sensors:
             resourcename = sensor['name']
             self.ipmicmd.sensormap[simplify_name(resourcename)] = resourcename
+        self.ipmicmd.sensormapped = True
 
     def read_sensors(self, sensorname):
         if sensorname == 'all':
-            sensors = self.ipmicmd.get_sensor_descriptions()
             readings = []
-            for sensor in filter(self.match_sensor, sensors):
-                try:
-                    reading = self.ipmicmd.get_sensor_reading(
-                        sensor['name'])
-                except pygexc.IpmiException as ie:
-                    if ie.ipmicode == 203:
-                        self.output.put(msg.SensorReadings([EmptySensor(
-                            sensor['name'])], name=self.node))
-                        continue
-                    raise
+            for reading in self.ipmicmd.sweep_sensors(self.sensorcategory):
                 if hasattr(reading, 'health'):
                     reading.health = _str_health(reading.health)
                 if hasattr(reading, 'unavailable') and reading.unavailable:
-                    self.output.put(msg.SensorReadings([EmptySensor(
-                        reading.name)], name=self.node))
-                    continue
+                    reading = EmptySensor(reading.name)
                 readings.append(reading)
             self.output.put(msg.SensorReadings(readings, name=self.node))
         else:
-            if sensorname not in self.ipmicmd.sensormap:
+            # the sensors of a session do not change, only map them once
+            if (sensorname not in self.ipmicmd.sensormap and
+                    not self.ipmicmd.sensormapped):
                 self.make_sensor_map()
             if sensorname not in self.ipmicmd.sensormap:
                 self.output.put(
@@ -1168,11 +1182,7 @@ class IpmiHandler(object):
             return self.read_sensors(self.element[-1])
 
     def match_sensor(self, sensor):
-        if self.sensorcategory == 'all':
-            return True
-        if sensor['type'] in sensor_categories[self.sensorcategory]:
-            return True
-        return False
+        return sensor_in_category(self.sensorcategory, sensor['type'])
 
     def set_disk(self, name, state):
         scfg = self.ipmicmd.get_storage_configuration()
@@ -23,7 +23,6 @@ import eventlet
 import eventlet.event
 import eventlet.green.threading as threading
 import eventlet.greenpool as greenpool
-import eventlet.queue as queue
 import eventlet.support.greendns
 from fnmatch import fnmatch
 import os
@@ -258,50 +257,16 @@ def _donothing(data):
 
 
 def perform_requests(operator, nodes, element, cfg, inputdata, realop):
-    cryptit = cfg.decrypt
-    cfg.decrypt = True
-    configdata = cfg.get_node_attributes(nodes, _configattributes)
-    cfg.decrypt = cryptit
-    resultdata = queue.LightQueue()
-    livingthreads = set([])
-    numnodes = len(nodes)
-    for node in nodes:
-        livingthreads.add(_ipmiworkers.spawn(
+    configdata = cfg.get_node_attributes_bulk(nodes, _configattributes,
+                                              decrypt=True)
+    resultdata = util.ResultQueue()
+
+    def spawnrequest(node):
+        return _ipmiworkers.spawn(
             perform_request, operator, node, element, configdata, inputdata,
-            cfg, resultdata, realop))
-    while livingthreads:
-        try:
-            bundle = []
-            datum = resultdata.get(timeout=10)
-            while datum:
-                if datum != 'Done':
-                    if isinstance(datum, Exception):
-                        raise datum
-                    if (hasattr(datum, 'kvpairs') and datum.kvpairs and
-                            len(datum.kvpairs) == 1):
-                        bundle.append((list(datum.kvpairs)[0], datum))
-                        numnodes -= 1
-                    else:
-                        yield datum
-                timeout = 0.1 if numnodes else 0.001
-                datum = resultdata.get(timeout=timeout)
-        except queue.Empty:
-            pass
-        finally:
-            for datum in sorted(
-                    bundle, key=lambda x: util.naturalize_string(x[0])):
-                yield datum[1]
-        for t in list(livingthreads):
-            if t.dead:
-                livingthreads.discard(t)
-    try:
-        # drain queue if a thread put something on the queue and died
-        while True:
-            datum = resultdata.get_nowait()
-            if datum != 'Done':
-                yield datum
-    except queue.Empty:
-        pass
+            cfg, resultdata, realop)
+    for datum in util.run_node_requests(nodes, spawnrequest, resultdata):
+        yield datum
 
 
 def perform_request(operator, node, element,
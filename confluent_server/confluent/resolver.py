@@ -0,0 +1,260 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2026 Lenovo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Cached name resolution for deployment paths.  Names are answered from
+# /etc/hosts, then from addresses configured in net.* attributes, then from
+# DNS through the green resolver.  Answers, including failures, are kept for
+# a while, and once expired are still given while a refresh happens in the
+# background, so a slow or unreachable DNS server does not hold up a boot.
+
+import eventlet
+import eventlet.event as event
+import eventlet.green.socket as socket
+import eventlet.support.greendns
+import os
+import time
+
+_dnsgetaddrinfo = eventlet.support.greendns.getaddrinfo
+
+cachettl = 300
+negativettl = 30
+# name -> (expiry, list of (family, address), or a gaierror).  Names are
+# looked up for all families at once, and the answer filtered by the family
+# asked for, so a lookup for one family serves the others.
+_cache = {}
+# names to the node and addresses configured in its net.* attributes, kept
+# until the node is seeded again
+_seeds = {}
+# names seeded from each node
+_seedsbynode = {}
+_inflight = {}
+_hosts = {}
+_hostsmtime = None
+_stats = {'hits': 0, 'stalehits': 0, 'negativehits': 0, 'misses': 0,
+          'hostshits': 0, 'seedhits': 0, 'lookups': 0, 'failures': 0,
+          'lookuptime': 0}
+
+
+def _is_literal(host):
+    for fam in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(fam, host.split('%', 1)[0])
+            return True
+        except (socket.error, ValueError):
+            pass
+    return False
+
+
+def _family_of(addr):
+    if ':' in addr:
+        return socket.AF_INET6
+    return socket.AF_INET
+
+
+def _check_hosts():
+    global _hosts
+    global _hostsmtime
+    try:
+        mtime = os.stat('/etc/hosts').st_mtime
+    except OSError:
+        mtime = None
+    if mtime == _hostsmtime:
+        return
+    hosts = {}
+    if mtime is not None:
+        with open('/etc/hosts') as hostsfile:
+            for line in hostsfile:
+                line = line.split('#', 1)[0].split()
+                if len(line) < 2 or not _is_literal(line[0]):
+                    continue
+                for name in line[1:]:
+                    name = name.lower()
+                    if name not in hosts:
+                        hosts[name] = []
+                    hosts[name].append((_family_of(line[0]), line[0]))
+    _hosts = hosts
+    _hostsmtime = mtime
+
+
+def _filter(addrs, family):
+    if family in (0, socket.AF_UNSPEC):
+        return addrs
+    return [x for x in addrs if x[0] == family]
+
+
+def _addrinfo(addrs, port, family, type, proto, flags):
+    addrinfo = []
+    for fam, addr in addrs:
+        addrinfo.extend(socket.getaddrinfo(
+            addr, port, fam, type, proto, flags | socket.AI_NUMERICHOST))
+    return addrinfo
+
+
+def _lookup(host):
+    started = time.time()
+    _stats['lookups'] += 1
+    try:
+        addrs = []
+        for addr in _dnsgetaddrinfo(host, 0, socket.AF_UNSPEC,
+                                    socket.SOCK_STREAM):
+            curr = (addr[0], addr[-1][0])
+            if curr not in addrs:
+                addrs.append(curr)
+        _cache[host] = (time.time() + cachettl, addrs)
+    except socket.gaierror as e:
+        _stats['failures'] += 1
+        _cache[host] = (time.time() + negativettl, e)
+    except Exception as e:
+        _stats['failures'] += 1
+        _cache[host] = (time.time() + negativettl, socket.gaierror(
+            socket.EAI_AGAIN, str(e)))
+    finally:
+        _stats['lookuptime'] += time.time() - started
+        waiter = _inflight.pop(host, None)
+        if waiter:
+            waiter.send(True)
+
+
+def _resolve(host):
+    cached = _cache.get(host, None)
+    if cached:
+        if cached[0] < time.time() and host not in _inflight:
+            # answer from the stale entry, and refresh it for next time
+            _inflight[host] = event.Event()
+            eventlet.spawn_n(_lookup, host)
+            _stats['stalehits'] += 1
+        elif isinstance(cached[1], Exception):
+            _stats['negativehits'] += 1
+        else:
+            _stats['hits'] += 1
+        return cached[1]
+    _stats['misses'] += 1
+    if host in _inflight:
+        _inflight[host].wait()
+    else:
+        _inflight[host] = event.Event()
+        _lookup(host)
+    return _cache[host][1]
+
+
+def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    """Cached equivalent of socket.getaddrinfo"""
+    if not host or _is_literal(host):
+        return socket.getaddrinfo(host, port, family, type, proto, flags)
+    name = host.lower()
+    _check_hosts()
+    addrs = _filter(_hosts.get(name, ()), family)
+    if addrs:
+        _stats['hostshits'] += 1
+        return _addrinfo(addrs, port, family, type, proto, flags)
+    seeded = _seeds.get(name, None)
+    if seeded:
+        addrs = _filter(seeded[1], family)
+        if addrs:
+            _stats['seedhits'] += 1
+            return _addrinfo(addrs, port, family, type, proto, flags)
+    addrs = _resolve(name)
+    if isinstance(addrs, Exception):
+        raise addrs
+    addrs = _filter(addrs, family)
+    if not addrs:
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+    return _addrinfo(addrs, port, family, type, proto, flags)
+
+
+def seed_from_config(configmanager, nodes):
+    """Learn names and addresses of nodes from their net.* attributes
+
+    The address of a network with hostname set is used for those names,
+    and the address of the default network for the node name.  Names
+    previously seeded from these nodes are forgotten first, so this is
+    also how a deleted node or a removed name is let go of.  Seeds do not
+    expire, nodes are to be seeded again as their attributes change.
+    """
+    nodes = list(nodes)
+    for node in nodes:
+        for name in _seedsbynode.pop(node, ()):
+            if _seeds.get(name, (None,))[0] == node:
+                del _seeds[name]
+    attribs = configmanager.get_node_attributes(
+        nodes, ('net.*ipv4_address', 'net.*ipv6_address', 'net.*hostname'))
+    for node in attribs:
+        seeded = set([])
+        bynet = {}
+        for attrib in attribs[node]:
+            val = attribs[node][attrib].get('value', None)
+            if not val:
+                continue
+            netname, setting = attrib.rsplit('.', 1)
+            if netname not in bynet:
+                bynet[netname] = {}
+            bynet[netname][setting] = val
+        for netname in bynet:
+            names = bynet[netname].get('hostname', '').split()
+            if not names and netname == 'net':
+                names = [node]
+            addrs = []
+            for setting in ('ipv4_address', 'ipv6_address'):
+                addr = bynet[netname].get(setting, '').split('/', 1)[0]
+                if addr and _is_literal(addr):
+                    addrs.append((_family_of(addr), addr))
+            if not addrs:
+                continue
+            for name in names:
+                name = name.lower()
+                _seeds[name] = (node, addrs)
+                seeded.add(name)
+        if seeded:
+            _seedsbynode[node] = seeded
+
+
+def resolve_many(names, family=0):
+    """Resolve many names at once, ahead of their use
+
+    :returns: A dict of name to list of addresses, empty if not resolved
+    """
+    pool = eventlet.GreenPool(64)
+    results = {}
+
+    def resolve_name(name):
+        try:
+            addrs = getaddrinfo(name, 0, family, socket.SOCK_STREAM)
+            return name, [x[-1][0] for x in addrs]
+        except socket.gaierror:
+            return name, []
+    for name, addrs in pool.imap(resolve_name, names):
+        results[name] = addrs
+    return results
+
+
+def prefetch_nodes(configmanager, nodes):
+    """Seed and resolve the names of a set of nodes ahead of their use"""
+    nodes = list(nodes)
+    seed_from_config(configmanager, nodes)
+    return resolve_many(nodes)
+
+
+def get_stats():
+    """Return resolver cache hit, miss and lookup counters"""
+    stats = dict(_stats)
+    lookuptime = stats.pop('lookuptime')
+    stats['avglookupms'] = (lookuptime * 1000 / stats['lookups']
+                            if stats['lookups'] else 0)
+    stats['cached'] = len(_cache)
+    stats['seeded'] = len(_seeds)
+    stats['hostsentries'] = len(_hosts)
+    stats['pending'] = len(_inflight)
+    return stats
@@ -21,17 +21,75 @@
 # patch pysnmp to have it be eventlet friendly has caused it's selection
 # This module simplifies the complex hlapi pysnmp interface
 
+import collections
 import confluent.exceptions as exc
+import confluent.resolver as resolver
 import eventlet
-from eventlet.support.greendns import getaddrinfo
 import pysnmp.smi.error as snmperr
 import socket
 snmp = eventlet.import_patched('pysnmp.hlapi')
 
+# Idle engines by switch and credential.  An engine remembers the discovered
+# engine id and localized USM keys of a switch, so reusing one saves redoing
+# that work for every session, such as one per vlan context.  An engine is
+# only used by one walk at a time.
+_engines = collections.OrderedDict()
+_maxidle = 4
+_maxengineusers = 1024
+# bulk repetitions to ask of each switch for each subtree, sized to fit a
+# response in a packet, and at most as many as a switch last accepted after
+# saying a response would be too big
+_repetitions = {}
+_replimits = {}
+_responsebudget = 1400
+
+
+def _get_engine(key):
+    idle = _engines.get(key, None)
+    if idle:
+        return idle.pop()
+    return snmp.SnmpEngine()
+
+
+def _put_engine(key, eng):
+    if key not in _engines:
+        if len(_engines) >= _maxengineusers:
+            _engines.popitem(last=False)
+        _engines[key] = []
+    if len(_engines[key]) < _maxidle:
+        _engines[key].append(eng)
+
+
+def _varbind_size(ans):
+    # approximate BER size of a varbind
+    size = 6
+    try:
+        arcs = tuple(ans[0].getOid())
+    except Exception:
+        arcs = (0,) * 12
+    for arc in arcs:
+        size += 1
+        while arc > 127:
+            arc >>= 7
+            size += 1
+    try:
+        size += len(ans[1].asOctets())
+    except AttributeError:
+        size += 6
+    return size
+
+
+def _learn_repetitions(key, sizes):
+    if not sizes:
+        return
+    avgsize = sum(sizes) // len(sizes)
+    _repetitions[key] = max(1, min(_replimits.get(key, 64),
+                                   _responsebudget // avgsize))
+
 
 def _get_transport(name):
     # Annoyingly, pysnmp does not automatically determine ipv6 v ipv4
-    res = getaddrinfo(name, 161, 0, socket.SOCK_DGRAM)
+    res = resolver.getaddrinfo(name, 161, 0, socket.SOCK_DGRAM)
     if res[0][0] == socket.AF_INET6:
         return snmp.Udp6TransportTarget(res[0][4], 2)
     else:
@@ -55,6 +113,7 @@ class Session(object):
         """
         self.server = server
         self.context = context
+        self.enginekey = (server, username, secret if username else None)
         if username is None:
             # SNMP v2c
             self.authdata = snmp.CommunityData(secret, mpModel=1)
@@ -62,15 +121,34 @@ class Session(object):
             self.authdata = snmp.UsmUserData(
                 username, authKey=secret, privKey=secret,
                 authProtocol=snmp.usmHMACSHAAuthProtocol)
-        self.eng = snmp.SnmpEngine()
 
-    def walk(self, oid):
+    def walk_many(self, oids):
+        """Walk over children of several OIDs concurrently
+
+        :param oids: The SNMP object identifiers
+        :returns: A dict of each OID to a list of what walk would yield
+        """
+        results = {}
+        if not oids:
+            return results
+        pool = eventlet.GreenPool(len(oids))
+        for oid, answers in pool.imap(
+                lambda x: (x, list(self.walk(x))), oids):
+            results[oid] = answers
+        return results
+
+    def walk(self, oid, maxrepetitions=None):
         """Walk over children of a given OID
 
         This is roughly equivalent to snmpwalk.  It will automatically try to
         be a snmpbulkwalk if possible.
 
         :param oid: The SNMP object identifier
+        :param maxrepetitions: Override how many of the children to ask for
+                               in each request, by default as many as have
+                               been seen to fit in a packet for this switch
+                               and OID.  This is reduced if the switch
+                               reports a response would be too big.
         """
         # SNMP is a complicated mess of things.  Will endeavor to shield caller
         # from as much as possible, assuming reasonable defaults when possible.
@@ -87,32 +165,82 @@ class Session(object):
         else:
             obj = snmp.ObjectType(snmp.ObjectIdentity(oid))
 
-        walking = snmp.bulkCmd(self.eng, self.authdata, tp, ctx, 0, 10, obj,
-                               lexicographicMode=False, lookupMib=resolvemib)
+        repkey = (self.server, oid)
+        if not maxrepetitions:
+            maxrepetitions = _repetitions.get(repkey, 10)
+        eng = _get_engine(self.enginekey)
+        sizes = []
+        reusable = False
+        walking = None
+        start = obj
         try:
-            for rsp in walking:
-                errstr, errnum, erridx, answers = rsp
-                if errstr:
-                    errstr = str(errstr)
-                    finerr = errstr + ' while trying to connect to ' \
-                                      '{0}'.format(self.server)
-                    if errstr in ('Unknown USM user', 'unknownUserName',
-                                  'wrongDigest', 'Wrong SNMP PDU digest'):
-                        raise exc.TargetEndpointBadCredentials(finerr)
-                    # need to do bad credential versus timeout
-                    raise exc.TargetEndpointUnreachable(finerr)
-                elif errnum:
-                    raise exc.ConfluentException(errnum.prettyPrint() +
-                                                 ' while trying to connect to '
-                                                 '{0}'.format(self.server))
-                for ans in answers:
-                    if not obj[0].isPrefixOf(ans[0]):
-                        # PySNMP returns leftovers in a bulk command
-                        # filter out such leftovers
+            while True:
+                # a resumed walk starts from the last OID given, which is
+                # not itself a prefix of the rest, so the end of the subtree
+                # is detected here rather than by pysnmp
+                walking = snmp.bulkCmd(eng, self.authdata, tp, ctx, 0,
+                                       maxrepetitions, start,
+                                       lexicographicMode=start is not obj,
+                                       lookupMib=resolvemib)
+                retry = False
+                for rsp in walking:
+                    errstr, errnum, erridx, answers = rsp
+                    if errstr:
+                        errstr = str(errstr)
+                        finerr = errstr + ' while trying to connect to ' \
+                                          '{0}'.format(self.server)
+                        if errstr in ('Unknown USM user', 'unknownUserName',
+                                      'wrongDigest', 'Wrong SNMP PDU digest'):
+                            raise exc.TargetEndpointBadCredentials(finerr)
+                        # need to do bad credential versus timeout
+                        raise exc.TargetEndpointUnreachable(finerr)
+                    elif errnum:
+                        if str(errnum) == 'tooBig' and maxrepetitions > 1:
+                            # ask for fewer at a time, picking up after the
+                            # last answer given
+                            maxrepetitions = max(1, maxrepetitions // 2)
+                            _replimits[repkey] = maxrepetitions
+                            _repetitions[repkey] = maxrepetitions
+                            retry = True
+                            break
+                        raise exc.ConfluentException(
+                            errnum.prettyPrint() +
+                            ' while trying to connect to '
+                            '{0}'.format(self.server))
+                    ended = False
+                    for ans in answers:
+                        if not obj[0].isPrefixOf(ans[0]):
+                            # PySNMP returns leftovers in a bulk command
+                            # filter out such leftovers
+                            ended = True
+                            break
+                        if len(sizes) < 32:
+                            sizes.append(_varbind_size(ans))
+                        start = ans
+                        yield ans
+                    if ended:
                         break
-                    yield ans
+                walking.close()
+                if not retry:
+                    break
+                if start is not obj:
+                    lastoid = start[0]
+                    if hasattr(lastoid, 'getOid'):
+                        lastoid = lastoid.getOid()
+                    start = snmp.ObjectType(snmp.ObjectIdentity(lastoid))
+            _learn_repetitions(repkey, sizes)
+            reusable = True
         except snmperr.WrongValueError:
             raise exc.TargetEndpointBadCredentials('Invalid SNMPv3 password')
+        except GeneratorExit:
+            reusable = True
+            raise
+        finally:
+            if walking is not None:
+                walking.close()
+            if reusable:
+                # an engine that has seen errors is not kept around
+                _put_engine(self.enginekey, eng)
 
 
 
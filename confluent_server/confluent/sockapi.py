@@ -115,6 +115,20 @@ def send_data(connection, data):
             raise
 
 
+def send_encoded(connection, sdata):
+    """Send json already encoded by a message, header and all at once"""
+    tl = len(sdata)
+    if not tl:
+        return
+    if tl > 16777215:
+        raise Exception("JSON data exceeds protocol limits")
+    try:
+        connection.sendall(struct.pack('!I', tl | 16777216) + sdata)
+    except IOError as ie:
+        if ie.errno != errno.EPIPE:
+            raise
+
+
 def sessionhdl(connection, authname, skipauth=False, cert=None):
     try:
         # For now, trying to test the console stuff, so let's just do n4.
@@ -144,6 +158,9 @@ def sessionhdl(connection, authname, skipauth=False, cert=None):
                 dreq = tlvdata.recvall(connection, response['dispatch']['length'])
                 return pluginapi.handle_dispatch(connection, cert, dreq,
                                                 response['dispatch']['name'])
+            if 'dispatchstream' in response:
+                return pluginapi.handle_dispatch_stream(
+                    connection, cert, response['dispatchstream']['name'])
             if 'proxyconsole' in response:
                 return start_proxy_term(connection, cert, response['proxyconsole'])
             authname = response['username']
@@ -216,8 +233,19 @@ def sessionhdl(connection, authname, skipauth=False, cert=None):
 def send_response(responses, connection):
     if responses is None:
         return
-    for rsp in responses:
-        send_data(connection, rsp.raw())
+    try:
+        for rsp in responses:
+            sdata = None
+            if hasattr(rsp, 'encoded'):
+                sdata = rsp.encoded()
+            if sdata is not None:
+                send_encoded(connection, sdata)
+            else:
+                send_data(connection, rsp.raw())
+    finally:
+        # if the client went away, let the request stop producing results
+        if hasattr(responses, 'close'):
+            responses.close()
     send_data(connection, {'_requestdone': 1})
 
 
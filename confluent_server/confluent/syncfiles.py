@@ -15,13 +15,17 @@
 # limitations under the License.
 
 import glob
+import hashlib
+import json
 import os
 import shutil
 import tempfile
+import confluent.config.conf as conf
 import confluent.sshutil as sshutil
 import confluent.util as util
 import confluent.noderange as noderange
 import eventlet
+import eventlet.semaphore as semaphore
 import pwd
 import grp
 
@@ -165,36 +169,107 @@ class SyncList(object):
                 self.optmap[f] = entopts
 
 
+# The sections staged under a location given by the node, with whether
+# they append to files that already exist
+_suffixedsections = (
+    ('append', 'appendmap', False),
+    ('merge', 'mergemap', True),
+    ('appendonce', 'appendoncemap', True),
+)
+
+# Staged trees in use, by a hash of what went into them.  Nodes with the
+# same sync list output share a tree rather than each staging their own.
+_stagedtrees = {}
+
+
+def _get_staged_tree(sl, locations):
+    """Return the key and directory of a staged tree for a sync list
+
+    locations maps each requested section to where the node wants it.
+    The replace section is staged in 'root', and each distinct location in
+    a directory of its own, so the tree does not depend on the locations
+    themselves.  Also returned is the directory staged for each location.
+    """
+    locationdirs = {'': 'root'}
+    keydata = [list(sl.replacemap.items())]
+    for section, mapname, _ in _suffixedsections:
+        if section in locations:
+            if locations[section] not in locationdirs:
+                locationdirs[locations[section]] = 'location{}'.format(
+                    len(locationdirs))
+            keydata.append([section, locationdirs[locations[section]],
+                            list(getattr(sl, mapname).items())])
+    key = hashlib.sha256(json.dumps(keydata).encode('utf8')).hexdigest()
+    if key in _stagedtrees:
+        _stagedtrees[key][1] += 1
+        return key, _stagedtrees[key][0], locationdirs
+    stagedir = tempfile.mkdtemp('.syncfiles')
+    try:
+        mkdirp(os.path.join(stagedir, 'root'))
+        for ent in sl.replacemap:
+            stage_ent(sl.replacemap, ent, os.path.join(stagedir, 'root'))
+        for section, mapname, appendexist in _suffixedsections:
+            if section not in locations:
+                continue
+            currmap = getattr(sl, mapname)
+            targdir = os.path.join(
+                stagedir, locationdirs[locations[section]])
+            for ent in currmap:
+                stage_ent(currmap, ent, targdir, appendexist)
+    except Exception:
+        shutil.rmtree(stagedir)
+        raise
+    _stagedtrees[key] = [stagedir, 1]
+    return key, stagedir, locationdirs
+
+
+def _release_staged_tree(key):
+    _stagedtrees[key][1] -= 1
+    if not _stagedtrees[key][1]:
+        shutil.rmtree(_stagedtrees.pop(key)[0])
+
+
+_syncslots = None
+
+
+def _get_syncslots():
+    global _syncslots
+    if _syncslots is None:
+        _syncslots = semaphore.Semaphore(
+            conf.get_int_option('deployment', 'max_concurrent_syncfiles')
+            or 64)
+    return _syncslots
+
+
 def sync_list_to_node(sl, node, suffixes, peerip=None):
+    with _get_syncslots():
+        syncstatus[node] = 'syncing'
+        return _sync_list_to_node(sl, node, suffixes, peerip)
+
+
+def _sync_list_to_node(sl, node, suffixes, peerip=None):
+    locations = {}
+    for section, _, _ in _suffixedsections:
+        if section in suffixes:
+            locations[section] = suffixes[section].strip('/')
+    stagekey, stagedir, locationdirs = _get_staged_tree(sl, locations)
+    # the node's own tree only links its locations into the shared tree
     targdir = tempfile.mkdtemp('.syncto{}'.format(node))
     output = ''
     try:
-        for ent in sl.replacemap:
-            stage_ent(sl.replacemap, ent, targdir)
-        if 'append' in suffixes:
-            while suffixes['append'] and suffixes['append'][0] == '/':
-                suffixes['append'] = suffixes['append'][1:]
-            for ent in sl.appendmap:
-                stage_ent(sl.appendmap, ent,
-                          os.path.join(targdir, suffixes['append']))
-        if 'merge' in suffixes:
-            while suffixes['merge'] and suffixes['merge'][0] == '/':
-                suffixes['merge'] = suffixes['merge'][1:]
-            for ent in sl.mergemap:
-                stage_ent(sl.mergemap, ent,
-                          os.path.join(targdir, suffixes['merge']), True)
-        if 'appendonce' in suffixes:
-            while suffixes['appendonce'] and suffixes['appendonce'][0] == '/':
-                suffixes['appendonce'] = suffixes['appendonce'][1:]
-            for ent in sl.appendoncemap:
-                stage_ent(sl.appendoncemap, ent,
-                          os.path.join(targdir, suffixes['appendonce']), True)
+        for location in locationdirs:
+            locationdir = os.path.join(stagedir, locationdirs[location])
+            if location and os.path.isdir(locationdir):
+                locationtarg = os.path.join(targdir, location)
+                mkdirp(os.path.dirname(locationtarg))
+                os.symlink(locationdir, locationtarg)
         sshutil.prep_ssh_key('/etc/confluent/ssh/automation')
         targip = node
         if peerip:
             targip = peerip
         output = util.run(
-            ['rsync', '-rvLD', targdir + '/', 'root@[{}]:/'.format(targip)])[0]
+            ['rsync', '-rvLD', os.path.join(stagedir, 'root') + '/',
+             targdir + '/', 'root@[{}]:/'.format(targip)])[0]
     except Exception as e:
         if 'CalledProcessError' not in repr(e):
             # https://github.com/eventlet/eventlet/issues/413
@@ -202,20 +277,21 @@ def sync_list_to_node(sl, node, suffixes, peerip=None):
             # for this exception, implement a hack workaround
             raise
         unreadablefiles = []
-        for root, dirnames, filenames in os.walk(targdir):
+        for root, dirnames, filenames in os.walk(stagedir):
             for filename in filenames:
                 filename = os.path.join(root, filename)
                 try:
                     with open(filename, 'r') as _:
                         pass
                 except OSError as e:
-                    unreadablefiles.append(filename.replace(targdir, ''))
+                    unreadablefiles.append(filename.replace(stagedir, ''))
         if unreadablefiles:
             raise Exception("Syncing failed due to unreadable files: " + ','.join(unreadablefiles))
         else:
             raise
     finally:
         shutil.rmtree(targdir)
+        _release_staged_tree(stagekey)
     if not isinstance(output, str):
         output = output.decode('utf8')
     retval = {
@@ -279,6 +355,7 @@ def mkpathorlink(source, destination, appendexist=False):
 
 
 syncrunners = {}
+syncstatus = {}
 
 
 def start_syncfiles(nodename, cfg, suffixes, principals=[]):
@@ -309,6 +386,7 @@ def start_syncfiles(nodename, cfg, suffixes, principals=[]):
     sl = SyncList(synclist, nodename, cfg)
     if not (sl.appendmap or sl.mergemap or sl.replacemap or sl.appendoncemap):
         return '200 OK'  # the synclist has no actual entries
+    syncstatus[nodename] = 'queued'
     syncrunners[nodename] = eventlet.spawn(
         sync_list_to_node, sl, nodename, suffixes, peerip)
     return '202 Queued' # backgrounded
@@ -317,7 +395,13 @@ def get_syncresult(nodename):
     if nodename not in syncrunners:
         return ('204 Not Running', '')
     if not syncrunners[nodename].dead:
-        return ('200 OK', '')
-    result = syncrunners[nodename].wait()
-    del syncrunners[nodename]
+        # clients poll without pause, give the sync a moment to finish
+        eventlet.sleep(1)
+    if not syncrunners[nodename].dead:
+        return ('200 OK', {'status': syncstatus.get(nodename, 'queued')})
+    try:
+        result = syncrunners[nodename].wait()
+    finally:
+        del syncrunners[nodename]
+        syncstatus.pop(nodename, None)
     return ('200 OK', result)
@@ -17,6 +17,7 @@
 
 # Various utility functions that do not neatly fit into one category or another
 import base64
+import confluent.config.conf as conf
 import confluent.exceptions as cexc
 import confluent.log as log
 import hashlib
@@ -26,7 +27,10 @@ import re
 import socket
 import ssl
 import struct
+import eventlet
 import eventlet.green.subprocess as subprocess
+import eventlet.queue as queue
+import eventlet.semaphore as semaphore
 
 
 def mkdirp(path):
@@ -235,3 +239,128 @@ def natural_sort(iterable):
     except TypeError:
         # The natural sort attempt failed, fallback to ascii sort
         return sorted(iterable)
+
+
+def get_request_concurrency():
+    """Return how many nodes a single request may work on at once"""
+    return conf.get_int_option('api', 'request_concurrency') or 256
+
+
+def sort_results():
+    """Indicate whether per node results should be delivered sorted
+
+    With result_order set to 'completed', results are delivered as soon as
+    they are available rather than gathered into naturally sorted batches.
+    """
+    return (conf.get_option('api', 'result_order') or 'sorted') == 'sorted'
+
+
+class ResultQueue(object):
+    """Bounded queue carrying results from request workers to a consumer
+
+    Workers block in put while the queue is full, so a slow client slows
+    down the workers rather than having results pile up in memory.  When
+    the consumer is done or goes away, close discards further results so
+    that remaining workers can run to completion without blocking.
+    """
+
+    def __init__(self, maxsize=None):
+        if maxsize is None:
+            maxsize = conf.get_int_option('api', 'result_queue_depth') or 1024
+        self.maxsize = maxsize
+        self.closed = False
+        self._queue = queue.LightQueue(maxsize)
+
+    def put(self, item):
+        if not self.closed:
+            self._queue.put(item)
+
+    def get(self, block=True, timeout=None):
+        return self._queue.get(block, timeout)
+
+    def get_nowait(self):
+        return self._queue.get_nowait()
+
+    def close(self):
+        self.closed = True
+        # wake any worker blocked on a full queue
+        self._queue.resize(None)
+
+
+def spawn_node_requests(nodes, spawnfn, threads, results, concurrency=None):
+    """Start per node work, limiting how much runs at once for a request
+
+    spawnfn is called with each node and returns the green thread doing
+    the work, which is added to threads.  This is meant to run in its own
+    green thread, so that results may be consumed while nodes are waiting
+    their turn.  No further nodes are started once results is closed.
+    """
+    if concurrency is None:
+        concurrency = get_request_concurrency()
+    limit = semaphore.Semaphore(concurrency)
+
+    def _release(thread):
+        limit.release()
+
+    for node in nodes:
+        limit.acquire()
+        if results.closed:
+            limit.release()
+            break
+        thread = spawnfn(node)
+        threads.add(thread)
+        thread.link(_release)
+
+
+def run_node_requests(nodes, spawnfn, results):
+    """Run per node work and yield the results it puts on a ResultQueue
+
+    spawnfn is as for spawn_node_requests.  Workers put 'Done' when
+    finished with a node, and an Exception to abort the request.  Single
+    valued results are gathered and yielded in natural sort order of their
+    key, unless results are to be delivered as they complete.
+    """
+    livingthreads = set([])
+    numnodes = len(nodes)
+    sortresults = sort_results()
+    spawner = eventlet.spawn(spawn_node_requests, nodes, spawnfn,
+                             livingthreads, results)
+    try:
+        while livingthreads or not spawner.dead:
+            try:
+                bundle = []
+                datum = results.get(timeout=10)
+                while datum:
+                    if datum != 'Done':
+                        if isinstance(datum, Exception):
+                            raise datum
+                        if (sortresults and hasattr(datum, 'kvpairs') and
+                                datum.kvpairs and len(datum.kvpairs) == 1):
+                            bundle.append((list(datum.kvpairs)[0], datum))
+                            numnodes -= 1
+                            if len(bundle) >= results.maxsize:
+                                # bound the sort buffer like the queue
+                                break
+                        else:
+                            yield datum
+                    timeout = 0.1 if numnodes else 0.001
+                    datum = results.get(timeout=timeout)
+            except queue.Empty:
+                pass
+            finally:
+                for datum in sorted(
+                        bundle, key=lambda x: naturalize_string(x[0])):
+                    yield datum[1]
+            for t in list(livingthreads):
+                if t.dead:
+                    livingthreads.discard(t)
+        try:
+            # drain queue if a thread put something on the queue and died
+            while True:
+                datum = results.get_nowait()
+                if datum != 'Done':
+                    yield datum
+        except queue.Empty:
+            pass
+    finally:
+        results.close()